@@ -0,0 +1,46 @@
+"""
+Per-document analyses computed once and stored next to the document.
+
+Extracted fields and audit findings depend only on the document text and on
+the extractor / ruleset version, so ingest computes them up front and the
+endpoints serve the stored copies. A stored result whose version tag differs
+from the running code is recomputed on its next request.
+"""
+from typing import Optional
+
+from . import extractors, rules, storage
+
+# kind -> (current version, compute(doc_id, text)); versions are looked up on
+# every call so a ruleset reloaded at runtime makes older results stale
+ANALYZERS = {
+    'fields': (lambda: extractors.EXTRACTOR_VERSION,
+               lambda doc_id, text: extractors.extract_structured_fields(text)),
+    'findings': (rules.ruleset_version, rules.run_audit_rules),
+}
+
+
+def version(kind: str) -> str:
+    return str(ANALYZERS[kind][0]())
+
+
+def analyze(doc_id: str, text: str) -> list:
+    """Runs every analyzer on a document; returns rows for storage.save_analyses()."""
+    return [(doc_id, kind, version(kind), compute(doc_id, text)) for kind, (_, compute) in ANALYZERS.items()]
+
+
+def get(doc_id: str, kind: str, text: Optional[str] = None):
+    """
+    Stored result of `kind` for a document, recomputed and stored again if
+    missing or stale. Returns None if the document does not exist.
+    """
+    current = version(kind)
+    stored = storage.load_analysis(doc_id, kind)
+    if stored is not None and stored[0] == current:
+        return stored[1]
+    if text is None:
+        text = storage.load_text(doc_id)
+        if text is None:
+            return None
+    result = ANALYZERS[kind][1](doc_id, text)
+    storage.save_analyses([(doc_id, kind, current, result)])
+    return result
@@ -0,0 +1,144 @@
+"""
+Portfolio audits: run the audit rules over many documents at once.
+
+Documents whose stored findings match the current ruleset are answered from
+the store. The rest are audited in the shared process pool, under the same
+slots as ingest; each worker reads the text itself, so no text crosses the
+process boundary. Results come
+back in completion order, ready to be written out as NDJSON.
+
+    python -m app.audit --all > findings.ndjson
+    python -m app.audit --filename 'msa-*.pdf' [--ingested-after 1700000000]
+    python -m app.audit <document_id> [<document_id> ...]
+"""
+import argparse
+import fnmatch
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Iterator, List, Optional
+
+from . import pool, rules, storage
+
+# Documents audited concurrently per bulk request
+AUDIT_IN_FLIGHT = int(os.getenv('AUDIT_IN_FLIGHT', str(pool.EXTRACT_WORKERS * 2)))
+
+
+def audit_document(doc_id: str):
+    """Runs in a pool worker: (ruleset version, findings), or None if the document is gone."""
+    text = storage.load_text(doc_id)
+    if text is None:
+        return None
+    findings = rules.run_audit_rules(doc_id, text)
+    return rules.RULESET_VERSION, findings
+
+
+def select_documents(doc_ids: Optional[List[str]] = None, filename: Optional[str] = None,
+                     ingested_after: Optional[float] = None, ingested_before: Optional[float] = None) -> List[str]:
+    """Ids of `doc_ids` (or every document) that pass the optional filename glob and ingest-time bounds."""
+    if doc_ids is not None and filename is None and ingested_after is None and ingested_before is None:
+        return list(doc_ids)
+    wanted = set(doc_ids) if doc_ids is not None else None
+    selected = []
+    for meta in storage.list_doc_metadata():
+        if wanted is not None and meta['id'] not in wanted:
+            continue
+        if filename is not None and not fnmatch.fnmatch(meta['filename'] or '', filename):
+            continue
+        ingested = meta['ingested_at'] or 0
+        if ingested_after is not None and ingested < ingested_after:
+            continue
+        if ingested_before is not None and ingested >= ingested_before:
+            continue
+        selected.append(meta['id'])
+    return selected
+
+
+def iter_audits(doc_ids: List[str]) -> Iterator[dict]:
+    """
+    Yields {'document_id', 'findings', 'cached'} per document as results
+    become available, or {'document_id', 'error'}. Newly computed findings are
+    stored. Closing the generator cancels audits that have not started.
+    """
+    version = rules.ruleset_version()
+    stale = []
+    for doc_id in doc_ids:
+        stored = storage.load_analysis(doc_id, 'findings')
+        if stored is not None and stored[0] == version:
+            yield {'document_id': doc_id, 'findings': stored[1], 'cached': True}
+        else:
+            stale.append(doc_id)
+    if not stale:
+        return
+    pending = {}
+    queued = iter(stale)
+    try:
+        while True:
+            for doc_id in queued:
+                pending[pool.submit_task(audit_document, doc_id)] = doc_id
+                if len(pending) >= AUDIT_IN_FLIGHT:
+                    break
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                doc_id = pending.pop(fut)
+                if fut.cancelled():
+                    # queued in a pool that was restarted after a hung extraction
+                    pending[pool.submit_task(audit_document, doc_id)] = doc_id
+                    continue
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    yield {'document_id': doc_id, 'error': str(e)}
+                    continue
+                if result is None:
+                    yield {'document_id': doc_id, 'error': 'document not found'}
+                    continue
+                ruleset_version, findings = result
+                storage.save_analyses([(doc_id, 'findings', ruleset_version, findings)])
+                yield {'document_id': doc_id, 'findings': findings, 'cached': False}
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+
+def iter_ndjson(doc_ids: List[str]) -> Iterator[str]:
+    """NDJSON lines for iter_audits(), followed by a summary line."""
+    counts = {'documents': 0, 'cached': 0, 'audited': 0, 'errors': 0, 'findings': 0}
+    for item in iter_audits(doc_ids):
+        counts['documents'] += 1
+        if 'error' in item:
+            counts['errors'] += 1
+        else:
+            counts['cached' if item['cached'] else 'audited'] += 1
+            counts['findings'] += len(item['findings'])
+        yield json.dumps(item) + '\n'
+    yield json.dumps({'summary': counts}) + '\n'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('document_ids', nargs='*')
+    parser.add_argument('--all', action='store_true', help='audit every stored document')
+    parser.add_argument('--filename', help='only documents whose filename matches this glob (from all of them '
+                                           'unless ids are given)')
+    parser.add_argument('--ingested-after', type=float, help='unix time')
+    parser.add_argument('--ingested-before', type=float, help='unix time')
+    args = parser.parse_args()
+    filtered = any(v is not None for v in (args.filename, args.ingested_after, args.ingested_before))
+    if not args.all and not args.document_ids and not filtered:
+        parser.error('give document ids, a filter or --all')
+    # NDJSON goes to stdout; log output, including the pool workers', goes to stderr
+    out = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    ids = select_documents(None if args.all or not args.document_ids else args.document_ids, args.filename,
+                           args.ingested_after, args.ingested_before)
+    try:
+        for line in iter_ndjson(ids):
+            out.write(line)
+            out.flush()
+    finally:
+        pool.shutdown()
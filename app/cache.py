@@ -0,0 +1,54 @@
+"""
+Small thread-safe LRU cache with a TTL, used for repeated /ask questions.
+
+Entries are tagged with the index generation they were computed against;
+a lookup under a newer generation is a miss, so ingests never serve stale
+citations and nothing has to be cleared explicitly.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_question(question: str) -> str:
+    """Case, whitespace and trailing punctuation do not change retrieval."""
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+class QueryCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()   # key -> (generation, expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, generation: int):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] != generation or item[1] < time.monotonic():
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[2]
+
+    def put(self, key, generation: int, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = (generation, time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._items)}
@@ -0,0 +1,91 @@
+"""
+Structure-aware chunking.
+
+Extraction keeps PyMuPDF text blocks apart with blank lines and ends every
+page with a form feed (storage.join_pages). The chunker splits the text into
+those blocks, starts a new chunk at every section heading ("12.3 Termination",
+"ARTICLE IV", "SCHEDULE A", all-caps titles) and packs consecutive blocks of
+the same clause into chunks of at most CHUNK_MAX_CHARS. Chunks do not
+overlap; only a block longer than the limit is cut, at sentence ends if it can be.
+"""
+import os
+import re
+
+import numpy as np
+
+CHUNK_MAX_CHARS = int(os.getenv('CHUNK_MAX_CHARS', '1000'))
+# A heading only closes the current chunk once it holds this much text, so
+# runs of tiny numbered items stay together
+CHUNK_MIN_CHARS = int(os.getenv('CHUNK_MIN_CHARS', '200'))
+
+PAGE_BREAK = '\f'
+
+# Numbered ("7.", "12.3 Termination"), "Section 4" / "ARTICLE IV" style, or all-caps title lines
+_HEADING_SRC = (r'[ \t]*(?:\d{1,3}\.(?:\d{1,3}\.?)*[ \t]+[A-Z]'
+                r'|(?i:section|article|clause|schedule|exhibit|annex|appendix)[ \t]+[0-9IVXLC]+\b'
+                r'|[A-Z][A-Z0-9 ,&/()\'-]{3,80}(?:\n|$))')
+_HEADING = re.compile(_HEADING_SRC)
+# Blank lines and page breaks separate blocks; so does a line break before a heading
+_BLOCK_BREAK = re.compile(r'\n[ \t]*\n\s*|\f\s*|\n(?=' + _HEADING_SRC + ')')
+_SENTENCE_END = re.compile(r'[.;:!?]["\')\]]?\s+')
+
+
+def _blocks(text: str):
+    """(start, end) of the non-blank blocks of `text`."""
+    pos = 0
+    for m in _BLOCK_BREAK.finditer(text):
+        if m.start() > pos:
+            yield pos, m.start()
+        pos = m.end()
+    end = len(text.rstrip())
+    if end > pos:
+        yield pos, end
+
+
+def is_heading(text: str, start: int) -> bool:
+    return bool(_HEADING.match(text, start))
+
+
+def _split_long(text: str, start: int, end: int, max_chars: int):
+    """Cut one oversized block at sentence ends, else at whitespace, else hard."""
+    while end - start > max_chars:
+        cut = None
+        for m in _SENTENCE_END.finditer(text, start + max_chars // 2, start + max_chars):
+            cut = m.end()
+        if cut is None:
+            space = text.rfind(' ', start + max_chars // 2, start + max_chars)
+            cut = space + 1 if space != -1 else start + max_chars
+        yield start, cut
+        start = cut
+        while start < end and text[start].isspace():
+            start += 1
+    if end > start:
+        yield start, end
+
+
+def chunk_spans(text: str, max_chars: int = CHUNK_MAX_CHARS, min_chars: int = CHUNK_MIN_CHARS):
+    """(start, end) offsets of clause-aligned, non-overlapping chunks covering the text."""
+    spans = []
+    cur = None
+    for start, end in _blocks(text):
+        heading = is_heading(text, start)
+        if cur is not None:
+            too_long = end - cur[0] > max_chars
+            if too_long or (heading and cur[1] - cur[0] >= min_chars):
+                spans.extend(_split_long(text, cur[0], cur[1], max_chars))
+                cur = None
+        if cur is None:
+            cur = [start, end]
+        else:
+            cur[1] = end
+    if cur is not None:
+        spans.extend(_split_long(text, cur[0], cur[1], max_chars))
+    return spans
+
+
+def page_numbers(text: str, starts) -> np.ndarray:
+    """1-based page of each chunk start, or 0 for all chunks when the text has no page breaks."""
+    breaks = [m.start() for m in re.finditer(PAGE_BREAK, text)]
+    if not breaks:
+        return np.zeros(len(starts), dtype=np.int32)
+    return (np.searchsorted(np.asarray(breaks), np.asarray(starts, dtype=np.int64), side='right') + 1).astype(np.int32)
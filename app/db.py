@@ -1,62 +1,365 @@
+import json
+import os
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-import json
-DB_PATH = Path(__file__).resolve().parent.parent / 'data' / 'contracts.db'
+
+DATA_DIR = Path(os.getenv('DATA_DIR', Path(__file__).resolve().parent.parent / 'data'))
+DB_PATH = Path(os.getenv('DB_PATH', DATA_DIR / 'contracts.db'))
+# Connections kept open and shared by request threads
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+SCHEMA_VERSION = 4
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    filename TEXT,
+    sha256 TEXT,
+    size INTEGER,
+    ingested_at INTEGER,
+    updated_at REAL NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS document_text (
+    id TEXT PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS content_hashes (
+    sha256 TEXT PRIMARY KEY,
+    document_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS embeddings (
+    hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (hash, model)
+);
+CREATE TABLE IF NOT EXISTS analyses (
+    id TEXT NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    version TEXT NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (id, kind)
+);
+CREATE TABLE IF NOT EXISTS contract_fields (
+    id TEXT PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE,
+    version TEXT NOT NULL,
+    governing_law TEXT COLLATE NOCASE,
+    effective_date TEXT,
+    liability_cap REAL,
+    liability_unlimited INTEGER NOT NULL,
+    auto_renewal INTEGER NOT NULL,
+    confidentiality INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS contract_fields_law ON contract_fields(governing_law);
+CREATE INDEX IF NOT EXISTS contract_fields_date ON contract_fields(effective_date);
+CREATE INDEX IF NOT EXISTS contract_fields_cap ON contract_fields(liability_cap);
+CREATE INDEX IF NOT EXISTS contract_fields_renewal ON contract_fields(auto_renewal);
+CREATE TABLE IF NOT EXISTS contract_parties (
+    id TEXT NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    party TEXT NOT NULL COLLATE NOCASE
+);
+CREATE INDEX IF NOT EXISTS contract_parties_id ON contract_parties(id);
+'''
+
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA foreign_keys=ON')
+    return conn
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        # connections must not cross a fork
+        if _pool is None or _pool_pid != os.getpid():
+            init_db()
+            _pool = queue.LifoQueue()
+            for _ in range(DB_POOL_SIZE):
+                _pool.put(None)  # opened lazily on first checkout
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def close_pool():
+    """Close the idle pooled connections, e.g. in a master before it forks; the next checkout reopens them."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        pool, _pool, _pool_pid = _pool, None, None
+    while pool is not None and not pool.empty():
+        conn = pool.get_nowait()
+        if conn is not None:
+            conn.close()
+
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection; `with conn:` inside commits a transaction."""
+    pool = _get_pool()
+    conn = pool.get()
+    try:
+        if conn is None:
+            conn = _connect()
+        yield conn
+    finally:
+        pool.put(conn)
+
 
 def init_db():
+    """Create or upgrade the schema."""
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('''CREATE TABLE IF NOT EXISTS documents (
-        id TEXT PRIMARY KEY,
-        filename TEXT,
-        metadata TEXT,
-        text TEXT
-    )''')
-    conn.commit()
-    conn.close()
+    conn = _connect()
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < SCHEMA_VERSION:
+            with conn:
+                cols = [r[1] for r in conn.execute("PRAGMA table_info(documents)")]
+                if 'text' in cols:
+                    # pre-WAL layout kept text inline with the metadata
+                    conn.execute('ALTER TABLE documents RENAME TO documents_v0')
+                conn.executescript(SCHEMA)
+                if 'text' in cols:
+                    rows = conn.execute('SELECT id, metadata, text FROM documents_v0').fetchall()
+                    _insert(conn, [(r[0], json.loads(r[1] or '{}'), r[2] or '') for r in rows])
+                    conn.execute('DROP TABLE documents_v0')
+                conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+        with conn:
+            # claims of uploads that were still queued when the last process stopped
+            conn.execute('DELETE FROM content_hashes WHERE document_id NOT IN (SELECT id FROM documents)')
+    finally:
+        conn.close()
+
+
+def _insert(conn, rows):
+    now = time.time()
+    conn.executemany(
+        'INSERT OR REPLACE INTO documents(id, filename, sha256, size, ingested_at, updated_at, metadata) '
+        'VALUES (?,?,?,?,?,?,?)',
+        [(doc_id, meta.get('filename'), meta.get('sha256'), meta.get('size'), meta.get('ingested_at'),
+          now, json.dumps(meta)) for doc_id, meta, _ in rows])
+    conn.executemany('INSERT OR REPLACE INTO document_text(id, text) VALUES (?,?)',
+                     [(doc_id, text) for doc_id, _, text in rows])
+    conn.executemany('INSERT OR IGNORE INTO content_hashes(sha256, document_id) VALUES (?,?)',
+                     [(meta['sha256'], doc_id) for doc_id, meta, _ in rows if meta.get('sha256')])
+
 
 def save_document(doc_id, metadata, text):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('INSERT INTO documents(id, filename, metadata, text) VALUES (?,?,?,?)',
-                (doc_id, metadata.get('filename'), json.dumps(metadata), text))
-    conn.commit()
-    conn.close()
+    save_documents([(doc_id, metadata, text)])
+
+
+def save_documents(rows):
+    """Bulk insert of (doc_id, metadata, text) tuples in a single transaction."""
+    with connection() as conn, conn:
+        _insert(conn, rows)
+
 
 def get_document(doc_id):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('SELECT id, filename, metadata, text FROM documents WHERE id=?', (doc_id,))
-    row = cur.fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute(
+            'SELECT d.id, d.metadata, t.text FROM documents d LEFT JOIN document_text t ON t.id = d.id '
+            'WHERE d.id=?', (doc_id,)).fetchone()
     if not row:
         return None
-    return {'id': row[0], 'filename': row[1], 'metadata': json.loads(row[2]), 'text': row[3]}
+    return {'id': row[0], 'metadata': json.loads(row[1]), 'text': row[2] or ''}
+
+
+def document_exists(doc_id):
+    with connection() as conn:
+        return conn.execute('SELECT 1 FROM documents WHERE id=?', (doc_id,)).fetchone() is not None
+
+
+def get_text(doc_id):
+    with connection() as conn:
+        row = conn.execute('SELECT text FROM document_text WHERE id=?', (doc_id,)).fetchone()
+    return row[0] if row else None
+
 
 def list_documents():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('SELECT id, filename FROM documents')
-    rows = cur.fetchall()
-    conn.close()
-    return [{'id': r[0], 'filename': r[1]} for r in rows]
-
-def all_text_chunks(chunk_size=1000, overlap=200):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('SELECT id, text FROM documents')
-    rows = cur.fetchall()
-    conn.close()
-    chunks = []
-    for doc_id, text in rows:
-        if not text:
-            continue
-        n = len(text)
-        i = 0
-        while i < n:
-            start = i
-            end = min(n, i + chunk_size)
-            chunks.append((doc_id, start, end, text[start:end]))
-            i = end - overlap
-    return chunks
+    """Document metadata columns only; text is never loaded."""
+    with connection() as conn:
+        rows = conn.execute(
+            'SELECT id, filename, sha256, size, ingested_at, updated_at FROM documents ORDER BY rowid').fetchall()
+    return [{'id': r[0], 'filename': r[1], 'sha256': r[2], 'size': r[3], 'ingested_at': r[4],
+             'updated_at': r[5]} for r in rows]
+
+
+def document_ids():
+    with connection() as conn:
+        return [r[0] for r in conn.execute('SELECT id FROM documents ORDER BY rowid')]
+
+
+def document_mtimes():
+    with connection() as conn:
+        return dict(conn.execute('SELECT id, updated_at FROM documents'))
+
+
+def count_documents():
+    with connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+
+def claim_content_hash(sha256, doc_id, live=()):
+    """
+    Atomically registers doc_id for sha256 unless taken; returns the owner.
+    A claim whose document was never stored and is not in `live` (still being
+    ingested) is left over from an ingest that was cut short, and is taken over.
+    """
+    with connection() as conn, conn:
+        conn.execute('INSERT OR IGNORE INTO content_hashes(sha256, document_id) VALUES (?,?)', (sha256, doc_id))
+        owner = conn.execute('SELECT document_id FROM content_hashes WHERE sha256=?', (sha256,)).fetchone()[0]
+        if owner != doc_id and owner not in live and not conn.execute(
+                'SELECT 1 FROM documents WHERE id=?', (owner,)).fetchone():
+            conn.execute('UPDATE content_hashes SET document_id=? WHERE sha256=?', (doc_id, sha256))
+            owner = doc_id
+        return owner
+
+
+def release_content_hash(sha256, doc_id):
+    with connection() as conn, conn:
+        conn.execute('DELETE FROM content_hashes WHERE sha256=? AND document_id=?', (sha256, doc_id))
+
+
+def get_embeddings(model, hashes):
+    """Cached embedding bytes for the given chunk hashes: {hash: blob}."""
+    found = {}
+    hashes = list(hashes)
+    with connection() as conn:
+        for i in range(0, len(hashes), 500):
+            part = hashes[i:i + 500]
+            found.update(conn.execute(
+                f'SELECT hash, vector FROM embeddings WHERE model=? AND hash IN ({",".join("?" * len(part))})',
+                [model, *part]))
+    return found
+
+
+def put_embeddings(model, items):
+    """Stores (hash, blob) pairs for a model."""
+    with connection() as conn, conn:
+        conn.executemany('INSERT OR REPLACE INTO embeddings(hash, model, vector) VALUES (?,?,?)',
+                         [(h, model, v) for h, v in items])
+
+
+def get_analysis(doc_id, kind):
+    """(version, result) stored for a document, or None."""
+    with connection() as conn:
+        row = conn.execute('SELECT version, result FROM analyses WHERE id=? AND kind=?', (doc_id, kind)).fetchone()
+    return (row[0], json.loads(row[1])) if row else None
+
+
+def save_analyses(rows, field_rows=()):
+    """
+    Stores (doc_id, kind, version, result) tuples and, in the same transaction,
+    field index rows (see save_field_index). Replacing a document drops its rows.
+    """
+    with connection() as conn, conn:
+        conn.executemany('INSERT OR REPLACE INTO analyses(id, kind, version, result) VALUES (?,?,?,?)',
+                         [(doc_id, kind, str(version), json.dumps(result)) for doc_id, kind, version, result in rows])
+        _insert_fields(conn, field_rows)
+
+
+def _insert_fields(conn, rows):
+    rows = list(rows)
+    if not rows:
+        return
+    ids = [(r[0],) for r in rows]
+    conn.executemany('DELETE FROM contract_parties WHERE id=?', ids)
+    conn.executemany(
+        'INSERT OR REPLACE INTO contract_fields(id, version, governing_law, effective_date, liability_cap, '
+        'liability_unlimited, auto_renewal, confidentiality) VALUES (?,?,?,?,?,?,?,?)', [r[:8] for r in rows])
+    conn.executemany('INSERT INTO contract_parties(id, party) VALUES (?,?)',
+                     [(r[0], party) for r in rows for party in r[8]])
+
+
+def save_field_index(rows):
+    """
+    Stores (doc_id, version, governing_law, effective_date, liability_cap,
+    liability_unlimited, auto_renewal, confidentiality, parties) rows,
+    replacing earlier rows of the same documents.
+    """
+    with connection() as conn, conn:
+        _insert_fields(conn, rows)
+
+
+def unindexed_fields(version):
+    """Ids of documents without a contract_fields row at `version`."""
+    with connection() as conn:
+        return [r[0] for r in conn.execute(
+            'SELECT d.id FROM documents d LEFT JOIN contract_fields f ON f.id = d.id '
+            'WHERE f.version IS NULL OR f.version != ? ORDER BY d.rowid', (version,))]
+
+
+def search_fields(where, params, limit, offset):
+    """(total, rows) of contract_fields f matching a WHERE clause, with filenames and parties, in ingest order."""
+    with connection() as conn:
+        total = conn.execute(f'SELECT COUNT(*) FROM contract_fields f WHERE {where}', params).fetchone()[0]
+        rows = conn.execute(
+            'SELECT f.id, d.filename, f.governing_law, f.effective_date, f.liability_cap, f.liability_unlimited, '
+            'f.auto_renewal, f.confidentiality FROM contract_fields f JOIN documents d ON d.id = f.id '
+            f'WHERE {where} ORDER BY d.rowid LIMIT ? OFFSET ?', [*params, limit, offset]).fetchall()
+        parties = {}
+        if rows:
+            for doc_id, party in conn.execute(
+                    f'SELECT id, party FROM contract_parties WHERE id IN ({",".join("?" * len(rows))}) '
+                    'ORDER BY rowid', [r[0] for r in rows]):
+                parties.setdefault(doc_id, []).append(party)
+    return total, [{'document_id': r[0], 'filename': r[1], 'governing_law': r[2], 'effective_date': r[3],
+                    'liability_cap': r[4], 'liability_unlimited': bool(r[5]), 'auto_renewal': bool(r[6]),
+                    'confidentiality': bool(r[7]), 'parties': parties.get(r[0], [])} for r in rows]
+
+
+def field_ids(where, params):
+    with connection() as conn:
+        return [r[0] for r in conn.execute(f'SELECT f.id FROM contract_fields f WHERE {where}', params)]
+
+
+def stale_analyses(kind, version):
+    """Ids of documents without a stored `kind` result at `version`."""
+    with connection() as conn:
+        return [r[0] for r in conn.execute(
+            'SELECT d.id FROM documents d LEFT JOIN analyses a ON a.id = d.id AND a.kind = ? '
+            'WHERE a.version IS NULL OR a.version != ? ORDER BY d.rowid', (kind, str(version)))]
+
+
+def get_text_span(doc_id, start, end):
+    """Characters [start, end) of a document's text, sliced inside SQLite."""
+    with connection() as conn:
+        row = conn.execute('SELECT substr(text, ?, ?) FROM document_text WHERE id=?',
+                           (start + 1, end - start, doc_id)).fetchone()
+    return row[0] if row else None
+
+
+def iter_texts(doc_ids=None, batch_size=64):
+    """
+    Yield (doc_id, text) for all documents, or only doc_ids, fetching
+    batch_size rows at a time so the corpus is never loaded at once.
+    """
+    with connection() as conn:
+        if doc_ids is None:
+            cur = conn.execute('SELECT t.id, t.text FROM document_text t JOIN documents d ON d.id = t.id '
+                               'ORDER BY d.rowid')
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+            return
+        ids = list(doc_ids)
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            cur = conn.execute(f'SELECT id, text FROM document_text WHERE id IN ({",".join("?" * len(part))})',
+                               part)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
@@ -0,0 +1,325 @@
+"""
+Dense (embedding) retrieval over the same chunks as the TF-IDF index.
+
+Chunk vectors come from llm.embed_texts in batches and are cached in the
+document store by chunk hash, so unchanged text is embedded once per model.
+They live in a FAISS inner-product index whose ids are the retriever's row
+numbers: exact (flat) for small corpora, HNSW once the corpus passes
+DENSE_HNSW_THRESHOLD chunks, or IVF when configured. The index is persisted
+next to the TF-IDF snapshot. A background thread builds it and catches up
+with appended documents (request_sync), DENSE_EMBED_BATCH chunks at a time;
+until it covers the current TF-IDF build, rank() raises DenseUnavailable.
+"""
+import hashlib
+import json
+import os
+import threading
+import traceback
+from typing import List, Optional
+
+import numpy as np
+
+from . import db, llm, retriever, storage
+from .telemetry import stage
+
+# auto | flat | hnsw | ivf
+DENSE_INDEX_KIND = os.getenv('DENSE_INDEX_KIND', 'auto')
+# 'auto' switches from exact search to HNSW above this many chunks
+DENSE_HNSW_THRESHOLD = int(os.getenv('DENSE_HNSW_THRESHOLD', '50000'))
+DENSE_HNSW_M = int(os.getenv('DENSE_HNSW_M', '32'))
+DENSE_IVF_LISTS = int(os.getenv('DENSE_IVF_LISTS', '1024'))
+DENSE_NPROBE = int(os.getenv('DENSE_NPROBE', '16'))
+# Texts per embed_texts() call
+DENSE_EMBED_BATCH = int(os.getenv('DENSE_EMBED_BATCH', '64'))
+
+_index = None        # FAISS index; id i is retriever row i
+_kind = None
+_rows = 0            # retriever rows already embedded
+_build_id = None     # retriever build the ids refer to
+_model = None
+_active = False      # set once the dense backend has been used in this process
+_ready = False       # _index covers the current TF-IDF build (it may lag behind the newest appends)
+_lock = threading.RLock()
+_sync_lock = threading.Lock()   # one sync() at a time
+_sync_wanted = threading.Event()
+_sync_thread: Optional[threading.Thread] = None
+_start_lock = threading.Lock()
+
+
+class DenseUnavailable(RuntimeError):
+    """Raised when FAISS or an embedding model is not available."""
+
+
+def _faiss():
+    try:
+        import faiss
+    except ImportError:
+        raise DenseUnavailable('faiss is not installed')
+    return faiss
+
+
+def _ensure_model():
+    if not llm.available():
+        llm.init_llm()
+    if not llm.available():
+        raise DenseUnavailable('no embedding model available')
+    return llm.embedding_model()
+
+
+def check_available(needs_index: bool = True):
+    """
+    Raises DenseUnavailable unless an embedding model (and, if needed, FAISS
+    and a built index) can be used. A missing index is then built in the background.
+    """
+    if needs_index:
+        _faiss()
+    model = _ensure_model()
+    if needs_index:
+        _require_index(model)
+
+
+def _require_index(model: str):
+    with _lock:
+        ready = _ready and _build_id == retriever._build_id and _model == model
+        behind = _rows < len(retriever._meta) or not ready
+        done = _rows
+    if behind:
+        request_sync()
+    if not ready:
+        raise DenseUnavailable(f'the dense index is being built ({done} of {len(retriever._meta)} chunks '
+                               f'embedded); retry shortly')
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def embed(texts: List[str], cache: bool = True) -> np.ndarray:
+    """
+    L2-normalized float32 embeddings for `texts`, embedded DENSE_EMBED_BATCH at
+    a time. With `cache` (chunk texts), cached vectors are reused and new ones
+    written to the cache; questions pass cache=False so they are never stored.
+    """
+    model = _ensure_model()
+    hashes = [chunk_hash(t) for t in texts]
+    cached = db.get_embeddings(model, set(hashes)) if cache else {}
+    missing = list(dict.fromkeys(h for h in hashes if h not in cached))
+    if missing:
+        by_hash = dict(zip(hashes, texts))
+        for i in range(0, len(missing), DENSE_EMBED_BATCH):
+            part = missing[i:i + DENSE_EMBED_BATCH]
+            with stage('embed'):
+                vecs = np.asarray(llm.embed_texts([by_hash[h] for h in part]), dtype=np.float32)
+            vecs /= np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12)
+            items = [(h, v.tobytes()) for h, v in zip(part, vecs)]
+            if cache:
+                db.put_embeddings(model, items)
+            cached.update(items)
+    return np.vstack([np.frombuffer(cached[h], dtype=np.float32) for h in hashes])
+
+
+def _resolve_kind(n_rows: int) -> str:
+    """Index type for n_rows vectors; IVF needs at least DENSE_IVF_LISTS vectors to train, so it starts flat."""
+    if DENSE_INDEX_KIND == 'ivf':
+        return 'ivf' if n_rows >= DENSE_IVF_LISTS else 'flat'
+    if DENSE_INDEX_KIND != 'auto':
+        return DENSE_INDEX_KIND
+    return 'hnsw' if n_rows > DENSE_HNSW_THRESHOLD else 'flat'
+
+
+def _new_index(kind: str, vectors: np.ndarray):
+    """An empty index of `kind` (IVF is trained on `vectors`, so needs at least DENSE_IVF_LISTS of them)."""
+    faiss = _faiss()
+    dim = vectors.shape[1]
+    if kind == 'hnsw':
+        return faiss.IndexHNSWFlat(dim, DENSE_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    if kind == 'ivf':
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, DENSE_IVF_LISTS, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        return index
+    return faiss.IndexFlatIP(dim)
+
+
+def _paths():
+    return retriever.INDEX_DIR / 'dense.faiss', retriever.INDEX_DIR / 'dense.json'
+
+
+def save():
+    """Persist the dense index with the retriever build it belongs to."""
+    with _lock:
+        if _index is None:
+            return
+        faiss = _faiss()
+        index_path, manifest_path = _paths()
+        retriever.INDEX_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = index_path.with_name(f'{index_path.name}.{os.getpid()}')
+        faiss.write_index(_index, str(tmp))
+        os.replace(tmp, index_path)
+        manifest = {'build_id': _build_id, 'rows': _rows, 'model': _model, 'kind': _kind}
+        manifest_path.write_text(json.dumps(manifest), encoding='utf-8')
+
+
+def _load(model: str) -> bool:
+    global _index, _kind, _rows, _build_id, _model
+    index_path, manifest_path = _paths()
+    if not manifest_path.exists() or not index_path.exists():
+        return False
+    manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+    if manifest.get('build_id') != retriever._build_id or manifest.get('model') != model:
+        return False
+    _index = _faiss().read_index(str(index_path))
+    _kind, _rows, _build_id, _model = manifest['kind'], manifest['rows'], manifest['build_id'], model
+    return True
+
+
+def preload() -> bool:
+    """
+    Loads the embedding model and the saved FAISS index of the current TF-IDF
+    build, embedding nothing; used before forking workers so they share both.
+    """
+    try:
+        model = _ensure_model()
+        _faiss()
+    except DenseUnavailable:
+        return False
+    global _ready
+    with _lock:
+        _ready = _load(model)
+        return _ready
+
+
+def _pending_docs(limit: int):
+    """(doc_id, starts, ends) of the next documents not yet embedded, about `limit` chunks of them."""
+    with retriever._lock:
+        meta = retriever._meta
+        lo = meta.doc_lo.values
+        first = int(np.searchsorted(lo, _rows))
+        pending, n = [], 0
+        for k in range(first, len(meta.doc_ids)):
+            if n >= limit:
+                break
+            a, b = int(lo[k]), int(meta.doc_hi.values[k])
+            pending.append((meta.doc_ids[k], meta.start.values[a:b].copy(), meta.end.values[a:b].copy()))
+            n += b - a
+        return pending
+
+
+def sync():
+    """
+    Bring the dense index up to date with the TF-IDF index, embedding only new
+    chunks, DENSE_EMBED_BATCH at a time. Only one step's chunk texts are held
+    at once, and the index lock is only taken to add each step's vectors, so
+    searches keep running meanwhile. Normally run by the background thread.
+    """
+    global _index, _kind, _rows, _build_id, _model, _ready
+    model = _ensure_model()
+    _faiss()
+    with _sync_lock:
+        with _lock:
+            if _build_id != retriever._build_id or _model != model:
+                _index, _kind, _rows, _build_id, _model, _ready = None, None, 0, None, None, False
+                if _load(model):
+                    _ready = True
+                else:
+                    _build_id, _model = retriever._build_id, model
+            build_id = _build_id
+        added = 0
+        while True:
+            pending = _pending_docs(DENSE_EMBED_BATCH)
+            if not pending:
+                break
+            texts = []
+            for doc_id, starts, ends in pending:
+                text = storage.load_text(doc_id) or ''
+                texts.extend(text[a:b] for a, b in zip(starts, ends))
+            vectors = embed(texts)
+            with _lock:
+                if _build_id != build_id or retriever._build_id != build_id:
+                    # the TF-IDF index was rebuilt: row ids changed, start over on the next sync
+                    return
+                kind = _resolve_kind(_rows + len(vectors))
+                if _index is None:
+                    _index, _kind = _new_index(kind, vectors), kind
+                elif kind != _kind and _kind == 'flat':
+                    # corpus outgrew exact search: move stored vectors into the new index type
+                    old = _index.reconstruct_n(0, _index.ntotal)
+                    _index, _kind = _new_index(kind, np.vstack([old, vectors])), kind
+                    _index.add(old)
+                _index.add(vectors)
+                _rows += len(vectors)
+            added += len(vectors)
+        with _lock:
+            _ready = _build_id == retriever._build_id
+        if added:
+            print(f"✅ Embedded {added} chunks into the dense index ({_kind}, {_rows} total).")
+            save()
+
+
+def request_sync():
+    """Wakes (starting it if needed) the background thread that builds and updates the dense index."""
+    global _active, _sync_thread
+    _active = True
+    _sync_wanted.set()
+    with _start_lock:
+        # a thread inherited across a fork is not alive in the child
+        if _sync_thread is None or not _sync_thread.is_alive():
+            _sync_thread = threading.Thread(target=_sync_loop, name='dense-sync', daemon=True)
+            _sync_thread.start()
+
+
+def _sync_loop():
+    while True:
+        _sync_wanted.wait()
+        _sync_wanted.clear()
+        try:
+            sync()
+        except Exception:
+            print("❌ Dense index sync failed:")
+            traceback.print_exc()
+
+
+def index_stats() -> dict:
+    index = _index
+    return {'active': _active, 'ready': _ready, 'kind': _kind, 'vectors': index.ntotal if index is not None else 0}
+
+
+def sync_if_active():
+    """Called after ingest commits; only keeps an index that is already in use up to date, in the background."""
+    if _active:
+        request_sync()
+
+
+def _search_params(ranges):
+    faiss = _faiss()
+    if len(ranges) == 1:
+        sel = faiss.IDSelectorRange(*ranges[0])
+    else:
+        sel = faiss.IDSelectorBatch(np.concatenate([np.arange(lo, hi, dtype=np.int64) for lo, hi in ranges]))
+    if _kind == 'hnsw':
+        return faiss.SearchParametersHNSW(sel=sel)
+    if _kind == 'ivf' and isinstance(_index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=sel, nprobe=DENSE_NPROBE)
+    return faiss.SearchParameters(sel=sel)
+
+
+def rank(questions: List[str], top_k: int, ranges: Optional[list] = None):
+    """
+    Nearest chunks for each question as [(row ids, scores)], the same shape
+    retriever._rank() returns. `ranges` limits the search to these (lo, hi) row ranges.
+    Raises DenseUnavailable while the index for the current TF-IDF build is being built.
+    """
+    check_available(needs_index=True)
+    queries = embed(questions, cache=False)
+    with _lock:
+        if _index is None or _index.ntotal == 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0)) for _ in questions]
+        if isinstance(_index, _faiss().IndexIVF):
+            _index.nprobe = DENSE_NPROBE
+        k = min(top_k, _index.ntotal)
+        params = _search_params(ranges) if ranges else None
+        scores, ids = _index.search(queries, k, params=params)
+    ranked = []
+    for row_ids, row_scores in zip(ids, scores):
+        keep = row_ids >= 0
+        ranked.append((row_ids[keep].astype(np.int64), row_scores[keep].astype(np.float64)))
+    return ranked
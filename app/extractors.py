@@ -1,50 +1,119 @@
+"""
+Structured field extraction.
+
+The text is lowercased once and scanned once for every label and regex
+prefix the fields need; each field then works from the recorded offsets.
+Field regexes are compiled at import and only tried where their literal
+prefix occurs, instead of being searched across the whole contract.
+"""
 import re
+from bisect import bisect_right
+
+from .scan import LiteralScanner, lower_text, near_sentence
+
+# Bump when the fields produced for the same text change; stored fields of older versions are recomputed
+EXTRACTOR_VERSION = '2'
+
+TERM_LABELS = ['term of this agreement', 'term:', 'term -', 'term of agreement', 'the term shall be']
+PAYMENT_LABELS = ['payment', 'fees', 'compensation', 'price:']
+TERMINATION_LABELS = ['termination', 'terminate this agreement', 'termination for cause',
+                      'termination for convenience']
+
+_PARTIES = re.compile(r'between\s+([A-Z][A-Za-z0-9 ,.&-]{2,200}?)\s+and\s+([A-Z][A-Za-z0-9 ,.&-]{2,200})',
+                      re.IGNORECASE)
+_EFFECTIVE_DATE = re.compile(r'effective\s+date[\s:]*([A-Za-z0-9 ,\-]+)', re.IGNORECASE)
+_GOVERNING_LAW = re.compile(r'governing law[\s:.]*([A-Za-z ,]+)', re.IGNORECASE)
+_CAP_AMOUNT = re.compile(r'[\s:]*\$?([0-9,]+)')
+_SIGNED_BY = re.compile(r'signed by[:\s\n]*([A-Za-z ,.-]{2,80})', re.IGNORECASE)
+
+# Literal prefixes of the patterns above plus the keywords tested for presence
+_ANCHORS = ['between', 'effective', 'governing law', 'auto-renew', 'auto renew', 'confidential', 'indemn',
+            'liability', 'cap', 'unlimited liability', 'no cap', 'signed by']
+_SCANNER = LiteralScanner(TERM_LABELS + PAYMENT_LABELS + TERMINATION_LABELS + _ANCHORS)
+
+
+def _first_match(pattern, text, offsets):
+    """Same as pattern.search(text) when every match has to start at one of `offsets`."""
+    for pos in offsets:
+        m = pattern.match(text, pos)
+        if m:
+            return m
+    return None
+
+
+def _liability_cap(text, hits):
+    """
+    Amount captured by r'liability.*cap[\\s:]*\\$?([0-9,]+)' (case-insensitive), or None.
+    The greedy `.*` stays on the line of 'liability' and ends at the last usable 'cap'.
+    """
+    caps = [q for q in hits.get('cap', ()) if _CAP_AMOUNT.match(text, q + 3)]
+    if not caps:
+        return None
+    line_end = -1
+    for p in hits.get('liability', ()):
+        if p > line_end:
+            line_end = text.find('\n', p)
+            if line_end == -1:
+                line_end = len(text)
+        i = bisect_right(caps, line_end - 3) - 1
+        if i >= 0 and caps[i] >= p + len('liability'):
+            return _CAP_AMOUNT.match(text, caps[i] + 3).group(1)
+    return None
+
+
 def extract_structured_fields(text: str):
-    lower = text.lower()
+    hits = _SCANNER.scan(lower_text(text))
+
     def find_after(labels):
         for lab in labels:
-            idx = lower.find(lab)
-            if idx!=-1:
+            if lab in hits:
+                idx = hits[lab][0]
                 return text[idx: idx+400].strip()
         return None
     parties = []
-    m = re.search(r'between\s+([A-Z][A-Za-z0-9 ,.&-]{2,200}?)\s+and\s+([A-Z][A-Za-z0-9 ,.&-]{2,200})', text, re.IGNORECASE)
+    m = _first_match(_PARTIES, text, hits.get('between', ()))
     if m:
         parties = [m.group(1).strip(), m.group(2).strip()]
     eff = None
-    m = re.search(r'effective\s+date[\s:]*([A-Za-z0-9 ,\-]+)', text, re.IGNORECASE)
+    m = _first_match(_EFFECTIVE_DATE, text, hits.get('effective', ()))
     if m:
         eff = m.group(1).strip()
     gov = None
-    m = re.search(r'governing law[\s:.]*([A-Za-z ,]+)', text, re.IGNORECASE)
+    m = _first_match(_GOVERNING_LAW, text, hits.get('governing law', ()))
     if m:
         gov = m.group(1).strip()
-    term = find_after(['term of this agreement','term:','term -','term of agreement','the term shall be'])
-    pay = find_after(['payment','fees','compensation','price:'])
-    termi = find_after(['termination','terminate this agreement','termination for cause','termination for convenience'])
+    term = find_after(TERM_LABELS)
+    pay = find_after(PAYMENT_LABELS)
+    termi = find_after(TERMINATION_LABELS)
     auto = None
-    m = re.search(r'auto[- ]renew', text, re.IGNORECASE)
-    if m:
-        s = _near_sentence(text, m.start())
-        auto = s
-    conf = 'confidential' in lower or 'confidentiality' in lower
+    renew = [hits[lab][0] for lab in ('auto-renew', 'auto renew') if lab in hits]
+    if renew:
+        auto = near_sentence(text, min(renew))
+    conf = 'confidential' in hits
     indemn = None
-    if 'indemn' in lower:
-        indemn = _find_sentence_with(text, 'indemn')
+    if 'indemn' in hits:
+        indemn = near_sentence(text, hits['indemn'][0])
     liab = None
-    m = re.search(r'liability.*cap[\s:]*\$?([0-9,]+)', text, re.IGNORECASE)
-    if m:
-        val = m.group(1).replace(',', '')
+    amount = _liability_cap(text, hits)
+    if amount is not None:
+        val = amount.replace(',', '')
         try:
             liab = {'amount': int(val)}
-        except:
+        except ValueError:
             liab = {'amount': None}
     else:
-        if 'unlimited liability' in lower or 'no cap' in lower:
+        if 'unlimited liability' in hits or 'no cap' in hits:
             liab = {'amount': None, 'note': 'unlimited'}
     signs = []
-    for m in re.finditer(r'signed by[:\s\n]*([A-Za-z ,.-]{2,80})', text, re.IGNORECASE):
-        signs.append({'name': m.group(1).strip(), 'title': None})
+    end = 0
+    # non-overlapping, like re.finditer
+    for pos in hits.get('signed by', ()):
+        if pos < end:
+            continue
+        m = _SIGNED_BY.match(text, pos)
+        if m:
+            signs.append({'name': m.group(1).strip(), 'title': None})
+            end = m.end()
     return {
         'parties': parties,
         'effective_date': eff,
@@ -58,15 +127,3 @@ def extract_structured_fields(text: str):
         'liability_cap': liab,
         'signatories': signs
     }
-
-def _near_sentence(text, pos):
-    start = text.rfind('.', 0, pos)
-    end = text.find('.', pos)
-    if start==-1: start= max(0, pos-200)
-    if end==-1: end = min(len(text), pos+200)
-    return text[start+1:end+1].strip()
-
-def _find_sentence_with(text, token):
-    i = text.lower().find(token)
-    if i==-1: return None
-    return _near_sentence(text, i)
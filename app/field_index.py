@@ -0,0 +1,168 @@
+"""
+Structured field index: extracted contract attributes in typed SQLite columns.
+
+Whenever extracted fields are stored (storage.save_analyses), their
+normalized form is written to `contract_fields` and `contract_parties` in
+the same transaction: governing law as a jurisdiction name, effective date
+as an ISO date, the liability cap as a number and the flags as 0/1. Filters
+compile to an indexed WHERE clause, so /search and filtered /ask never touch
+the document text.
+
+A filter is a dict of conditions that must all hold:
+
+    {"governing_law": "New York",              # or a list of names; case-insensitive
+     "liability_cap": {"lt": 1000000},         # gt / gte / lt / lte, or a plain value for equality
+     "effective_date": {"gte": "2020-01-01"},
+     "auto_renewal": true, "confidentiality": true, "liability_unlimited": false,
+     "party": "acme"}                          # substring of either party
+"""
+import re
+from datetime import date, datetime
+from typing import Optional
+
+from . import db
+
+# Bump when normalization changes; index rows with another tag are rebuilt by backfill()
+FIELD_INDEX_VERSION = '1'
+
+_RANGE_OPS = {'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+_BOOL_COLUMNS = ('auto_renewal', 'confidentiality', 'liability_unlimited')
+_NAME = r"[A-Z][A-Za-z.'-]*(?:[ \t]+(?:(?:and|of|du|de)[ \t]+)?[A-Z][A-Za-z.'-]*)*"
+# the name itself is matched case-sensitively so it stops at the first lowercase word
+_LAWS_OF = re.compile(r"(?i:laws?\s+of\s+(?:the\s+)?(?:(?:state|commonwealth|province|republic|kingdom)\s+of\s+)?)("
+                      + _NAME + ")")
+_JURISDICTION = re.compile(r"(?i:(?:the\s+)?(?:(?:state|commonwealth|province)\s+of\s+)?)(" + _NAME + r")\s*,?\s*$")
+_DATES = [
+    (re.compile(r'\b([A-Z][a-z]{2,8}\.?\s+\d{1,2}(?:st|nd|rd|th)?,?\s+\d{4})\b'), ('%B %d %Y', '%b %d %Y')),
+    (re.compile(r'\b(\d{1,2}(?:st|nd|rd|th)?\s+[A-Z][a-z]{2,8}\.?,?\s+\d{4})\b'), ('%d %B %Y', '%d %b %Y')),
+    (re.compile(r'\b(\d{4}-\d{2}-\d{2})\b'), ('%Y-%m-%d',)),
+    (re.compile(r'\b(\d{1,2}/\d{1,2}/\d{4})\b'), ('%m/%d/%Y',)),
+]
+
+
+def governing_law(raw: Optional[str]) -> Optional[str]:
+    """Jurisdiction named by the governing-law text ("...the laws of the State of New York" -> "New York")."""
+    if not raw:
+        return None
+    m = _LAWS_OF.search(raw)
+    if m is None:
+        # the whole text is the jurisdiction, as in "Governing Law: Delaware"
+        m = _JURISDICTION.match(raw.strip())
+    if m is None:
+        return None
+    return m.group(1).strip(' .,')
+
+
+def effective_date(raw: Optional[str]) -> Optional[str]:
+    if not raw:
+        return None
+    for pattern, formats in _DATES:
+        m = pattern.search(raw)
+        if not m:
+            continue
+        value = re.sub(r'(?<=\d)(st|nd|rd|th)\b', '', m.group(1)).replace(',', '').replace('.', '')
+        value = ' '.join(value.split())
+        for fmt in formats:
+            try:
+                return datetime.strptime(value, fmt).date().isoformat()
+            except ValueError:
+                pass
+    return None
+
+
+def index_row(doc_id: str, version, fields: dict):
+    """Row for db.save_field_index() from an extract_structured_fields() result."""
+    cap = fields.get('liability_cap') or {}
+    parties = [p.strip(' .,') for p in fields.get('parties') or [] if p and p.strip(' .,')]
+    return (doc_id, f'{version}+{FIELD_INDEX_VERSION}', governing_law(fields.get('governing_law')),
+            effective_date(fields.get('effective_date')), cap.get('amount'), int(cap.get('note') == 'unlimited'),
+            int(bool(fields.get('auto_renewal'))), int(bool(fields.get('confidentiality'))), parties)
+
+
+def _range(column: str, cond, convert):
+    if not isinstance(cond, dict):
+        return [f'f.{column} = ?'], [convert(cond)]
+    unknown = set(cond) - set(_RANGE_OPS)
+    if unknown or not cond:
+        raise ValueError(f'{column}: use {sorted(_RANGE_OPS)}')
+    clauses, params = [], []
+    for op, value in cond.items():
+        if value is None:
+            continue
+        clauses.append(f'f.{column} {_RANGE_OPS[op]} ?')
+        params.append(convert(value))
+    return clauses, params
+
+
+def _iso(value) -> str:
+    if isinstance(value, date):
+        return value.isoformat()
+    try:
+        return date.fromisoformat(str(value)).isoformat()
+    except ValueError:
+        raise ValueError(f'effective_date: expected YYYY-MM-DD, got {value!r}')
+
+
+def compile_filter(spec: Optional[dict]):
+    """(WHERE clause over contract_fields f, params); raises ValueError on unknown keys or bad values."""
+    clauses, params = [], []
+    for key, cond in (spec or {}).items():
+        if cond is None:
+            continue
+        if key == 'governing_law':
+            names = [cond] if isinstance(cond, str) else list(cond)
+            clauses.append(f'f.governing_law IN ({",".join("?" * len(names))})')
+            params.extend(names)
+        elif key == 'liability_cap':
+            c, p = _range('liability_cap', cond, float)
+            clauses += c
+            params += p
+        elif key == 'effective_date':
+            c, p = _range('effective_date', cond, _iso)
+            clauses += c
+            params += p
+        elif key in _BOOL_COLUMNS:
+            if not isinstance(cond, bool):
+                raise ValueError(f'{key}: expected true or false')
+            clauses.append(f'f.{key} = ?')
+            params.append(int(cond))
+        elif key == 'party':
+            pattern = '%' + str(cond).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            clauses.append("EXISTS (SELECT 1 FROM contract_parties p "
+                           "WHERE p.id = f.id AND p.party LIKE ? ESCAPE '\\')")
+            params.append(pattern)
+        else:
+            raise ValueError(f'unknown filter field {key!r}')
+    return ' AND '.join(clauses) or '1', params
+
+
+def search(spec: Optional[dict], limit: int = 100, offset: int = 0) -> dict:
+    """Documents whose indexed fields match `spec`: {'total', 'documents': [...]} in ingest order."""
+    where, params = compile_filter(spec)
+    total, rows = db.search_fields(where, params, limit, offset)
+    return {'total': total, 'documents': rows}
+
+
+def matching_ids(spec: Optional[dict]) -> set:
+    where, params = compile_filter(spec)
+    return set(db.field_ids(where, params))
+
+
+def backfill(batch_size: int = 500) -> int:
+    """Indexes stored documents whose field rows are missing or were written by other code; returns how many."""
+    from . import analysis, storage
+    current = f"{analysis.version('fields')}+{FIELD_INDEX_VERSION}"
+    ids = db.unindexed_fields(current)
+    for i in range(0, len(ids), batch_size):
+        rows = []
+        for doc_id in ids[i:i + batch_size]:
+            stored = storage.load_analysis(doc_id, 'fields')
+            if stored is not None and stored[0] == analysis.version('fields'):
+                rows.append(index_row(doc_id, stored[0], stored[1]))
+            else:
+                # recomputing stores the fields and their index row together
+                analysis.get(doc_id, 'fields')
+        db.save_field_index(rows)
+    if ids:
+        print(f"✅ Indexed extracted fields of {len(ids)} document(s).")
+    return len(ids)
@@ -0,0 +1,278 @@
+"""
+Background ingest jobs.
+
+/ingest stores the uploaded files and returns a job id straight away; worker
+threads then extract each file through the process pool and save it. Extracted
+documents from all running jobs go through a single committer thread, which
+appends them to the index in one batch per INDEX_COMMIT_DELAY window instead
+of once per upload.
+
+Job state lives in this process only, so with several server workers a job
+is visible on the worker that accepted it.
+"""
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+from . import analysis, dense, pool, retriever, storage
+from .telemetry import stage
+
+# Files extracted at once; by default as many as the process pool admits, so every core stays busy
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', str(pool.EXTRACT_QUEUE_SIZE)))
+# Seconds the committer waits for more documents before updating the index
+INDEX_COMMIT_DELAY = float(os.getenv('INDEX_COMMIT_DELAY', '0.5'))
+# Finished jobs are forgotten after this many seconds
+JOB_TTL = float(os.getenv('JOB_TTL', '3600'))
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_pending = set()                        # documents claimed by uploads here and not yet stored or failed
+_waiting = {}                           # pending document id -> [(job_id, file index)] of its duplicates
+_claim_lock = threading.Lock()
+_unindexed = []                         # stored documents whose index update failed; retried with the next commit
+_tasks: queue.Queue = queue.Queue()     # (job_id, file index) to extract
+_commits: queue.Queue = queue.Queue()   # (job_id, file index, text, analyses) ready to store and index
+_started = False
+_start_lock = threading.Lock()
+
+
+def _ensure_started():
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        for i in range(INGEST_WORKERS):
+            threading.Thread(target=_worker, name=f'ingest-worker-{i}', daemon=True).start()
+        threading.Thread(target=_committer, name='index-committer', daemon=True).start()
+        _started = True
+
+
+def claim_content_hash(sha256: str, doc_id: str) -> str:
+    """
+    Claims content `sha256` for a new upload `doc_id` and returns the owning
+    document ID. A claim left by an upload that neither got stored nor is still
+    being ingested here (e.g. queued when the server stopped) is taken over.
+    """
+    with _claim_lock:
+        with _jobs_lock:
+            live = set(_pending)
+        owner = storage.claim_content_hash(sha256, doc_id, live)
+        if owner == doc_id:
+            with _jobs_lock:
+                _pending.add(doc_id)
+    return owner
+
+
+def release_claim(sha256: str, doc_id: str):
+    """Drops the claim of an upload that is not submitted after all."""
+    storage.release_content_hash(sha256, doc_id)
+    with _jobs_lock:
+        _pending.discard(doc_id)
+
+
+def submit(files: List[dict], webhook_url: Optional[str] = None) -> str:
+    """
+    Registers a job for already stored uploads and queues its files.
+    Each entry of `files` needs 'document_id', 'path' and 'metadata'; entries
+    flagged 'duplicate' point at an existing document and are not re-extracted.
+    A duplicate of a document still being ingested ends the way that one does.
+    """
+    _ensure_started()
+    job_id = str(uuid.uuid4())
+    job = {
+        'job_id': job_id,
+        'status': 'queued',
+        'created_at': time.time(),
+        'finished_at': None,
+        'webhook_url': webhook_url,
+        'files': [{
+            'document_id': f['document_id'],
+            'filename': f['metadata'].get('filename'),
+            'status': 'queued',
+            'duplicate': bool(f.get('duplicate')),
+            'error': None,
+            '_path': Path(f['path']) if f.get('path') else None,
+            '_metadata': f['metadata'],
+        } for f in files],
+    }
+    settled = []
+    with _jobs_lock:
+        _prune()
+        _jobs[job_id] = job
+        for i, f in enumerate(files):
+            if f.get('duplicate'):
+                if f['document_id'] in _pending:
+                    _waiting.setdefault(f['document_id'], []).append((job_id, i))
+                else:
+                    settled.append(i)
+    for i in settled:
+        # the owner is no longer in flight, so it was either stored or failed
+        if storage.doc_exists(files[i]['document_id']):
+            _set_status(job_id, i, 'done')
+        else:
+            _set_status(job_id, i, 'failed', 'duplicate of an upload that failed')
+    for i, f in enumerate(files):
+        if not f.get('duplicate'):
+            _tasks.put((job_id, i))
+    _finish_if_complete(job_id)
+    return job_id
+
+
+def get(job_id: str) -> Optional[dict]:
+    """Returns a JSON-safe view of a job, or None if unknown."""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        files = [{k: v for k, v in f.items() if not k.startswith('_')} for f in job['files']]
+        done = sum(f['status'] in ('done', 'failed') for f in files)
+        return {
+            'job_id': job_id,
+            'status': job['status'],
+            'created_at': job['created_at'],
+            'finished_at': job['finished_at'],
+            'progress': {'done': done, 'total': len(files)},
+            'files': files,
+        }
+
+
+def _prune():
+    cutoff = time.time() - JOB_TTL
+    for job_id in [j for j, job in _jobs.items() if job['finished_at'] and job['finished_at'] < cutoff]:
+        del _jobs[job_id]
+
+
+def _set_status(job_id: str, i: int, status: str, error: Optional[str] = None):
+    """Updates one file; a final status is passed on to the duplicates waiting for that file."""
+    waiters = []
+    with _jobs_lock:
+        job = _jobs[job_id]
+        f = job['files'][i]
+        f['status'] = status
+        f['error'] = error
+        if job['status'] == 'queued':
+            job['status'] = 'running'
+        if status in ('done', 'failed') and not f['duplicate']:
+            _pending.discard(f['document_id'])
+            waiters = _waiting.pop(f['document_id'], [])
+            for w_job, w_i in waiters:
+                if w_job in _jobs:
+                    _jobs[w_job]['files'][w_i].update(
+                        status=status, error=error and f"duplicate of {f['document_id']}, which failed: {error}")
+    for w_job in {w_job for w_job, _ in waiters}:
+        _finish_if_complete(w_job)
+
+
+def _release_hash(f: dict):
+    """Lets a later upload of the same bytes be ingested again instead of mapping to this failed document."""
+    if f['_metadata'].get('sha256'):
+        storage.release_content_hash(f['_metadata']['sha256'], f['document_id'])
+
+
+def _worker():
+    while True:
+        job_id, i = _tasks.get()
+        f = None
+        try:
+            with _jobs_lock:
+                f = _jobs[job_id]['files'][i]
+            _set_status(job_id, i, 'extracting')
+            try:
+                with stage('extract'):
+                    text = pool.extract_text(f['_path'])
+            except TimeoutError:
+                print(f"⚠️ Extraction timed out for {f['_path'].name}")
+                raise RuntimeError(f'extraction timed out after {pool.EXTRACT_TIMEOUT:g}s')
+            # fields and findings are stored with the document so /extract and /audit never recompute them
+            with stage('analyze'):
+                analyses = analysis.analyze(f['document_id'], text)
+            _set_status(job_id, i, 'indexing')
+            _commits.put((job_id, i, text, analyses))
+        except Exception as e:
+            print(f"❌ Ingest failed for job {job_id} file {i}:")
+            traceback.print_exc()
+            if f:
+                _release_hash(f)
+            _set_status(job_id, i, 'failed', str(e))
+            _finish_if_complete(job_id)
+        finally:
+            _tasks.task_done()
+
+
+def _committer():
+    while True:
+        batch = [_commits.get()]
+        deadline = time.monotonic() + INDEX_COMMIT_DELAY
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_commits.get(timeout=remaining))
+            except queue.Empty:
+                break
+        _commit(batch)
+
+
+def _commit(batch):
+    """
+    Stores every extracted file in `batch` and appends it to the index, both in
+    bulk. Only a storage failure fails the files: once stored, a document that
+    could not be indexed is retried with the next commit (and is picked up by
+    any rebuild), so its upload stays done rather than inviting a second copy.
+    """
+    global _unindexed
+    with _jobs_lock:
+        records = [(_jobs[job_id]['files'][i]['document_id'], _jobs[job_id]['files'][i]['_metadata'], text)
+                   for job_id, i, text, _ in batch]
+    status, error = 'done', None
+    try:
+        storage.save_docs(records)
+        storage.save_analyses([row for *_, analyses in batch for row in analyses])
+    except Exception as e:
+        print("❌ Storing extracted documents failed:")
+        traceback.print_exc()
+        status, error = 'failed', f'storing failed: {e}'
+        with _jobs_lock:
+            files = [_jobs[job_id]['files'][i] for job_id, i, *_ in batch]
+        for f in files:
+            _release_hash(f)
+    else:
+        doc_ids, _unindexed = _unindexed + [r[0] for r in records], []
+        try:
+            retriever.add_documents(doc_ids)
+        except Exception:
+            print("❌ Index update failed; retrying with the next commit:")
+            traceback.print_exc()
+            _unindexed = doc_ids
+        try:
+            retriever.maybe_save_snapshot()
+            dense.sync_if_active()
+        except Exception:
+            # the index stays dirty, so the next commit or shutdown saves it again
+            print("❌ Index snapshot failed:")
+            traceback.print_exc()
+    for job_id, i, *_ in batch:
+        _set_status(job_id, i, status, error)
+    for job_id in {job_id for job_id, *_ in batch}:
+        _finish_if_complete(job_id)
+
+
+def _finish_if_complete(job_id: str):
+    with _jobs_lock:
+        job = _jobs[job_id]
+        if job['finished_at'] or any(f['status'] not in ('done', 'failed') for f in job['files']):
+            return
+        failed = all(f['status'] == 'failed' for f in job['files'])
+        job['status'] = 'failed' if failed else 'done'
+        job['finished_at'] = time.time()
+        url = job['webhook_url']
+        doc_ids = [f['document_id'] for f in job['files'] if f['status'] == 'done']
+    if url:
+        payload = {'event': 'ingest_complete', 'job_id': job_id, 'document_ids': doc_ids}
+        threading.Thread(target=storage.post_webhook, args=(url, payload), daemon=True).start()
@@ -1,10 +1,283 @@
+"""
+LLM and embedding access.
+
+Provider calls go through one async client per process: a shared httpx
+connection pool, a concurrency semaphore, token buckets for requests and
+tokens per minute, and retries with jittered exponential backoff on 429/5xx
+and transport errors. Concurrent embed_texts() calls are merged into
+micro-batches of up to EMBED_BATCH_MAX inputs per provider request.
+
+The client runs on a private event loop thread, so the synchronous helpers
+below can be called from request threads, ingest workers and the index
+committer alike; async code can await the a* variants directly.
+Without an API key, embeddings come from sentence-transformers and
+answers fall back to the retrieved snippets.
+"""
+import asyncio
+import json
 import os
+import random
+import threading
+import time
+from typing import AsyncIterator, List, Optional
+
+from .telemetry import STAGE_LATENCY, stage
+
 OPENAI_KEY = os.getenv('OPENAI_API_KEY')
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1').rstrip('/')
+OPENAI_EMBED_MODEL = 'text-embedding-3-small'
+OPENAI_CHAT_MODEL = os.getenv('OPENAI_CHAT_MODEL', 'gpt-4o-mini')
+LOCAL_EMBED_MODEL = 'all-MiniLM-L6-v2'
 USE_SENTENCE = True  # fallback to sentence-transformers if available
+
+# Provider requests in flight per process
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+# Client-side rate limits (0 disables)
+LLM_REQUESTS_PER_MIN = float(os.getenv('LLM_REQUESTS_PER_MIN', '3000'))
+LLM_TOKENS_PER_MIN = float(os.getenv('LLM_TOKENS_PER_MIN', '1000000'))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '60'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '5'))
+# Backoff before retry n is uniform in [0, min(cap, base * 2**n)] seconds
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', '0.5'))
+LLM_BACKOFF_CAP = float(os.getenv('LLM_BACKOFF_CAP', '20'))
+# Inputs per embeddings request (provider limit) and how long to wait for more
+EMBED_BATCH_MAX = int(os.getenv('EMBED_BATCH_MAX', '2048'))
+EMBED_BATCH_WINDOW = float(os.getenv('EMBED_BATCH_WINDOW_MS', '5')) / 1000
+
 _llm_ready = False
 _model = None
 _encoder = None
 
+
+class LLMError(RuntimeError):
+    """A provider request failed after all retries."""
+
+
+def _estimate_tokens(texts) -> int:
+    return sum(len(t) for t in texts) // 4 + 1
+
+
+class TokenBucket:
+    """Allows `rate` units per minute with bursts up to one minute's worth."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, n: float = 1):
+        if self.rate <= 0:
+            return
+        n = min(n, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                await asyncio.sleep((n - self.tokens) / self.rate)
+
+
+class LLMClient:
+    """Async provider client; create and use it on a single event loop."""
+
+    def __init__(self, api_key: str, base_url: str = OPENAI_BASE_URL, transport=None,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY, requests_per_min: float = LLM_REQUESTS_PER_MIN,
+                 tokens_per_min: float = LLM_TOKENS_PER_MIN, max_retries: int = LLM_MAX_RETRIES,
+                 backoff_base: float = LLM_BACKOFF_BASE, backoff_cap: float = LLM_BACKOFF_CAP,
+                 batch_max: int = EMBED_BATCH_MAX, batch_window: float = EMBED_BATCH_WINDOW):
+        import httpx
+        self._http = httpx.AsyncClient(
+            base_url=base_url, transport=transport, timeout=httpx.Timeout(LLM_TIMEOUT, connect=10),
+            headers={'Authorization': f'Bearer {api_key}'},
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency))
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self._requests = TokenBucket(requests_per_min)
+        self._tokens = TokenBucket(tokens_per_min)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.batch_max = batch_max
+        self.batch_window = batch_window
+        self._pending = {}          # model -> [(texts, future)]
+        self._flushers = {}         # model -> scheduled flush task
+        self.stats = {'requests': 0, 'retries': 0, 'embed_batches': 0, 'embed_inputs': 0}
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    async def _send(self, path: str, payload: dict, tokens: int, stream: bool = False):
+        """POST with limits and retries; returns the response (open, if stream=True)."""
+        import httpx
+        for attempt in range(self.max_retries + 1):
+            await self._requests.acquire()
+            await self._tokens.acquire(tokens)
+            retry_after = None
+            try:
+                self.stats['requests'] += 1
+                req = self._http.build_request('POST', path, json=payload)
+                resp = await self._http.send(req, stream=stream)
+                if resp.status_code != 429 and resp.status_code < 500:
+                    if resp.status_code >= 400:
+                        body = (await resp.aread()).decode(errors='replace')[:500]
+                        await resp.aclose()
+                        raise LLMError(f'{path} returned {resp.status_code}: {body}')
+                    return resp
+                retry_after = resp.headers.get('retry-after')
+                error = LLMError(f'{path} returned {resp.status_code}')
+                await resp.aclose()
+            except httpx.TransportError as e:
+                error = e
+            if attempt == self.max_retries:
+                raise LLMError(f'{path} failed after {attempt + 1} attempts: {error}')
+            self.stats['retries'] += 1
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+
+    async def _post_json(self, path: str, payload: dict, tokens: int) -> dict:
+        async with self._sem:
+            resp = await self._send(path, payload, tokens)
+            return resp.json()
+
+    async def embed(self, texts: List[str], model: str = OPENAI_EMBED_MODEL) -> List[List[float]]:
+        """Embeddings for `texts`, sent together with other callers' texts where possible."""
+        if not texts:
+            return []
+        fut = asyncio.get_running_loop().create_future()
+        queue = self._pending.setdefault(model, [])
+        queue.append((list(texts), fut))
+        if sum(len(t) for t, _ in queue) >= self.batch_max:
+            self._flush(model)
+        elif model not in self._flushers:
+            self._flushers[model] = asyncio.get_running_loop().call_later(self.batch_window, self._flush, model)
+        return await fut
+
+    def _flush(self, model: str):
+        handle = self._flushers.pop(model, None)
+        if handle is not None:
+            handle.cancel()
+        queue = self._pending.pop(model, [])
+        # split into provider-sized requests without breaking up a caller's texts unless it alone is too big
+        batch, size = [], 0
+        for item in queue:
+            if batch and size + len(item[0]) > self.batch_max:
+                asyncio.ensure_future(self._embed_batch(model, batch))
+                batch, size = [], 0
+            batch.append(item)
+            size += len(item[0])
+        if batch:
+            asyncio.ensure_future(self._embed_batch(model, batch))
+
+    async def _embed_batch(self, model: str, batch):
+        inputs = [t for texts, _ in batch for t in texts]
+        try:
+            vectors = []
+            for i in range(0, len(inputs), self.batch_max):
+                part = inputs[i:i + self.batch_max]
+                data = await self._post_json('/embeddings', {'model': model, 'input': part}, _estimate_tokens(part))
+                vectors.extend(d['embedding'] for d in sorted(data['data'], key=lambda d: d['index']))
+                self.stats['embed_batches'] += 1
+            self.stats['embed_inputs'] += len(inputs)
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        pos = 0
+        for texts, fut in batch:
+            if not fut.done():
+                fut.set_result(vectors[pos:pos + len(texts)])
+            pos += len(texts)
+
+    async def chat(self, prompt: str, max_tokens: int = 300) -> str:
+        payload = {'model': OPENAI_CHAT_MODEL, 'messages': [{'role': 'user', 'content': prompt}],
+                   'max_tokens': max_tokens}
+        data = await self._post_json('/chat/completions', payload, _estimate_tokens([prompt]) + max_tokens)
+        return data['choices'][0]['message']['content']
+
+    async def stream_chat(self, prompt: str, max_tokens: int = 300) -> AsyncIterator[str]:
+        """Content deltas of a streamed chat completion; closing the iterator closes the connection."""
+        payload = {'model': OPENAI_CHAT_MODEL, 'messages': [{'role': 'user', 'content': prompt}],
+                   'max_tokens': max_tokens, 'stream': True}
+        async with self._sem:
+            resp = await self._send('/chat/completions', payload, _estimate_tokens([prompt]) + max_tokens,
+                                    stream=True)
+            try:
+                async for line in resp.aiter_lines():
+                    if not line.startswith('data:'):
+                        continue
+                    data = line[5:].strip()
+                    if data == '[DONE]':
+                        break
+                    choices = json.loads(data).get('choices') or []
+                    delta = choices[0].get('delta', {}).get('content') if choices else None
+                    if delta:
+                        yield delta
+            finally:
+                await resp.aclose()
+
+
+# --- process-wide client on a background event loop --------------------------------
+
+_loop = None
+_loop_pid = None
+_client: Optional[LLMClient] = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    global _loop, _loop_pid, _client
+    with _loop_lock:
+        # a forked worker needs its own loop thread and sockets
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='llm-loop', daemon=True).start()
+            _loop_pid = os.getpid()
+            _client = None
+        return _loop
+
+
+def _run(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+async def _anext(agen):
+    return await agen.__anext__()
+
+
+async def _make_client():
+    return LLMClient(OPENAI_KEY)
+
+
+def client_stats() -> Optional[dict]:
+    """Counters of the shared client, or None before the first provider call."""
+    return dict(_client.stats) if _client is not None else None
+
+
+def get_client() -> LLMClient:
+    """The shared client, created on the loop thread on first use."""
+    global _client
+    loop = _get_loop()
+    if _client is None:
+        client = asyncio.run_coroutine_threadsafe(_make_client(), loop).result()
+        with _loop_lock:
+            if _client is None:
+                _client = client
+    return _client
+
+
 def init_llm():
     global _llm_ready, _encoder
     if OPENAI_KEY:
@@ -12,7 +285,7 @@ def init_llm():
         return
     try:
         from sentence_transformers import SentenceTransformer
-        _encoder = SentenceTransformer('all-MiniLM-L6-v2')
+        _encoder = SentenceTransformer(LOCAL_EMBED_MODEL)
         _llm_ready = True
     except Exception as e:
         _llm_ready = False
@@ -20,26 +293,68 @@ def init_llm():
 def available():
     return _llm_ready
 
+def embedding_model():
+    """Name of the model embed_texts() uses; embeddings are cached per model."""
+    return OPENAI_EMBED_MODEL if OPENAI_KEY else LOCAL_EMBED_MODEL
+
+async def aembed_texts(texts):
+    if OPENAI_KEY:
+        return await get_client().embed(texts)
+    return await asyncio.to_thread(embed_texts, texts)
+
 def embed_texts(texts):
     """Return vector embeddings for list of texts. Uses OpenAI embeddings if key present, else sentence-transformers."""
     if OPENAI_KEY:
-        import openai
-        openai.api_key = OPENAI_KEY
-        resp = openai.Embedding.create(model='text-embedding-3-small', input=texts)
-        return [r['embedding'] for r in resp['data']]
+        client = get_client()
+        return _run(client.embed(list(texts)))
     else:
         if _encoder is None:
             raise RuntimeError('No embedding model available')
         return _encoder.encode(texts).tolist()
 
+def _prompt(question, snippets):
+    return f"You are a contract assistant. Answer the question concisely using ONLY the provided source snippets.\nQuestion: {question}\n\nSOURCES:\n" + "\n\n".join(snippets) + "\n\nProvide a short answer and bullet point the sources as (doc_id:start-end)."
+
+async def asynthesize_answer(question, snippets):
+    if not OPENAI_KEY:
+        return "\n\n".join(snippets)
+    with stage('synthesis'):
+        return await get_client().chat(_prompt(question, snippets))
+
 def synthesize_answer(question, snippets):
     """Simple synthesis: call OpenAI to produce a concise answer given question + snippets."""
     if not OPENAI_KEY:
         # fallback: naive join
         return "\n\n".join(snippets)
-    import openai, json
-    openai.api_key = OPENAI_KEY
-    prompt = f"You are a contract assistant. Answer the question concisely using ONLY the provided source snippets.\nQuestion: {question}\n\nSOURCES:\n" + "\n\n".join(snippets) + "\n\nProvide a short answer and bullet point the sources as (doc_id:start-end)."
-    resp = openai.ChatCompletion.create(model='gpt-4o-mini', messages=[{'role':'user','content':prompt}], max_tokens=300)
-    return resp['choices'][0]['message']['content']
+    client = get_client()
+    with stage('synthesis'):
+        return _run(client.chat(_prompt(question, snippets)))
 
+def stream_synthesis(question, snippets):
+    """
+    Generator of answer text pieces, forwarded from the provider's streaming mode as
+    they arrive. Without an API key the snippets themselves are streamed word by word.
+    Closing the generator closes the provider connection.
+    """
+    if not snippets:
+        return
+    if not OPENAI_KEY:
+        words = "\n\n".join(snippets).split()
+        for i, word in enumerate(words):
+            yield word if i == len(words) - 1 else word + " "
+        return
+    client = get_client()
+    agen = client.stream_chat(_prompt(question, snippets))
+    t0 = time.perf_counter()
+    try:
+        while True:
+            try:
+                delta = _run(_anext(agen))
+            except StopAsyncIteration:
+                break
+            if t0 is not None:
+                STAGE_LATENCY.observe('synthesis_first_token', value=time.perf_counter() - t0)
+                t0 = None
+            yield delta
+    finally:
+        _run(agen.aclose())
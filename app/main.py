@@ -1,90 +1,335 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-from typing import List, Optional
-from pathlib import Path
-import uuid, time
-from . import storage, extractors, retriever, rules
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Literal, Optional, Union
+from datetime import date
+import gc, os, uuid, time
+import anyio
+from . import (storage, retriever, rules, pool, jobs, migrate, dense, analysis, llm, telemetry, field_index, db,
+               audit as portfolio)
+from .telemetry import OPERATIONS, profiled
 
 app = FastAPI(title='Contract Intelligence (py3.12)', version='0.1')
+app.add_middleware(telemetry.RequestTimer)
 
-DATA_DIR = Path(__file__).resolve().parent.parent / 'data'
-DATA_DIR.mkdir(exist_ok=True)
-
-METRICS = {'ingest_count': 0, 'extract_count': 0, 'ask_count': 0, 'audit_count': 0}
+DATA_DIR = storage.DATA_DIR
+# preload(): also load the embedding model and FAISS index in the master (opt-in: PRELOAD_MODELS=1)
+PRELOAD_MODELS = os.getenv('PRELOAD_MODELS', '0') == '1'
+_preloaded = False
+# Upper bounds for /ask request sizes
+ASK_MAX_TOP_K = int(os.getenv('ASK_MAX_TOP_K', '100'))
+ASK_MAX_CANDIDATES = int(os.getenv('ASK_MAX_CANDIDATES', '2000'))
+ASK_MAX_BATCH = int(os.getenv('ASK_MAX_BATCH', '1000'))
 
 class IngestResponse(BaseModel):
+    job_id: str
     document_ids: List[str]
 
+def _load_data():
+    migrate.migrate_if_empty()
+    field_index.backfill()
+    retriever.load_or_build_index()
+
+def preload():
+    """
+    Called by gunicorn.conf.py in the master before it forks the workers: loads
+    the index, sklearn and (PRELOAD_MODELS) the embedding model once, so the
+    workers share those pages copy-on-write and skip loading at startup.
+    gc.freeze() keeps the workers' collections from writing to those objects.
+    SQLite connections opened here are closed so that none crosses the fork.
+    """
+    global _preloaded
+    _load_data()
+    retriever.warm()
+    if PRELOAD_MODELS:
+        dense.preload()
+    db.close_pool()
+    gc.collect()
+    gc.freeze()
+    _preloaded = True
+    print(f"✅ Preloaded in {telemetry.mark_startup('preload'):.2f}s; forking workers.")
+
+def _report_startup():
+    seconds = telemetry.mark_startup('ready')
+    memory = {k: v / 2 ** 20 for k, v in telemetry.memory_breakdown().items()}
+    usage = (f" (RSS {memory['rss']:.0f} MB, PSS {memory['pss']:.0f} MB, private {memory['private']:.0f} MB)"
+             if memory else '')
+    print(f"🚀 Worker {os.getpid()} ready in {seconds:.2f}s{usage}.")
+
 @app.on_event('startup')
 def startup():
-    retriever.init_index()
+    if not _preloaded:
+        _load_data()
+    _report_startup()
+
+@app.on_event('shutdown')
+def shutdown():
+    retriever.maybe_save_snapshot(force=True)
+    pool.shutdown()
 
 @app.post('/ingest', response_model=IngestResponse)
-async def ingest(files: List[UploadFile] = File(...), background_tasks: BackgroundTasks = None, webhook_url: Optional[str] = Form(None)):
+async def ingest(files: List[UploadFile] = File(...), webhook_url: Optional[str] = Form(None)):
+    """Stores the uploads and queues them for extraction; poll /jobs/{job_id} for progress."""
     if not files:
         raise HTTPException(status_code=400, detail='No files uploaded')
-    ids = []
-    for f in files:
-        content = await f.read()
-        doc_id = str(uuid.uuid4())
-        save_path = DATA_DIR / f'{doc_id}.pdf'
-        save_path.write_bytes(content)
-        text = storage.extract_text_from_pdf(save_path)
-        meta = {'filename': f.filename, 'size': len(content), 'ingested_at': int(time.time())}
-        storage.save_doc_json(doc_id, meta, text)
-        ids.append(doc_id)
-        METRICS['ingest_count'] += 1
-    retriever.invalidate_index()
-    retriever.init_index()
-    if webhook_url:
-        background_tasks.add_task(storage.post_webhook, webhook_url, {'event':'ingest_complete','document_ids': ids})
-    return {'document_ids': ids}
+    saved = []
+    try:
+        for f in files:
+            doc_id = str(uuid.uuid4())
+            save_path = DATA_DIR / f'{doc_id}.pdf'
+            # copy from the spooled upload to disk in chunks; never read the whole file
+            size, sha256 = await run_in_threadpool(storage.save_upload, f.file, save_path)
+            meta = {'filename': f.filename, 'size': size, 'sha256': sha256, 'ingested_at': int(time.time())}
+            # a SQLite write that can wait for the committer's transaction; keep it off the event loop
+            owner = await run_in_threadpool(jobs.claim_content_hash, sha256, doc_id)
+            if owner != doc_id:
+                # same bytes already ingested: reuse that document, skip extraction
+                await run_in_threadpool(save_path.unlink)
+                saved.append({'document_id': owner, 'path': None, 'metadata': meta, 'duplicate': True})
+            else:
+                saved.append({'document_id': doc_id, 'path': save_path, 'metadata': meta})
+            OPERATIONS.inc('ingest')
+    except BaseException:
+        # nothing was queued: the files already claimed would otherwise stay claimed
+        with anyio.CancelScope(shield=True):
+            for f in saved:
+                if not f.get('duplicate'):
+                    await run_in_threadpool(jobs.release_claim, f['metadata']['sha256'], f['document_id'])
+        raise
+    job_id = jobs.submit(saved, webhook_url=webhook_url)
+    return {'job_id': job_id, 'document_ids': [f['document_id'] for f in saved]}
+
+@app.get('/jobs/{job_id}')
+def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(404, 'job not found')
+    return job
 
 class ExtractRequest(BaseModel):
     document_id: str
 
 @app.post('/extract')
+@profiled
 def extract_body(payload: ExtractRequest):
-    METRICS['extract_count'] += 1
-    doc = storage.load_doc(payload.document_id)
-    if not doc:
+    OPERATIONS.inc('extract')
+    fields = analysis.get(payload.document_id, 'fields')
+    if fields is None:
         raise HTTPException(404, 'document not found')
-    fields = extractors.extract_structured_fields(doc['text'])
     return fields
 
+class CapRange(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    gt: Optional[float] = None
+    gte: Optional[float] = None
+    lt: Optional[float] = None
+    lte: Optional[float] = None
+
+class DateRange(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    gt: Optional[date] = None
+    gte: Optional[date] = None
+    lt: Optional[date] = None
+    lte: Optional[date] = None
+
+class FieldFilter(BaseModel):
+    """Conditions on extracted fields; all given conditions must hold."""
+    model_config = ConfigDict(extra='forbid')
+    governing_law: Optional[Union[str, List[str]]] = None   # case-insensitive, any of
+    effective_date: Optional[Union[date, DateRange]] = None
+    liability_cap: Optional[Union[float, CapRange]] = None
+    liability_unlimited: Optional[bool] = None
+    auto_renewal: Optional[bool] = None
+    confidentiality: Optional[bool] = None
+    party: Optional[str] = None                               # substring of either party
+
+def _filter_dict(f: Optional[FieldFilter]):
+    return f.model_dump(exclude_none=True) if f is not None else None
+
 class AskRequest(BaseModel):
     question: str
-    top_k: Optional[int] = 3
+    top_k: int = Field(3, ge=1, le=ASK_MAX_TOP_K)
+    document_id: Optional[str] = None
+    backend: Literal['tfidf', 'dense', 'hybrid'] = 'tfidf'
+    # hybrid only: TF-IDF candidates re-ranked with embeddings
+    candidates: Optional[int] = Field(None, ge=1, le=ASK_MAX_CANDIDATES)
+    # only search documents whose extracted fields match
+    filter: Optional[FieldFilter] = None
 
 @app.post('/ask')
+@profiled
 def ask(payload: AskRequest):
-    METRICS['ask_count'] += 1
-    results = retriever.answer_question(payload.question, top_k=payload.top_k)
+    OPERATIONS.inc('ask')
+    try:
+        results = retriever.answer_question(payload.question, top_k=payload.top_k,
+                                            document_id=payload.document_id, backend=payload.backend,
+                                            candidates=payload.candidates, filter=_filter_dict(payload.filter))
+    except dense.DenseUnavailable as e:
+        raise HTTPException(503, f'dense retrieval unavailable: {e}')
+    except ValueError as e:
+        raise HTTPException(400, f'invalid filter: {e}')
     return results
 
+class AskBatchRequest(BaseModel):
+    questions: List[str] = Field(..., max_length=ASK_MAX_BATCH)
+    top_k: int = Field(3, ge=1, le=ASK_MAX_TOP_K)
+    document_id: Optional[str] = None
+    backend: Literal['tfidf', 'dense', 'hybrid'] = 'tfidf'
+    candidates: Optional[int] = Field(None, ge=1, le=ASK_MAX_CANDIDATES)
+    filter: Optional[FieldFilter] = None
+
+@app.post('/ask/batch')
+@profiled
+def ask_batch(payload: AskBatchRequest):
+    """Scores many questions with one sparse matrix product per batch; results keep the input order."""
+    OPERATIONS.inc('ask', n=len(payload.questions))
+    try:
+        results = retriever.answer_questions(payload.questions, top_k=payload.top_k,
+                                             document_id=payload.document_id, backend=payload.backend,
+                                             candidates=payload.candidates, filter=_filter_dict(payload.filter))
+    except dense.DenseUnavailable as e:
+        raise HTTPException(503, f'dense retrieval unavailable: {e}')
+    except ValueError as e:
+        raise HTTPException(400, f'invalid filter: {e}')
+    return {'results': results}
+
+class SearchRequest(BaseModel):
+    filter: FieldFilter = FieldFilter()
+    limit: int = Field(100, ge=1, le=1000)
+    offset: int = Field(0, ge=0)
+
+@app.post('/search')
+def search(payload: SearchRequest):
+    """Documents whose extracted fields match the filter, with those fields, in ingest order."""
+    try:
+        return field_index.search(_filter_dict(payload.filter), limit=payload.limit, offset=payload.offset)
+    except ValueError as e:
+        raise HTTPException(400, f'invalid filter: {e}')
+
 @app.get('/ask/stream')
-def ask_stream(question: str, top_k: int = 3):
-    METRICS['ask_count'] += 1
-    gen = retriever.stream_answer(question, top_k=top_k)
-    return StreamingResponse(gen, media_type='text/event-stream')
+async def ask_stream(request: Request, question: str, top_k: int = Query(3, ge=1, le=ASK_MAX_TOP_K),
+                     backend: Literal['tfidf', 'dense', 'hybrid'] = 'tfidf'):
+    OPERATIONS.inc('ask')
+    if backend != 'tfidf':
+        # fail before the stream starts rather than halfway through it
+        try:
+            await run_in_threadpool(dense.check_available, needs_index=backend == 'dense')
+        except dense.DenseUnavailable as e:
+            raise HTTPException(503, f'dense retrieval unavailable: {e}')
+    gen = retriever.stream_answer(question, top_k=top_k, backend=backend)
+
+    async def events():
+        # one event is produced per send, so a slow client slows the provider stream down too
+        try:
+            while True:
+                event = await run_in_threadpool(next, gen, None)
+                if event is None:
+                    break
+                yield event
+                if await request.is_disconnected():
+                    break
+        finally:
+            # closing ends the provider stream, which can block; keep it off the event loop. After a
+            # disconnect this runs in a cancelled scope, so shield it or the close would be cancelled too
+            try:
+                with anyio.CancelScope(shield=True):
+                    await run_in_threadpool(gen.close)
+            except ValueError:
+                pass  # cancelled while a worker thread was still inside next(); it is closed when collected
+
+    return StreamingResponse(events(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 class AuditRequest(BaseModel):
     document_id: str
 
 @app.post('/audit')
+@profiled
 def audit(payload: AuditRequest):
-    METRICS['audit_count'] += 1
-    doc = storage.load_doc(payload.document_id)
-    if not doc:
+    OPERATIONS.inc('audit')
+    findings = analysis.get(payload.document_id, 'findings')
+    if findings is None:
         raise HTTPException(404, 'document not found')
-    findings = rules.run_audit_rules(payload.document_id, doc['text'])
     return {'findings': findings}
 
+class AuditFilter(BaseModel):
+    filename: Optional[str] = None           # glob, e.g. 'msa-*.pdf'
+    ingested_after: Optional[float] = None   # unix time
+    ingested_before: Optional[float] = None
+
+class BulkAuditRequest(BaseModel):
+    document_ids: Optional[List[str]] = None
+    all: bool = False
+    filter: Optional[AuditFilter] = None
+
+@app.post('/audit/bulk')
+def audit_bulk(payload: BulkAuditRequest):
+    """
+    Streams findings as NDJSON in completion order; current stored findings are
+    not recomputed. A filter without document_ids selects from all documents.
+    """
+    filtered = payload.filter is not None and payload.filter.model_dump(exclude_none=True)
+    if not payload.all and payload.document_ids is None and not filtered:
+        raise HTTPException(400, 'give document_ids, a filter or all=true')
+    f = payload.filter or AuditFilter()
+    ids = portfolio.select_documents(None if payload.all else payload.document_ids,
+                                     f.filename, f.ingested_after, f.ingested_before)
+    OPERATIONS.inc('audit', n=len(ids))
+    return StreamingResponse(portfolio.iter_ndjson(ids), media_type='application/x-ndjson')
+
 @app.get('/healthz')
 def healthz():
     return {'status': 'ok'}
 
-@app.get('/metrics')
+@app.get('/metrics', response_class=PlainTextResponse)
 def metrics():
-    return METRICS
+    """Prometheus text format."""
+    return PlainTextResponse(telemetry.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _index_gauges():
+    stats = retriever.index_stats()
+    return {'_labels': ('field',), **{(k,): int(v) for k, v in stats.items()}}
+
+
+def _dense_gauges():
+    stats = dense.index_stats()
+    return stats['vectors'] if stats['active'] else None
+
+
+def _cache_counters():
+    cache = retriever.cache_stats()
+    return {'_labels': ('result',), ('hit',): cache['hits'], ('miss',): cache['misses']}
+
+
+def _rule_metrics(field):
+    def read():
+        stats = rules.rule_stats()
+        values = {(rule,): s[field] / 1000 if field == 'total_ms' else s[field] for rule, s in stats.items()}
+        return {'_labels': ('rule',), **values}
+    return read
+
+
+def _llm_counters():
+    stats = llm.client_stats()
+    return {'_labels': ('event',), **{(k,): v for k, v in stats.items()}} if stats else None
+
+
+telemetry.gauge('contract_index', 'TF-IDF index size (documents, chunks, nnz, tail_blocks, generation, ...).',
+                _index_gauges)
+telemetry.gauge('contract_dense_index_vectors', 'Vectors in the FAISS index.', _dense_gauges)
+telemetry.gauge('contract_query_cache_size', 'Answers held in the query cache.',
+                lambda: retriever.cache_stats()['size'])
+telemetry.gauge('contract_query_cache_lookups_total', 'Query cache lookups by result.', _cache_counters,
+                type='counter')
+telemetry.gauge('contract_ruleset_info', 'Loaded audit ruleset.',
+                lambda: {'_labels': ('version',), (rules.ruleset_version(),): 1})
+telemetry.gauge('contract_audit_rule_evaluations_total', 'Audit rule evaluations.', _rule_metrics('calls'),
+                type='counter')
+telemetry.gauge('contract_audit_rule_seconds_total', 'Time spent evaluating each audit rule.',
+                _rule_metrics('total_ms'), type='counter')
+telemetry.gauge('contract_llm_client_total', 'Provider requests, retries and embedding batches.', _llm_counters,
+                type='counter')
+
+telemetry.mark_startup('import')
@@ -0,0 +1,52 @@
+"""
+Imports per-document JSON files written by earlier versions (data/<id>.json)
+into the SQLite document store.
+
+    python -m app.migrate [--batch-size 500] [--delete]
+"""
+import argparse
+import json
+
+from . import db, storage
+
+
+def migrate(batch_size: int = 500, delete: bool = False) -> int:
+    """Bulk-inserts legacy JSON documents not yet in the store; returns how many were imported."""
+    existing = set(db.document_ids())
+    imported, migrated_paths, batch = 0, [], []
+    for p in storage.legacy_json_docs():
+        migrated_paths.append(p)
+        if p.stem in existing:
+            continue
+        try:
+            rec = json.loads(p.read_text(encoding='utf-8'))
+        except Exception as e:
+            print(f"⚠️ Skipping unreadable {p.name}: {e}")
+            migrated_paths.pop()
+            continue
+        batch.append((rec.get('id') or p.stem, rec.get('metadata') or {}, rec.get('text') or ''))
+        if len(batch) >= batch_size:
+            storage.save_docs(batch)
+            imported += len(batch)
+            batch = []
+    storage.save_docs(batch)
+    imported += len(batch)
+    if delete:
+        for p in migrated_paths:
+            p.unlink()
+    print(f"✅ Migrated {imported} JSON document(s) into {db.DB_PATH.name}.")
+    return imported
+
+
+def migrate_if_empty():
+    """First start after upgrading: import legacy JSON files into an empty store."""
+    if db.count_documents() == 0 and storage.legacy_json_docs():
+        migrate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--delete', action='store_true', help='remove JSON files once imported')
+    args = parser.parse_args()
+    migrate(batch_size=args.batch_size, delete=args.delete)
@@ -0,0 +1,246 @@
+"""
+Process pool for CPU-bound PDF work, so PyMuPDF never runs on the event loop.
+
+Large PDFs are split into page ranges that are extracted in parallel and
+reassembled in page order. The number of files in flight is bounded, so a
+big batch of uploads queues up here instead of saturating every core.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import BrokenExecutor, Future, InvalidStateError, ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from . import storage
+
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', str(os.cpu_count() or 2)))
+# Max files being extracted at once; further submissions wait for a slot
+EXTRACT_QUEUE_SIZE = int(os.getenv('EXTRACT_QUEUE_SIZE', str(EXTRACT_WORKERS * 2)))
+# Per-file timeout in seconds
+EXTRACT_TIMEOUT = float(os.getenv('EXTRACT_TIMEOUT', '300'))
+# PDFs with more pages than this are split into ranges of this size
+PAGES_PER_TASK = int(os.getenv('EXTRACT_PAGES_PER_TASK', '25'))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(EXTRACT_QUEUE_SIZE)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """Returns the shared process pool, starting it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a process that already runs server threads is unsafe
+            _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def shutdown():
+    """Stops the pool, dropping queued work."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _retire(stuck: ProcessPoolExecutor):
+    """
+    Replaces `stuck` (a task in it hung past its timeout) with a fresh pool for
+    the next get_pool(). Tasks other files already have running there finish
+    where they are; the ones still queued are cancelled and resubmitted to the
+    new pool by their files (see _start). The hung worker process exits once
+    its task returns.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is stuck:
+            _pool = None
+    stuck.shutdown(wait=False, cancel_futures=True)
+
+
+def _page_ranges(n_pages: int):
+    return [(i, min(n_pages, i + PAGES_PER_TASK)) for i in range(0, n_pages, PAGES_PER_TASK)]
+
+
+def _settle(result: Future, text: str):
+    try:
+        result.set_result(text)
+    except InvalidStateError:
+        pass  # cancelled after a timeout
+
+
+def _fail(result: Future, error: BaseException):
+    try:
+        result.set_exception(error)
+    except InvalidStateError:
+        pass
+
+
+class _Extraction(Future):
+    """Text of one file; `tasks` are the (pool, future) pairs of the process-pool work behind it."""
+
+    def __init__(self):
+        super().__init__()
+        self.tasks = []
+        self.release_slot = None
+
+    def running_pools(self):
+        return {pool for pool, t in self.tasks if t.running()}
+
+
+def _start(path: Path) -> Future:
+    """
+    Schedules extraction of one file; the caller must already hold a slot. The
+    slot is released once every process task of the file has finished (or was
+    cancelled before starting), not when the result is settled, so a task still
+    running after a timeout keeps counting against EXTRACT_QUEUE_SIZE until its
+    pool is retired. A task cancelled because its pool was retired (rather than
+    because this file timed out) is resubmitted to the current pool.
+    """
+    result = _Extraction()
+    lock = threading.Lock()
+    state = {'outstanding': 0, 'released': False, 'remaining': 0}
+    pages = {}   # page range index -> pages
+
+    def release_slot():
+        with lock:
+            if state['released']:
+                return
+            state['released'] = True
+        _slots.release()
+
+    def task_done():
+        with lock:
+            state['outstanding'] -= 1
+            finished = state['outstanding'] == 0
+        if finished:
+            release_slot()
+
+    def submit(callback, fn, *args) -> bool:
+        with lock:
+            state['outstanding'] += 1
+        try:
+            pool = get_pool()
+            task = pool.submit(fn, *args)
+        except RuntimeError as e:
+            # pool shut down or broken underneath us
+            _fail(result, e)
+            task_done()
+            return False
+        result.tasks.append((pool, task))
+        task.add_done_callback(callback)
+        return True
+
+    def retired(task):
+        return task.cancelled() and not result.done()
+
+    def on_part(k, a, b):
+        def callback(t):
+            try:
+                if result.done():
+                    return
+                if retired(t):
+                    submit(on_part(k, a, b), storage.extract_pages, path, a, b)
+                    return
+                try:
+                    part = t.result()
+                except BrokenExecutor as e:
+                    _fail(result, e)
+                    return
+                except Exception as e:
+                    print(f"⚠️ PDF read error: {e}")
+                    _settle(result, '')
+                    return
+                with lock:
+                    pages[k] = part
+                    state['remaining'] -= 1
+                    finished = state['remaining'] == 0
+                if finished:
+                    _settle(result, storage.join_pages([p for k in sorted(pages) for p in pages[k]]))
+            finally:
+                task_done()
+        return callback
+
+    def on_count(f):
+        try:
+            if result.done():
+                return
+            if retired(f):
+                submit(on_count, storage.page_count, path)
+                return
+            if not f.cancelled() and isinstance(f.exception(), BrokenExecutor):
+                _fail(result, f.exception())
+                return
+            n_pages = 0 if f.cancelled() or f.exception() else f.result()
+            if n_pages == 0:
+                _settle(result, '')
+                return
+            ranges = _page_ranges(n_pages)
+            state['remaining'] = len(ranges)
+            for k, (a, b) in enumerate(ranges):
+                # each range gets its callback as soon as it is submitted, so a failure
+                # halfway leaves no counted task without one
+                if not submit(on_part(k, a, b), storage.extract_pages, path, a, b):
+                    for _, t in result.tasks:
+                        t.cancel()
+                    return
+        finally:
+            task_done()
+
+    def cancel_tasks(f):
+        if f.cancelled():
+            for _, t in result.tasks:
+                t.cancel()
+
+    result.release_slot = release_slot
+    result.add_done_callback(cancel_tasks)
+    submit(on_count, storage.page_count, path)
+    return result
+
+
+def submit_task(fn, *args) -> Future:
+    """
+    Runs fn(*args) in the pool under one of the slots extraction uses, so other
+    bulk work (portfolio audits) cannot queue up in front of ingest and eat into
+    its EXTRACT_TIMEOUT. Blocks while EXTRACT_QUEUE_SIZE tasks are in flight.
+    """
+    _slots.acquire()
+    try:
+        task = get_pool().submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    task.add_done_callback(lambda _: _slots.release())
+    return task
+
+
+def submit_extract(path: Path) -> Future:
+    """
+    Queues a PDF for extraction and returns a Future with its text.
+    Blocks while EXTRACT_QUEUE_SIZE files are already in flight.
+    """
+    _slots.acquire()
+    return _start(Path(path))
+
+
+def extract_text(path: Path, timeout: float = EXTRACT_TIMEOUT) -> str:
+    """Blocking extraction for worker threads. Raises TimeoutError after `timeout` seconds."""
+    fut = submit_extract(path)
+    try:
+        return fut.result(timeout=timeout)
+    except TimeoutError:
+        fut.cancel()
+        stuck = fut.running_pools()
+        if stuck:
+            # PyMuPDF is stuck on this file: move everything else to a fresh pool, and stop
+            # counting this file against EXTRACT_QUEUE_SIZE, since it no longer holds up that pool
+            print(f"⚠️ Extraction of {Path(path).name} hung; restarting the extraction pool.")
+            for pool in stuck:
+                _retire(pool)
+            fut.release_slot()
+        raise
+
@@ -1,164 +1,1015 @@
 import html
 import json
+import os
+import threading
+import time
 import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import List, Optional
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from . import storage
+
+import numpy as np
+import scipy.sparse as sp
+from . import chunking, storage
+from .cache import QueryCache, normalize_question
+from . import telemetry
+from .telemetry import stage
+
+# Hashed term space: the vocabulary never has to be refitted, so new documents
+# can be vectorized on their own and appended to the existing matrix.
+N_FEATURES = 2 ** 20
+# Re-weight the matrix with fresh IDF once the corpus has grown by this fraction.
+IDF_REFRESH_RATIO = float(os.getenv('INDEX_IDF_REFRESH_RATIO', '0.1'))
+# Merge a shard's appended row blocks into its main matrix once there are this many.
+MAX_TAIL_BLOCKS = int(os.getenv('INDEX_MAX_TAIL_BLOCKS', '32'))
+# A shard takes no more documents once it holds this many chunks
+INDEX_SHARD_ROWS = int(os.getenv('INDEX_SHARD_ROWS', '50000'))
+# Threads scoring shards in parallel; sparse products and partitions release the GIL
+SEARCH_THREADS = int(os.getenv('SEARCH_THREADS', str(os.cpu_count() or 1)))
+MAX_DOC_CHARS = 2_000_000
+# Chunks vectorized per batch while streaming documents into the index
+INDEX_BATCH_CHUNKS = int(os.getenv('INDEX_BATCH_CHUNKS', '2000'))
+# Questions scored per sparse matrix product by answer_questions()
+ASK_BATCH_SIZE = int(os.getenv('ASK_BATCH_SIZE', '256'))
+# Estimated non-zeros of one shard's (rows x questions) product; wider batches are scored in column groups.
+# Contract-wide terms match nearly every chunk, so without a cap the product is close to dense.
+SCORE_NNZ_BUDGET = int(os.getenv('SCORE_NNZ_BUDGET', '2000000'))
+# backend='hybrid': sparse candidates per question that are re-scored with embeddings
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '200'))
+# Answers kept for repeated questions (0 disables) and how long, in seconds
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '1024'))
+QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', '600'))
+
+# On-disk snapshot of the index, shared by every worker on the host
+INDEX_DIR = storage.DATA_DIR / 'index'
+SNAPSHOT_VERSION = 5
+# Memory-map snapshot arrays instead of reading them into each worker
+INDEX_MMAP = os.getenv('INDEX_MMAP', '1') == '1'
+# Minimum seconds between snapshots written after incremental ingests
+SNAPSHOT_INTERVAL = float(os.getenv('INDEX_SNAPSHOT_INTERVAL', '60'))
+
+
+class _Column:
+    """Append-only NumPy array with amortized growth."""
+
+    def __init__(self, dtype, data=None):
+        self._buf = np.empty(0, dtype=dtype) if data is None else data
+        self._n = len(self._buf)
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def values(self):
+        return self._buf[:self._n]
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._buf.dtype)
+        need = self._n + len(values)
+        if need > len(self._buf):
+            # also replaces read-only memory-mapped buffers on first append
+            buf = np.empty(max(need, 2 * len(self._buf), 1024), dtype=self._buf.dtype)
+            buf[:self._n] = self._buf[:self._n]
+            self._buf = buf
+        self._buf[self._n:need] = values
+        self._n = need
+
+
+class ChunkMeta:
+    """
+    Per-row chunk metadata kept in NumPy arrays: interned document index (int32),
+    start/end offsets (int64) and page number (int32, 0 if unknown). A document's chunks occupy consecutive rows,
+    so doc_lo/doc_hi give its row range and filtering by document is a slice.
+    """
+
+    def __init__(self):
+        self.doc_ids: List[str] = []
+        self.doc_pos = {}
+        self.row_doc = _Column(np.int32)
+        self.start = _Column(np.int64)
+        self.end = _Column(np.int64)
+        self.page = _Column(np.int32)
+        self.doc_lo = _Column(np.int64)
+        self.doc_hi = _Column(np.int64)
+
+    def __len__(self):
+        return len(self.row_doc)
+
+    def add_doc(self, doc_id: str, starts, ends, pages=None):
+        if not starts:
+            return
+        k = len(self.doc_ids)
+        lo = len(self)
+        self.doc_ids.append(doc_id)
+        self.doc_pos[doc_id] = k
+        self.row_doc.extend(np.full(len(starts), k, dtype=np.int32))
+        self.start.extend(starts)
+        self.end.extend(ends)
+        self.page.extend(np.zeros(len(starts), dtype=np.int32) if pages is None else pages)
+        self.doc_lo.extend([lo])
+        self.doc_hi.extend([lo + len(starts)])
+
+    def extend(self, other: "ChunkMeta"):
+        """Append rows of `other`, which were vectorized after the current rows."""
+        k, n = len(self.doc_ids), len(self)
+        for i, doc_id in enumerate(other.doc_ids):
+            self.doc_pos[doc_id] = k + i
+        self.doc_ids.extend(other.doc_ids)
+        self.row_doc.extend(other.row_doc.values + k)
+        self.start.extend(other.start.values)
+        self.end.extend(other.end.values)
+        self.page.extend(other.page.values)
+        self.doc_lo.extend(other.doc_lo.values + n)
+        self.doc_hi.extend(other.doc_hi.values + n)
+
+    def rows_for(self, doc_id: str):
+        """(lo, hi) row range of a document, or None if it has no chunks."""
+        k = self.doc_pos.get(doc_id)
+        if k is None:
+            return None
+        return int(self.doc_lo.values[k]), int(self.doc_hi.values[k])
+
+    def ranges_for(self, doc_ids):
+        """Sorted, merged (lo, hi) row ranges covering the chunks of `doc_ids`."""
+        ks = np.fromiter((self.doc_pos[d] for d in doc_ids if d in self.doc_pos), dtype=np.int64)
+        if not len(ks):
+            return []
+        los = self.doc_lo.values[ks]
+        order = np.argsort(los, kind="stable")
+        ranges = []
+        for lo, hi in zip(los[order].tolist(), self.doc_hi.values[ks][order].tolist()):
+            if ranges and ranges[-1][1] == lo:
+                ranges[-1] = (ranges[-1][0], hi)
+            else:
+                ranges.append((lo, hi))
+        return ranges
+
+    def row(self, i: int):
+        return (self.doc_ids[self.row_doc.values[i]], int(self.start.values[i]), int(self.end.values[i]))
+
+    def hit(self, i: int, score):
+        """(span, score, page or None) for a ranked row."""
+        page = int(self.page.values[i])
+        return self.row(i), score, page or None
+
+    def save(self, path: Path):
+        for name in ("row_doc", "start", "end", "page", "doc_lo", "doc_hi"):
+            np.save(path / f"{name}.npy", getattr(self, name).values)
+        (path / "docs.json").write_text(json.dumps(self.doc_ids), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path: Path, mmap_mode=None):
+        meta = cls()
+        meta.doc_ids = json.loads((path / "docs.json").read_text(encoding="utf-8"))
+        meta.doc_pos = {d: k for k, d in enumerate(meta.doc_ids)}
+        for name in ("row_doc", "start", "end", "page", "doc_lo", "doc_hi"):
+            col = getattr(meta, name)
+            setattr(meta, name, _Column(col.values.dtype, np.load(path / f"{name}.npy", mmap_mode=mmap_mode)))
+        return meta
+
+
+class Shard:
+    """
+    Rows [lo, lo + rows) of the index, always whole documents: a main matrix
+    plus the row blocks appended since it was last compacted. Only the newest
+    shard takes new documents, so appends and compaction touch one shard.
+    """
+
+    def __init__(self, lo: int):
+        self.lo = lo
+        self.rows = 0
+        self.vectors = None
+        self.tail: List = []
+        self.saved: Optional[Path] = None   # snapshot directory already holding exactly these rows
+
+    @property
+    def hi(self):
+        return self.lo + self.rows
+
+    def blocks(self):
+        return ([self.vectors] if self.vectors is not None else []) + self.tail
+
+    def append(self, block):
+        if self.vectors is None and not self.tail:
+            self.vectors = block
+        else:
+            self.tail.append(block)
+        self.rows += block.shape[0]
+        self.saved = None
+        if len(self.tail) >= MAX_TAIL_BLOCKS:
+            self.compact()
+
+    def compact(self):
+        """Fold appended row blocks into the main matrix."""
+        if self.tail:
+            self.vectors = _stack_rows(self.blocks())
+            self.tail = []
+
+    def reweight(self, factor):
+        """Multiply every weight by factor[feature] and re-normalize the rows."""
+        self.compact()
+        if self.vectors is None:
+            return
+        if not self.vectors.data.flags.writeable:
+            # memory-mapped snapshot: take a private copy before re-weighting
+            self.vectors = self.vectors.copy()
+        self.vectors.data *= factor[self.vectors.indices]
+        _normalize_rows(self.vectors)
+        self.saved = None
+
+    def slice(self, lo: int, hi: int):
+        """Index rows [lo, hi), which lie inside this shard; a document's rows always sit inside one block."""
+        offset = self.lo
+        for block in self.blocks():
+            n = block.shape[0]
+            if offset <= lo and hi <= offset + n:
+                return block[lo - offset:hi - offset]
+            offset += n
+        self.compact()
+        return self.vectors[lo - self.lo:hi - self.lo]
+
+    def score(self, query_cols, top_k: int, ranges=None):
+        """
+        [(index row ids, scores)] per query: the top_k of this shard's rows, or
+        of the (lo, hi) row ranges given, which lie inside the shard.
+        `query_cols` is the transposed query batch (features x queries) in CSR.
+        """
+        row_map = None
+        if ranges is None:
+            blocks, offset, n_rows = self.blocks(), self.lo, self.rows
+        elif len(ranges) == 1:
+            lo, hi = ranges[0]
+            blocks, offset, n_rows = [self.slice(lo, hi)], lo, hi - lo
+        else:
+            # many documents: gather their rows into one matrix and map results back
+            self.compact()
+            row_map = np.concatenate([np.arange(lo, hi) for lo, hi in ranges])
+            blocks, offset, n_rows = [self.vectors[row_map - self.lo]], 0, len(row_map)
+        # (rows x queries); only chunks sharing a term with a query are materialized
+        parts = [b @ query_cols for b in blocks]
+        sims = (sp.vstack(parts) if len(parts) > 1 else parts[0]).tocsc()
+        ranked = []
+        for j in range(query_cols.shape[1]):
+            a, b = sims.indptr[j], sims.indptr[j + 1]
+            rows = sims.indices[a:b].astype(np.int64)
+            scores = sims.data[a:b]
+            if len(rows) < top_k:
+                # too few matching chunks: pad with zero-score rows so top_k results still come back
+                pad = np.setdiff1d(np.arange(min(n_rows, top_k + len(rows))), rows)[:top_k - len(rows)]
+                rows = np.concatenate([rows, pad])
+                scores = np.concatenate([scores, np.zeros(len(pad))])
+            rows, scores = _top_k(rows, scores, top_k)
+            ranked.append((rows + offset if row_map is None else row_map[rows], scores))
+        return ranked
+
 
 # Globals
-_chunks: List[tuple] = []    # list of (doc_id, start, end, text)
-_vectors = None              # TF-IDF matrix (sparse)
-_tfidf: Optional[TfidfVectorizer] = None
-_meta: List[dict] = []       # list of metadata dicts matching _chunks positions
-
-
-def safe_chunk_text(text: str, doc_id: str, chunk_size: int = 1000, overlap: int = 200):
-    """Split large text safely into overlapping chunks."""
-    chunks = []
-    n = len(text)
-    if n == 0:
-        return chunks
-    try:
-        i = 0
-        while i < n:
-            start = i
-            end = min(n, i + chunk_size)
-            chunk_text = text[start:end]
-            chunks.append((doc_id, start, end, chunk_text))
-            if end >= n:
-                break
-            i = end - overlap
-    except MemoryError:
-        print(f"⚠️ MemoryError while chunking doc {doc_id}. Skipping remainder.")
-    except Exception:
-        print(f"⚠️ Unexpected error while chunking doc {doc_id}:")
-        traceback.print_exc()
-    return chunks
+_shards: List[Shard] = []    # TF-IDF rows (sparse, L2-normalized) split by document, in row order
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid = None
+_tfidf = None                # HashingVectorizer, created on first use (see _vectorizer)
+_meta = ChunkMeta()          # chunk offsets per matrix row; text stays in the store
+_df = None                   # per-feature chunk frequency over the whole index
+_idf = None                  # IDF weights the stored rows are currently weighted with
+_idf_rows = 0                # number of chunks when _idf was last recomputed
+_indexed: set = set()        # doc ids already present in the index
+_build_id = None             # changes whenever rows are renumbered by a full rebuild
+_ready = False
+_dirty = False               # index changed since the last snapshot
+_last_saved = 0.0
+_generation = 0              # bumped on every index change; cached answers from older generations are ignored
+_lock = threading.RLock()
+_query_cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+
+
+def _vectorizer_params():
+    return {"n_features": N_FEATURES, "stop_words": "english",
+            "alternate_sign": False, "norm": None}
+
+
+def _make_vectorizer():
+    # sklearn takes most of this module's import time, so it is only imported once text is vectorized
+    from sklearn.feature_extraction.text import HashingVectorizer
+    return HashingVectorizer(**_vectorizer_params())
+
+
+def _vectorizer():
+    """The hashing vectorizer; it is stateless, so a loaded snapshot does not need one until the first query."""
+    global _tfidf
+    if _tfidf is None:
+        _tfidf = _make_vectorizer()
+    return _tfidf
+
+
+def _normalize_rows(m):
+    """L2-normalize the rows of a CSR matrix in place."""
+    from sklearn.preprocessing import normalize
+    return normalize(m, norm="l2", copy=False)
+
+
+def warm():
+    """Import sklearn and create the vectorizer now instead of on the first query (before forking workers)."""
+    _vectorizer()
+    _normalize_rows(sp.csr_matrix((1, N_FEATURES)))
+
+
+def _compute_idf(df, n_rows):
+    # Same smoothing as sklearn's TfidfTransformer(smooth_idf=True)
+    return np.log((1.0 + n_rows) / (1.0 + df)) + 1.0
+
+
+def _weight(counts, idf):
+    """Apply IDF weights to a raw count block and L2-normalize its rows in place."""
+    counts.data *= idf[counts.indices]
+    return _normalize_rows(counts)
+
+
+def _chunk_freq(counts):
+    counts.sum_duplicates()
+    return np.bincount(counts.indices, minlength=N_FEATURES)
+
+
+def _stack_rows(blocks: list):
+    """
+    Stack CSR row blocks into one matrix, releasing each block once copied,
+    so peak memory stays close to the size of the result.
+    """
+    if not blocks:
+        return None
+    nnz = sum(b.nnz for b in blocks)
+    n_rows = sum(b.shape[0] for b in blocks)
+    idx_dtype = np.int64 if nnz > np.iinfo(np.int32).max else np.int32
+    data = np.empty(nnz, dtype=np.float64)
+    indices = np.empty(nnz, dtype=idx_dtype)
+    indptr = np.zeros(n_rows + 1, dtype=idx_dtype)
+    pos = row = 0
+    blocks.reverse()
+    while blocks:
+        b = blocks.pop()
+        data[pos:pos + b.nnz] = b.data
+        indices[pos:pos + b.nnz] = b.indices
+        indptr[row + 1:row + 1 + b.shape[0]] = b.indptr[1:] + pos
+        pos += b.nnz
+        row += b.shape[0]
+        del b
+    return sp.csr_matrix((data, indices, indptr), shape=(n_rows, N_FEATURES), copy=False)
+
+
+def _row_view(m, lo: int, hi: int):
+    """Rows [lo, hi) of a CSR matrix, sharing its data instead of copying it."""
+    a, b = m.indptr[lo], m.indptr[hi]
+    return sp.csr_matrix((m.data[a:b], m.indices[a:b], m.indptr[lo:hi + 1] - a), shape=(hi - lo, m.shape[1]),
+                         copy=False)
+
+
+def _cut(meta: ChunkMeta, room: int):
+    """
+    Row ranges splitting `meta`'s documents into shard-sized runs: the first
+    closes once it reaches `room` rows, the others at INDEX_SHARD_ROWS.
+    """
+    ranges, start = [], 0
+    for hi in meta.doc_hi.values.tolist():
+        if hi - start >= room:
+            ranges.append((start, hi))
+            start, room = hi, INDEX_SHARD_ROWS
+    if start < len(meta):
+        ranges.append((start, len(meta)))
+    return ranges
+
+
+def _append_rows(vectors, meta: ChunkMeta):
+    """Add weighted rows for `meta`'s documents to the newest shard, opening new shards as it fills up."""
+    base = len(_meta)
+    shard = _shards[-1] if _shards else None
+    room = INDEX_SHARD_ROWS - shard.rows if shard is not None else 0
+    for lo, hi in _cut(meta, room if room > 0 else INDEX_SHARD_ROWS):
+        if shard is None or shard.rows >= INDEX_SHARD_ROWS:
+            if shard is not None:
+                # full: no more appends, so merge its tail once
+                shard.compact()
+            shard = Shard(base + lo)
+            _shards.append(shard)
+        shard.append(_row_view(vectors, lo, hi))
+    _meta.extend(meta)
+
+
+def _search_pool():
+    global _pool, _pool_pid
+    # threads do not survive a fork: a preforked worker starts its own pool
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="shard-search")
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def _each_shard(fn, items):
+    """[fn(item)] for per-shard work items, on the search threads when there is more than one."""
+    if len(items) > 1 and SEARCH_THREADS > 1:
+        return list(_search_pool().map(fn, items))
+    return [fn(item) for item in items]
+
+
+def _vectorize_docs(doc_ids: Optional[List[str]] = None):
+    """
+    Stream stored documents (all, or just doc_ids) through the vectorizer.
+    Chunks are cut as offsets and only INDEX_BATCH_CHUNKS chunk strings exist
+    at any time. Returns (raw count matrix or None, ChunkMeta, doc ids seen).
+    """
+    meta, blocks, batch, seen = ChunkMeta(), [], [], []
+
+    def flush():
+        with stage("vectorize"):
+            block = _vectorizer().transform(batch)
+            block.sum_duplicates()
+        blocks.append(block)
+        batch.clear()
+
+    for doc_id, text in storage.iter_doc_texts(doc_ids):
+        seen.append(doc_id)
+        text = text or ""
+        # Optionally truncate extremely large docs to a reasonable limit
+        if len(text) > MAX_DOC_CHARS:
+            print(f"⚠️ Document {doc_id} is very large; truncating to 2,000,000 chars for indexing.")
+        text = text[:MAX_DOC_CHARS]
+        with stage("chunk"):
+            spans = chunking.chunk_spans(text)
+            starts = [start for start, _ in spans]
+            pages = chunking.page_numbers(text, starts)
+        for start, end in spans:
+            batch.append(text[start:end])
+            if len(batch) >= INDEX_BATCH_CHUNKS:
+                flush()
+        meta.add_doc(doc_id, starts, [end for _, end in spans], pages)
+    if batch:
+        flush()
+    return _stack_rows(blocks), meta, seen
+
+
+def _reset():
+    global _shards, _tfidf, _meta, _df, _idf, _idf_rows, _indexed, _ready, _dirty, _build_id, _generation
+    _generation += 1
+    _shards = []
+    _tfidf = None
+    _meta = ChunkMeta()
+    _df = None
+    _idf = None
+    _idf_rows = 0
+    _indexed = set()
+    _build_id = None
+    _ready = False
+    _dirty = False
 
 
 def init_index():
     """Build TF-IDF index over all stored docs."""
-    global _chunks, _vectors, _tfidf, _meta
+    global _df, _idf, _idf_rows, _indexed, _ready, _dirty, _build_id
     print("🔍 Initializing document index...")
-    _chunks = []
-    _meta = []
+    with _lock, stage("index_build"):
+        _reset()
+        try:
+            _build_id = uuid.uuid4().hex
+            counts, meta, docs = _vectorize_docs()
+            _indexed = set(docs)
+            if counts is not None:
+                print(f"✅ Weighting TF-IDF matrix for {len(meta)} chunks...")
+                _df = _chunk_freq(counts)
+                _idf_rows = len(meta)
+                _idf = _compute_idf(_df, _idf_rows)
+                _append_rows(_weight(counts, _idf), meta)
+                print(f"✅ Index initialization complete ({len(_shards)} shard(s)).")
+            else:
+                print("ℹ️ No text chunks to index.")
+            _ready = True
+            _dirty = True
+        except MemoryError:
+            print("❌ MemoryError during index build. Try smaller documents or increase RAM.")
+            _reset()
+        except Exception:
+            print("❌ Unexpected error during index build:")
+            traceback.print_exc()
+            _reset()
+
+
+def add_documents(doc_ids: List[str]):
+    """
+    Append newly stored documents to the newest shard without touching the rest of the corpus.
+    Only the new chunks are vectorized; IDF is refreshed lazily (see _refresh_idf).
+    """
+    global _df, _idf, _idf_rows, _dirty, _generation
+    with _lock:
+        if not _ready:
+            init_index()
+            return
+        new_ids = [d for d in doc_ids if d not in _indexed]
+        if not new_ids:
+            return
+        t0 = time.perf_counter()
+        try:
+            counts, meta, _ = _vectorize_docs(new_ids)
+            _indexed.update(new_ids)
+            if counts is None:
+                return
+            freq = _chunk_freq(counts)
+            _df = freq if _df is None else _df + freq
+            if _idf is None:
+                # first rows of an empty index: weight them with their own IDF
+                _idf_rows = len(meta)
+                _idf = _compute_idf(_df, _idf_rows)
+            _append_rows(_weight(counts, _idf), meta)
+            _dirty = True
+            _generation += 1
+            print(f"✅ Indexed {len(meta)} new chunks from {len(new_ids)} document(s).")
+        except Exception:
+            print("❌ Unexpected error while appending to index:")
+            traceback.print_exc()
+        finally:
+            telemetry.STAGE_LATENCY.observe("index_append", value=time.perf_counter() - t0)
+
+
+def _refresh_idf():
+    """
+    Re-weight all stored rows with up-to-date IDF once the corpus has grown enough.
+    Rows were normalized after weighting, so dividing by the old IDF and multiplying
+    by the new one before re-normalizing is equivalent to re-weighting raw counts.
+    """
+    global _idf, _idf_rows, _generation
+    n_rows = len(_meta)
+    if _idf is None or n_rows <= _idf_rows * (1.0 + IDF_REFRESH_RATIO):
+        return
+    new_idf = _compute_idf(_df, n_rows)
+    factor = new_idf / _idf
+    _each_shard(lambda shard: shard.reweight(factor), list(_shards))
+    _idf = new_idf
+    _idf_rows = n_rows
+    _generation += 1
+
+
+def invalidate_index():
+    """Clear current index (force rebuild next request)."""
+    with _lock:
+        _reset()
+
+
+def _current_snapshot():
+    pointer = INDEX_DIR / 'CURRENT'
+    if not pointer.exists():
+        return None
+    snap = INDEX_DIR / pointer.read_text(encoding='utf-8').strip()
+    return snap if (snap / 'manifest.json').exists() else None
+
+
+def save_snapshot():
+    """
+    Write the index to a new versioned directory under data/index and point
+    CURRENT at it. Workers that still map an older snapshot keep using it.
+    """
+    INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    with _SnapshotLock(INDEX_DIR / '.lock'):
+        return _write_snapshot()
+
+
+def _write_snapshot():
+    global _dirty, _last_saved
+    with _lock, stage("snapshot_save"):
+        if not _ready:
+            return None
+        snap = INDEX_DIR / f'snap-{time.time_ns()}'
+        snap.mkdir()
+        for i, shard in enumerate(_shards):
+            _save_shard(shard, snap / f'shard-{i:04d}')
+        if _df is not None:
+            np.save(snap / 'df.npy', _df)
+            np.save(snap / 'idf.npy', _idf)
+        _meta.save(snap)
+        mtimes = storage.doc_mtimes()
+        manifest = {
+            "version": SNAPSHOT_VERSION,
+            "vectorizer": _vectorizer_params(),
+            "created_at": int(time.time()),
+            "rows": len(_meta),
+            "shards": [{"lo": shard.lo, "rows": shard.rows} for shard in _shards],
+            "idf_rows": _idf_rows,
+            "build_id": _build_id,
+            "docs": {d: mtimes[d] for d in _indexed if d in mtimes},
+        }
+        (snap / 'manifest.json').write_text(json.dumps(manifest), encoding='utf-8')
+        tmp = INDEX_DIR / f'CURRENT.{os.getpid()}'
+        tmp.write_text(snap.name, encoding='utf-8')
+        os.replace(tmp, INDEX_DIR / 'CURRENT')
+        _dirty = False
+        _last_saved = time.time()
+        _prune_snapshots(keep=snap.name)
+        print(f"💾 Saved index snapshot {snap.name} ({len(_meta)} chunks).")
+        return snap
+
+
+def _save_shard(shard: Shard, path: Path):
+    """
+    Write a shard's rows to `path`. A shard unchanged since the last snapshot
+    is hard-linked from there instead, so a snapshot after an ingest only
+    writes the newest shard (unless IDF was refreshed).
+    """
+    path.mkdir()
+    names = ('data.npy', 'indices.npy', 'indptr.npy')
+    if shard.saved is not None:
+        try:
+            for name in names:
+                os.link(shard.saved / name, path / name)
+            shard.saved = path
+            return
+        except OSError:
+            # pruned by another worker, or links unsupported: write it out
+            for name in names:
+                (path / name).unlink(missing_ok=True)
+    shard.compact()
+    np.save(path / 'data.npy', shard.vectors.data)
+    np.save(path / 'indices.npy', shard.vectors.indices)
+    np.save(path / 'indptr.npy', shard.vectors.indptr)
+    shard.saved = path
+
+
+def _prune_snapshots(keep: str):
+    import shutil
+    for old in INDEX_DIR.glob('snap-*'):
+        if old.name != keep:
+            # mapped files stay readable for workers still using them
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def maybe_save_snapshot(force: bool = False):
+    """Snapshot after incremental ingests, at most once per INDEX_SNAPSHOT_INTERVAL."""
+    if _dirty and (force or time.time() - _last_saved >= SNAPSHOT_INTERVAL):
+        save_snapshot()
+
+
+def load_snapshot() -> bool:
+    """
+    Load the current snapshot if it matches this code version and the stored
+    documents it covers are unchanged. Documents ingested after the snapshot
+    was written are appended incrementally. Returns False if a rebuild is needed.
+    """
+    global _meta, _df, _idf, _idf_rows, _indexed, _ready, _last_saved, _build_id
+    snap = _current_snapshot()
+    if snap is None:
+        return False
     try:
-        docs = storage.list_docs()
-        for doc_id in docs:
-            rec = storage.load_doc(doc_id)
-            if not rec or "text" not in rec:
-                continue
-            text = rec["text"] or ""
-            # Optionally truncate extremely large docs to a reasonable limit
-            if len(text) > 2_000_000:
-                print(f"⚠️ Document {doc_id} is very large; truncating to 2,000,000 chars for indexing.")
-                text = text[:2_000_000]
-            doc_chunks = safe_chunk_text(text, doc_id)
-            _chunks.extend(doc_chunks)
-        texts = [c[3] for c in _chunks]
-        if texts:
-            print(f"✅ Building TF-IDF matrix for {len(texts)} chunks...")
-            _tfidf = TfidfVectorizer(stop_words="english")
-            _vectors = _tfidf.fit_transform(texts)
-            _meta = [{"doc_id": c[0], "start": c[1], "end": c[2]} for c in _chunks]
-            print("✅ Index initialization complete.")
-        else:
-            print("ℹ️ No text chunks to index.")
-            _tfidf = None
-            _vectors = None
-            _meta = []
-    except MemoryError:
-        print("❌ MemoryError during index build. Try smaller documents or increase RAM.")
-        _tfidf = None
-        _vectors = None
-        _meta = []
+        manifest = json.loads((snap / 'manifest.json').read_text(encoding='utf-8'))
+        if manifest.get("version") != SNAPSHOT_VERSION or manifest.get("vectorizer") != _vectorizer_params():
+            print("ℹ️ Index snapshot was written by a different version; rebuilding.")
+            return False
+        current = storage.doc_mtimes()
+        stale = [d for d, mtime in manifest["docs"].items() if current.get(d) != mtime]
+        if stale:
+            print(f"ℹ️ Index snapshot is stale ({len(stale)} changed or removed docs); rebuilding.")
+            return False
+        mode = 'r' if INDEX_MMAP else None
+        with _lock, stage("snapshot_load"):
+            _reset()
+            _meta = ChunkMeta.load(snap, mmap_mode=mode)
+            for i, entry in enumerate(manifest["shards"]):
+                path = snap / f'shard-{i:04d}'
+                shard = Shard(entry["lo"])
+                shard.append(sp.csr_matrix(
+                    (np.load(path / 'data.npy', mmap_mode=mode),
+                     np.load(path / 'indices.npy', mmap_mode=mode),
+                     np.load(path / 'indptr.npy', mmap_mode=mode)),
+                    shape=(entry["rows"], N_FEATURES), copy=False))
+                shard.saved = path
+                _shards.append(shard)
+            if (snap / 'df.npy').exists():
+                _df = np.load(snap / 'df.npy')
+                _idf = np.load(snap / 'idf.npy')
+            _idf_rows = manifest["idf_rows"]
+            _build_id = manifest["build_id"]
+            _indexed = set(manifest["docs"])
+            _ready = True
+            _last_saved = time.time()
+            print(f"✅ Loaded index snapshot {snap.name} ({len(_meta)} chunks, {len(_shards)} shard(s)).")
+            new_docs = [d for d in current if d not in _indexed]
+            if new_docs:
+                add_documents(new_docs)
+        return True
     except Exception:
-        print("❌ Unexpected error during index build:")
+        print("❌ Failed to load index snapshot; rebuilding:")
         traceback.print_exc()
-        _tfidf = None
-        _vectors = None
-        _meta = []
+        invalidate_index()
+        return False
 
 
-def invalidate_index():
-    """Clear current index (force rebuild next request)."""
-    global _chunks, _vectors, _tfidf, _meta
-    _chunks = []
-    _vectors = None
-    _tfidf = None
-    _meta = []
+def load_or_build_index():
+    """
+    Startup entry point: reuse the shared snapshot when possible, otherwise
+    build the index once and publish a snapshot for the other workers.
+    A file lock makes concurrently starting workers wait for the first build.
+    """
+    INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    with _SnapshotLock(INDEX_DIR / '.lock'):
+        if load_snapshot():
+            if _dirty:
+                _write_snapshot()
+            return
+        init_index()
+        _write_snapshot()
+
+
+class _SnapshotLock:
+    """Exclusive advisory lock on a file (no-op where fcntl is unavailable)."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fh = None
+
+    def __enter__(self):
+        try:
+            import fcntl
+        except ImportError:
+            return self
+        self._fh = open(self.path, 'a')
+        fcntl.flock(self._fh, fcntl.LOCK_EX)
+        return self
 
+    def __exit__(self, *exc):
+        if self._fh is not None:
+            import fcntl
+            fcntl.flock(self._fh, fcntl.LOCK_UN)
+            self._fh.close()
+        return False
 
-def answer_question(question: str, top_k: int = 3, document_id: Optional[str] = None):
+
+def _query_vectors(questions: List[str]):
+    vec = _vectorizer().transform(questions)
+    return _weight(vec, _idf)
+
+
+def _top_k(rows, scores, k: int):
+    """The k best (row, score) pairs, best first, without sorting every candidate."""
+    if len(scores) > k:
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(len(scores))
+    order = part[np.argsort(-scores[part], kind="stable")]
+    return rows[order], scores[order]
+
+
+def _shard_ranges(ranges):
+    """Split sorted (lo, hi) row ranges at shard boundaries: [(shard, its ranges)]."""
+    work, i = [], 0
+    for lo, hi in ranges:
+        while lo < hi:
+            while _shards[i].hi <= lo:
+                i += 1
+            shard, end = _shards[i], min(hi, _shards[i].hi)
+            if work and work[-1][0] is shard:
+                work[-1][1].append((lo, end))
+            else:
+                work.append((shard, [(lo, end)]))
+            lo = end
+    return work
+
+
+def _query_groups(queries, n_rows: int):
     """
-    Answer the question. If document_id provided, search only that document.
-    Returns {'answer': <text>, 'citations': [ {document_id,start,end,score}, ... ] }
+    The query batch transposed (features x queries, CSR), split into column
+    groups whose product with n_rows index rows is estimated to stay within
+    SCORE_NNZ_BUDGET non-zeros. A query's column has at most as many entries as
+    there are chunks sharing one of its terms, scaled from the whole index by _df.
+    """
+    total = len(_meta)
+    if _df is None or total == 0 or queries.shape[0] <= 1:
+        return [queries.T.tocsr()]
+    terms = queries.copy()
+    terms.data = np.ones_like(terms.data)
+    estimate = np.minimum(terms @ _df * (n_rows / total), n_rows)
+    groups, start, used = [], 0, 0.0
+    for j, cost in enumerate(estimate):
+        if j > start and used + cost > SCORE_NNZ_BUDGET:
+            groups.append(queries[start:j].T.tocsr())
+            start, used = j, 0.0
+        used += cost
+    groups.append(queries[start:].T.tocsr())
+    return groups
+
+
+def _rank(queries, top_k: int, ranges=None):
     """
-    global _vectors, _meta, _chunks, _tfidf
+    Score a batch of query rows against the index (or only the (lo, hi) row
+    ranges given) and return [(row ids, scores)] per query. Stored and query rows
+    are L2-normalized, so the sparse product is already the cosine similarity.
+    Shards are scored in parallel and their top_k lists merged.
+    """
+    work = [(shard, None) for shard in _shards] if ranges is None else _shard_ranges(ranges)
+    n_rows = max((shard.rows if r is None else sum(hi - lo for lo, hi in r) for shard, r in work), default=0)
+    # converted once here rather than inside every shard's product
+    groups = _query_groups(queries, n_rows)
+    per_shard = _each_shard(
+        lambda item: [hit for cols in groups for hit in item[0].score(cols, top_k, item[1])], work)
+    if len(per_shard) == 1:
+        return per_shard[0]
+    ranked = []
+    for j in range(queries.shape[0]):
+        rows = np.concatenate([hits[j][0] for hits in per_shard] or [np.empty(0, dtype=np.int64)])
+        scores = np.concatenate([hits[j][1] for hits in per_shard] or [np.empty(0)])
+        ranked.append(_top_k(rows, scores, top_k))
+    return ranked
+
+
+def _rerank(questions: List[str], candidates, top_k: int):
+    """
+    Second hybrid stage: re-score each question's sparse candidates by embedding
+    cosine similarity. Returns the top_k hits per question, the candidate texts
+    (reused for the snippets) and the time spent reading and embedding.
+    """
+    from . import dense
+    t0 = time.perf_counter()
+    texts, pages = {}, {}
+    for hits in candidates:
+        for span, _, page in hits:
+            if span not in texts:
+                texts[span] = storage.load_text_span(*span) or ""
+                pages[span] = page
+    t1 = time.perf_counter()
+    spans = list(texts)
+    chunk_vecs = dense.embed([texts[span] for span in spans]) if spans else np.empty((0, 0), dtype=np.float32)
+    query_vecs = dense.embed(questions, cache=False)
+    position = {span: i for i, span in enumerate(spans)}
+    ranked = []
+    for q, hits in zip(query_vecs, candidates):
+        if not hits:
+            ranked.append([])
+            continue
+        rows = np.array([position[span] for span, _, _ in hits])
+        top_rows, scores = _top_k(rows, chunk_vecs[rows] @ q, top_k)
+        ranked.append([(spans[r], float(score), pages[spans[r]]) for r, score in zip(top_rows, scores)])
+    t2 = time.perf_counter()
+    return ranked, texts, {"fetch_ms": (t1 - t0) * 1000, "embed_ms": (t2 - t1) * 1000}
+
+
+def cache_stats() -> dict:
+    return _query_cache.stats()
+
+
+def index_stats() -> dict:
+    """Size of the index as currently loaded; read without the lock, so values may be a batch behind."""
+    shards = list(_shards)
+    blocks = [block for shard in shards for block in shard.blocks()]
+    return {
+        "ready": _ready,
+        "documents": len(_indexed),
+        "chunks": len(_meta),
+        "shards": len(shards),
+        "nnz": sum(b.nnz for b in blocks),
+        "tail_blocks": len(blocks) - sum(shard.vectors is not None for shard in shards),
+        "generation": _generation,
+        "idf_stale_rows": len(_meta) - _idf_rows if _idf is not None else 0,
+    }
+
 
+def answer_questions(questions: List[str], top_k: int = 3, document_id: Optional[str] = None,
+                     backend: str = "tfidf", candidates: Optional[int] = None, filter: Optional[dict] = None):
+    """
+    Answer many questions at once: each ASK_BATCH_SIZE slice of questions is
+    scored with a single sparse matrix product (or one FAISS search when
+    backend='dense'). backend='hybrid' takes the best `candidates` chunks
+    (default HYBRID_CANDIDATES) by TF-IDF and re-ranks only those with
+    embeddings; its results also carry per-stage timings in milliseconds.
+    `filter` (see field_index) limits retrieval to documents whose extracted
+    fields match, before any scoring.
+    Repeated questions are answered from the query cache until the index changes.
+    Returns one result per question in the same shape as answer_question().
+    """
     # ensure index
-    if _vectors is None or _tfidf is None or len(_chunks) == 0:
+    if not _ready:
         init_index()
 
-    if _vectors is None or _tfidf is None or _vectors.shape[0] == 0:
-        return {"answer": "No indexed data available.", "citations": []}
+    # read before ranking: an ingest racing with this call leaves entries under the old generation
+    generation = _generation
+    filter_key = json.dumps(filter, sort_keys=True, default=str) if filter else None
+    keys = [(normalize_question(q), top_k, document_id, backend, candidates, filter_key) for q in questions]
+    results = [_query_cache.get(key, generation) for key in keys]
+    missing = [i for i, res in enumerate(results) if res is None]
+    if missing:
+        allowed = None
+        if filter:
+            from . import field_index
+            allowed = field_index.matching_ids(filter)
+        computed = _answer_uncached([questions[i] for i in missing], top_k, document_id, backend, candidates,
+                                    allowed)
+        for i, res in zip(missing, computed):
+            results[i] = res
+            if res["citations"]:
+                _query_cache.put(keys[i], generation, res)
+    return results
 
-    try:
-        # transform the question using the same fitted TF-IDF (important!)
-        vec_q = _tfidf.transform([question])
-
-        # If filtering by document_id, select subset rows from _vectors
-        if document_id:
-            indices = [i for i, m in enumerate(_meta) if m["doc_id"] == document_id]
-            if not indices:
-                return {"answer": f"No data found for document {document_id}", "citations": []}
-            docs_matrix = _vectors[indices, :]
-            sims = cosine_similarity(vec_q, docs_matrix).flatten()
-            # sims corresponds to indices list; need to map back to global indices
-            ordered_pairs = sorted(enumerate(sims), key=lambda x: x[1], reverse=True)[:top_k]
-            snippets = []
-            citations = []
-            for local_idx, score in ordered_pairs:
-                global_idx = indices[local_idx]
-                text = _chunks[global_idx][3].strip()
-                meta = _meta[global_idx]
-                snippets.append(text)
-                citations.append({
-                    "document_id": meta["doc_id"],
-                    "start": meta["start"],
-                    "end": meta["end"],
-                    "score": float(score)
-                })
-        else:
-            sims = cosine_similarity(vec_q, _vectors).flatten()
-            idx_sorted = sims.argsort()[::-1][:top_k]
+
+def _answer_uncached(questions: List[str], top_k: int, document_id: Optional[str], backend: str,
+                     candidates: Optional[int], allowed: Optional[set] = None):
+    results = []
+    for i in range(0, len(questions), ASK_BATCH_SIZE):
+        batch = questions[i:i + ASK_BATCH_SIZE]
+        texts = {}
+        timings = None
+        with _lock:
+            if len(_meta) == 0:
+                results.extend({"answer": "No indexed data available.", "citations": []} for _ in batch)
+                continue
+            ranges = None
+            # If filtering by document_id, score only that document's row range
+            if document_id:
+                rows = _meta.rows_for(document_id)
+                if rows is None:
+                    results.extend({"answer": f"No data found for document {document_id}", "citations": []}
+                                   for _ in batch)
+                    continue
+                ranges = [rows]
+            # If filtering by fields, only the matching documents' rows
+            if allowed is not None:
+                if document_id:
+                    allowed = allowed & {document_id}
+                ranges = _meta.ranges_for(allowed)
+                if not ranges:
+                    results.extend({"answer": "No documents match the filter.", "citations": []} for _ in batch)
+                    continue
+            if backend in ("tfidf", "hybrid"):
+                k = top_k if backend == "tfidf" else max(top_k, candidates or HYBRID_CANDIDATES)
+                try:
+                    t0 = time.perf_counter()
+                    with stage("idf_refresh"):
+                        _refresh_idf()
+                    # transform the questions into the same hashed, IDF-weighted space
+                    with stage("query_vectorize"):
+                        queries = _query_vectors(batch)
+                    with stage("score"):
+                        ranked = [[_meta.hit(r, score) for r, score in zip(*hits)]
+                                  for hits in _rank(queries, k, ranges)]
+                    timings = {"sparse_ms": (time.perf_counter() - t0) * 1000}
+                except Exception:
+                    print("❌ Error in answer_questions:")
+                    traceback.print_exc()
+                    results.extend({"answer": "", "citations": []} for _ in batch)
+                    continue
+        if backend == "dense":
+            # embedding calls may be slow, so they run outside the index lock
+            from . import dense
+            with stage("dense_search"):
+                hits_per_query = dense.rank(batch, top_k, ranges)
+            with _lock:
+                ranked = [[_meta.hit(r, score) for r, score in zip(*hits)] for hits in hits_per_query]
+        elif backend == "hybrid":
+            n_candidates = [len(hits) for hits in ranked]
+            with stage("rerank"):
+                ranked, texts, rerank_timings = _rerank(batch, ranked, top_k)
+            timings.update(rerank_timings)
+        # chunk text is read from the store outside the index lock
+        for j, hits in enumerate(ranked):
             snippets = []
             citations = []
-            for i in idx_sorted:
-                score = float(sims[i])
-                meta = _meta[i]
-                text = _chunks[i][3].strip()
-                snippets.append(text)
-                citations.append({
-                    "document_id": meta["doc_id"],
-                    "start": meta["start"],
-                    "end": meta["end"],
-                    "score": score
-                })
-
-        answer = "\n\n".join(snippets)
-        return {"answer": answer, "citations": citations}
-    except Exception:
-        print("❌ Error in answer_question:")
-        traceback.print_exc()
-        return {"answer": "", "citations": []}
+            for (doc_id, start, end), score, page in hits:
+                text = texts.get((doc_id, start, end))
+                if text is None:
+                    text = storage.load_text_span(doc_id, start, end) or ""
+                snippets.append(text.strip())
+                citations.append({"document_id": doc_id, "start": start, "end": end, "page": page,
+                                  "score": float(score)})
+            result = {"answer": "\n\n".join(snippets), "citations": citations}
+            if backend == "hybrid":
+                result["retrieval"] = {"candidates": n_candidates[j], **timings}
+            results.append(result)
+    return results
 
 
-def stream_answer(question: str, top_k: int = 3, document_id: Optional[str] = None):
-    """SSE-style generator that yields tokens for the answer then the citations."""
-    res = answer_question(question, top_k=top_k, document_id=document_id)
-    answer = res.get("answer", "")
-    for token in answer.split():
-        yield f"data: {html.escape(token)}\n\n"
-    yield f"data: [CITATIONS] {json.dumps(res.get('citations', []))}\n\n"
+def answer_question(question: str, top_k: int = 3, document_id: Optional[str] = None, backend: str = "tfidf",
+                    candidates: Optional[int] = None, filter: Optional[dict] = None):
+    """
+    Answer the question. If document_id provided, search only that document;
+    if filter provided, only documents whose extracted fields match it.
+    Returns {'answer': <text>, 'citations': [ {document_id,start,end,score}, ... ] }
+    """
+    return answer_questions([question], top_k=top_k, document_id=document_id, backend=backend,
+                            candidates=candidates, filter=filter)[0]
+
+
+def _sse(data: str) -> str:
+    # multi-line payloads need one data: field per line
+    return "".join(f"data: {line}\n" for line in data.split("\n")) + "\n"
+
+
+def stream_answer(question: str, top_k: int = 3, document_id: Optional[str] = None, backend: str = "tfidf"):
+    """
+    SSE generator: a comment straight away, the citations as soon as retrieval
+    is done, then the answer tokens as llm.stream_synthesis() produces them and
+    finally [DONE]. Tokens are only pulled from the provider when the client
+    is ready for them, and closing the generator closes the provider stream.
+    """
+    from . import llm
+    yield ": retrieving\n\n"
+    res = answer_question(question, top_k=top_k, document_id=document_id, backend=backend)
+    yield _sse(f"[CITATIONS] {json.dumps(res.get('citations', []))}")
+    snippets = [res["answer"]] if res.get("citations") else []
+    tokens = llm.stream_synthesis(question, snippets)
+    try:
+        for token in tokens:
+            yield _sse(html.escape(token))
+    finally:
+        tokens.close()
+    yield _sse("[DONE]")
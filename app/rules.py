@@ -1,30 +1,203 @@
+"""
+Audit rules, defined as data.
+
+A ruleset is a JSON file (app/rulesets/default.json unless RULESET_PATH is
+set) listing rules in output order. Each rule may use these keys:
+
+    id              finding name
+    any             literals; the rule needs one of them and its first usable
+                    occurrence is the anchor
+    all             groups of literals that must each occur as well
+    within          only count `all` hits within this many chars of the anchor
+    follow          regex that must match right after the anchor; group 1, if
+                    numeric, feeds value_severity
+    absent          literals that must not occur anywhere
+    unless          ids of earlier rules that suppress this one when they fire
+    severity        default severity
+    value_severity  [{"below": n, "severity": s}], checked in order
+    evidence_term   evidence is the sentence around this literal instead of the anchor
+    evidence_text   fixed evidence string
+
+All literals of all rules are compiled into one scanner, so a document is
+scanned once however many rules there are. The file is re-read when it
+changes, and time spent per rule is accumulated for /metrics.
+"""
+import hashlib
+import json
+import os
 import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+
+from .scan import LiteralScanner, lower_text, near_sentence
+
+RULESET_PATH = Path(os.getenv('RULESET_PATH', Path(__file__).resolve().parent / 'rulesets' / 'default.json'))
+# Seconds between checks of the ruleset file for changes
+RULESET_RELOAD_INTERVAL = float(os.getenv('RULESET_RELOAD_INTERVAL', '2'))
+
+# Tag of the loaded ruleset (its "version" plus a content hash); stored findings with another tag are stale.
+# Use ruleset_version(), which loads the ruleset on first use.
+RULESET_VERSION = None
+
+_RULE_KEYS = {'id', 'any', 'all', 'within', 'follow', 'absent', 'unless', 'severity', 'value_severity',
+              'evidence_term', 'evidence_text'}
+
+_ruleset = None
+_mtime = None
+_checked_at = 0.0
+_reload_lock = threading.Lock()
+_stats = {}          # rule id -> [evaluations, seconds]
+_stats_lock = threading.Lock()
+
+
+class Rule:
+    def __init__(self, spec: dict):
+        unknown = set(spec) - _RULE_KEYS
+        if unknown:
+            raise ValueError(f"rule {spec.get('id')!r}: unknown keys {sorted(unknown)}")
+        if 'id' not in spec or not (spec.get('any') or spec.get('absent')):
+            raise ValueError(f"rule {spec.get('id')!r}: needs an id and 'any' or 'absent'")
+        self.id = spec['id']
+        self.any = [t.lower() for t in spec.get('any', [])]
+        self.all = [[t.lower() for t in group] for group in spec.get('all', [])]
+        self.within = spec.get('within')
+        self.follow = re.compile(spec['follow']) if spec.get('follow') else None
+        self.absent = [t.lower() for t in spec.get('absent', [])]
+        self.unless = set(spec.get('unless', []))
+        self.severity = spec.get('severity', 'medium')
+        self.value_severity = [(v['below'], v['severity']) for v in spec.get('value_severity', [])]
+        self.evidence_term = spec['evidence_term'].lower() if spec.get('evidence_term') else None
+        self.evidence_text = spec.get('evidence_text')
+
+    def literals(self):
+        terms = self.any + self.absent + [t for group in self.all for t in group]
+        return terms + ([self.evidence_term] if self.evidence_term else [])
+
+    def _group_near(self, hits, group, pos):
+        for term in group:
+            offsets = hits.get(term, ())
+            if bisect_right(offsets, pos + self.within) > bisect_left(offsets, pos - self.within):
+                return True
+        return False
+
+    def evaluate(self, text: str, lower: str, hits: dict):
+        """(anchor position or None, captured value or None) if the rule fires, else None."""
+        if any(t in hits for t in self.absent):
+            return None
+        if not self.any:
+            return None, None
+        if not all(any(t in hits for t in group) for group in self.all):
+            return None
+        anchors = sorted((pos, term) for term in self.any for pos in hits.get(term, ()))
+        for pos, term in anchors:
+            if self.within is not None and not all(self._group_near(hits, g, pos) for g in self.all):
+                continue
+            if self.follow is None:
+                return pos, None
+            m = self.follow.match(lower, pos + len(term))
+            if m:
+                return pos, m.group(1) if m.groups() else None
+        return None
+
+    def finding(self, doc_id, text, hits, pos, value):
+        severity = self.severity
+        if value is not None and value.isdigit():
+            for below, sev in self.value_severity:
+                if int(value) < below:
+                    severity = sev
+                    break
+        if self.evidence_text is not None:
+            evidence = self.evidence_text
+        elif self.evidence_term is not None:
+            offsets = hits.get(self.evidence_term)
+            evidence = near_sentence(text, offsets[0]) if offsets else None
+        else:
+            evidence = near_sentence(text, pos) if pos is not None else None
+        return {'rule': self.id, 'severity': severity, 'evidence': evidence, 'doc_id': doc_id}
+
+
+class Ruleset:
+    def __init__(self, spec: dict, tag: str):
+        self.version = tag
+        self.rules = [Rule(r) for r in spec['rules']]
+        ids = [r.id for r in self.rules]
+        if len(set(ids)) != len(ids):
+            raise ValueError('duplicate rule ids')
+        self.scanner = LiteralScanner([t for r in self.rules for t in r.literals()])
+
+
+def load_ruleset(path: Path = None) -> Ruleset:
+    """Reads and compiles a ruleset file; raises ValueError if it is invalid."""
+    raw = Path(path or RULESET_PATH).read_bytes()
+    spec = json.loads(raw)
+    return Ruleset(spec, f"{spec.get('version', '0')}:{hashlib.sha1(raw).hexdigest()[:12]}")
+
+
+def reload(force: bool = False) -> bool:
+    """
+    Recompiles the ruleset if its file changed (checked at most every
+    RULESET_RELOAD_INTERVAL seconds). An invalid file keeps the rules in use.
+    """
+    global _ruleset, _mtime, _checked_at, RULESET_VERSION
+    now = time.monotonic()
+    if not force and _ruleset is not None and now - _checked_at < RULESET_RELOAD_INTERVAL:
+        return False
+    with _reload_lock:
+        _checked_at = now
+        try:
+            mtime = RULESET_PATH.stat().st_mtime_ns
+            if not force and mtime == _mtime:
+                return False
+            ruleset = load_ruleset()
+        except (OSError, ValueError, KeyError) as e:
+            if _ruleset is None:
+                raise
+            print(f"❌ Ruleset reload failed, keeping version {_ruleset.version}: {e}")
+            return False
+        changed = _ruleset is None or ruleset.version != _ruleset.version
+        _ruleset, _mtime = ruleset, mtime
+        if changed:
+            RULESET_VERSION = ruleset.version
+            print(f"✅ Loaded ruleset {ruleset.version} ({len(ruleset.rules)} rules).")
+        return changed
+
+
+def ruleset_version() -> str:
+    reload()
+    return RULESET_VERSION
+
+
+def rule_stats() -> dict:
+    """Evaluations and total milliseconds per rule since startup ('_scan' is the shared scan)."""
+    with _stats_lock:
+        return {rule: {'calls': n, 'total_ms': round(sec * 1000, 3)} for rule, (n, sec) in _stats.items()}
+
+
+def _record(rule_id, seconds):
+    with _stats_lock:
+        entry = _stats.setdefault(rule_id, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+
 def run_audit_rules(doc_id, text):
+    reload()
+    ruleset = _ruleset
+    t0 = time.perf_counter()
+    lower = lower_text(text)
+    hits = ruleset.scanner.scan(lower)
+    _record('_scan', time.perf_counter() - t0)
     findings = []
-    lower = text.lower()
-    m = re.search(r'auto[- ]renew.*?(\d{1,3})\s*day', lower)
-    if m:
-        days = int(m.group(1))
-        sev = 'high' if days < 30 else 'medium'
-        findings.append({'rule': 'auto_renewal_notice', 'severity': sev, 'evidence': _near_sentence(text, m.start()), 'doc_id': doc_id})
-    elif 'auto-renew' in lower or 'auto renew' in lower:
-        findings.append({'rule': 'auto_renewal', 'severity': 'medium', 'evidence': _near_sentence(text, lower.find('auto')), 'doc_id': doc_id})
-    if 'unlimited liability' in lower or 'no cap' in lower or 'without limitation' in lower:
-        findings.append({'rule': 'liability_unlimited', 'severity': 'high', 'evidence': _find_sentence_with(text, 'liability'), 'doc_id': doc_id})
-    if 'indemnify' in lower and ('all' in lower or 'every' in lower):
-        findings.append({'rule': 'broad_indemnity', 'severity': 'high', 'evidence': _find_sentence_with(text, 'indemn'), 'doc_id': doc_id})
-    if 'confidential' not in lower:
-        findings.append({'rule': 'missing_confidentiality', 'severity': 'medium', 'evidence': 'no confidentiality clause found', 'doc_id': doc_id})
+    fired = set()
+    for rule in ruleset.rules:
+        t0 = time.perf_counter()
+        if not rule.unless & fired:
+            hit = rule.evaluate(text, lower, hits)
+            if hit is not None:
+                fired.add(rule.id)
+                findings.append(rule.finding(doc_id, text, hits, *hit))
+        _record(rule.id, time.perf_counter() - t0)
     return findings
 
-def _near_sentence(text, pos):
-    start = text.rfind('.', 0, pos)
-    end = text.find('.', pos)
-    if start==-1: start= max(0, pos-200)
-    if end==-1: end = min(len(text), pos+200)
-    return text[start+1:end+1].strip()
-
-def _find_sentence_with(text, token):
-    i = text.lower().find(token)
-    if i==-1: return None
-    return _near_sentence(text, i)
@@ -0,0 +1,51 @@
+"""
+Multi-literal scanning shared by field extraction and the audit rules.
+
+A LiteralScanner compiles a set of lowercase literals into one regex
+alternation and reports every occurrence of every literal in a single pass,
+including occurrences that overlap each other.
+"""
+import re
+
+
+def lower_text(text: str) -> str:
+    """text.lower(), keeping offsets valid for `text`."""
+    lower = text.lower()
+    if len(lower) != len(text):
+        # a few characters lowercase to two
+        lower = ''.join(c if len(c.lower()) != 1 else c.lower() for c in text)
+    return lower
+
+
+class LiteralScanner:
+    def __init__(self, literals):
+        # longest first, so the alternation reports the longest literal at each position
+        self.literals = sorted(set(literals), key=lambda s: (-len(s), s))
+        self._pattern = re.compile('|'.join(map(re.escape, self.literals)))
+        # finditer() resumes after each match, so literals starting inside it (e.g. 'liability'
+        # in 'unlimited liability', or 'termination' under 'termination for cause') are checked here
+        self._overlaps = {a: [(b, d) for d in range(len(a)) for b in self.literals
+                              if b != a and (a[d:].startswith(b) or b.startswith(a[d:]))]
+                          for a in self.literals}
+
+    def scan(self, lower: str) -> dict:
+        """Offsets of every literal occurrence in `lower`: {literal: sorted offsets}."""
+        hits = {}
+        for m in self._pattern.finditer(lower):
+            start, literal = m.start(), m.group()
+            hits.setdefault(literal, []).append(start)
+            for other, d in self._overlaps[literal]:
+                if lower.startswith(other, start + d):
+                    hits.setdefault(other, []).append(start + d)
+        for offsets in hits.values():
+            offsets.sort()
+        return hits
+
+
+def near_sentence(text, pos):
+    """The sentence around `pos`, bounded by periods (or 200 chars either side)."""
+    start = text.rfind('.', 0, pos)
+    end = text.find('.', pos)
+    if start==-1: start= max(0, pos-200)
+    if end==-1: end = min(len(text), pos+200)
+    return text[start+1:end+1].strip()
@@ -1,60 +1,221 @@
 from pathlib import Path
-import json
-import requests
+import hashlib
+import threading
 import traceback
 import os
 
-# Directory to store extracted document data
-DATA_DIR = Path(__file__).resolve().parent.parent / 'data'
-DATA_DIR.mkdir(exist_ok=True)
+from . import chunking, db, field_index
+
+# Directory for uploaded PDFs, the document database and index snapshots
+DATA_DIR = db.DATA_DIR
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+# Uploads are copied to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(1024 * 1024)))
+# Upper bound on upload bytes held in memory across all concurrent requests
+UPLOAD_MEMORY_LIMIT = int(os.getenv('UPLOAD_MEMORY_LIMIT', str(64 * 1024 * 1024)))
+_upload_buffers = threading.BoundedSemaphore(max(1, UPLOAD_MEMORY_LIMIT // UPLOAD_CHUNK_SIZE))
+
+
+def save_upload(src, dest: Path):
+    """
+    Streams a file-like upload to `dest` in UPLOAD_CHUNK_SIZE pieces, hashing as it goes.
+    Each in-flight chunk holds one of the shared buffer slots, so concurrent uploads
+    never buffer more than UPLOAD_MEMORY_LIMIT bytes. Returns (size, sha256 hex digest).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    tmp = dest.with_name(dest.name + '.part')
+    try:
+        with open(tmp, 'wb') as out:
+            while True:
+                with _upload_buffers:
+                    chunk = src.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+                size += len(chunk)
+        os.replace(tmp, dest)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return size, digest.hexdigest()
 
 def extract_text_from_pdf(path: Path) -> str:
     """
     Extracts plain text from a PDF using PyMuPDF (fitz).
     Returns empty string if PDF cannot be read.
     """
+    try:
+        return join_pages(extract_pages(path))
+    except Exception as e:
+        print(f"⚠️ PDF read error: {e}")
+        return ''
+
+
+def page_count(path: Path) -> int:
+    """
+    Returns the number of pages in a PDF, or 0 if it cannot be opened.
+    """
     try:
         import fitz  # PyMuPDF
-        doc = fitz.open(str(path))
-        texts = []
-        for p in doc:
+        with fitz.open(str(path)) as doc:
+            return doc.page_count
+    except Exception as e:
+        print(f"⚠️ PDF read error: {e}")
+        return 0
+
+
+def extract_pages(path: Path, start: int = 0, end: int = None) -> list:
+    """
+    Extracts the text of pages [start, end) of a PDF, one string per page.
+    Text blocks are kept in reading order and separated by a blank line, which
+    the chunker uses as clause boundaries. Unreadable pages come back as empty
+    strings so page order is preserved.
+    """
+    import fitz  # PyMuPDF
+    texts = []
+    with fitz.open(str(path)) as doc:
+        end = doc.page_count if end is None else min(end, doc.page_count)
+        for i in range(start, end):
             try:
-                texts.append(p.get_text('text') or '')
+                blocks = doc[i].get_text('blocks', sort=True)
+                texts.append('\n\n'.join(b[4].strip() for b in blocks if b[6] == 0 and b[4].strip()))
             except Exception:
                 texts.append('')
-        return '\n\n'.join(texts)
-    except Exception as e:
-        print(f"⚠️ PDF read error: {e}")
-        return ''
+    return texts
+
+
+def join_pages(pages: list) -> str:
+    """
+    Document text from page texts: each page ends with a form feed, so chunks
+    can be mapped back to page numbers.
+    """
+    return ''.join(p + chunking.PAGE_BREAK for p in pages)
 
 
-def save_doc_json(doc_id: str, metadata: dict, text: str):
+def save_doc(doc_id: str, metadata: dict, text: str):
     """
-    Saves extracted document data (metadata + text) into a JSON file.
+    Saves extracted document data (metadata + text) to the document store.
     """
-    rec = {'id': doc_id, 'metadata': metadata, 'text': text}
-    p = DATA_DIR / f'{doc_id}.json'
-    p.write_text(json.dumps(rec, ensure_ascii=False, indent=2), encoding='utf-8')
-    print(f"✅ Saved document: {p.name}")
+    db.save_document(doc_id, metadata, text)
+    print(f"✅ Saved document: {doc_id}")
+
+
+def save_docs(records: list):
+    """
+    Saves many (doc_id, metadata, text) records in one transaction.
+    """
+    if records:
+        db.save_documents(records)
+        print(f"✅ Saved {len(records)} document(s).")
 
 
 def load_doc(doc_id: str):
     """
-    Loads a stored document JSON by its ID.
-    Returns None if file not found.
+    Loads a stored document (id, metadata, text) by its ID.
+    Returns None if not found.
     """
-    p = DATA_DIR / f'{doc_id}.json'
-    if not p.exists():
+    rec = db.get_document(doc_id)
+    if rec is None:
         print(f"⚠️ Document not found: {doc_id}")
-        return None
-    return json.loads(p.read_text(encoding='utf-8'))
+    return rec
+
+
+def load_text(doc_id: str):
+    """
+    Loads only the text of a stored document, or None if not found.
+    """
+    return db.get_text(doc_id)
+
+
+def load_text_span(doc_id: str, start: int, end: int):
+    """
+    Loads characters [start, end) of a document's text without reading the rest.
+    """
+    return db.get_text_span(doc_id, start, end)
+
+
+def iter_doc_texts(doc_ids: list = None):
+    """
+    Yields (doc_id, text) for all stored documents (or just doc_ids), streaming from the store.
+    """
+    return db.iter_texts(doc_ids)
 
 
 def list_docs():
     """
     Returns a list of all stored document IDs.
     """
-    return [p.stem for p in DATA_DIR.glob('*.json')]
+    return db.document_ids()
+
+
+def list_doc_metadata():
+    """
+    Returns id, filename, sha256, size and timestamps of every document, without text.
+    """
+    return db.list_documents()
+
+
+def doc_mtimes():
+    """
+    Returns {document_id: last update time} for all stored documents.
+    Used to validate index snapshots against the current corpus.
+    """
+    return db.document_mtimes()
+
+
+def claim_content_hash(sha256: str, doc_id: str, live=()) -> str:
+    """
+    Registers `doc_id` as the owner of content `sha256` unless another document
+    already has it. Returns the owning document ID. An owner that was never
+    stored and is not in `live` (documents still being ingested) is replaced.
+    """
+    return db.claim_content_hash(sha256, doc_id, live)
+
+
+def doc_exists(doc_id: str) -> bool:
+    return db.document_exists(doc_id)
+
+
+def release_content_hash(sha256: str, doc_id: str):
+    """
+    Forgets `doc_id` as owner of `sha256`, e.g. after its ingest failed.
+    """
+    db.release_content_hash(sha256, doc_id)
+
+
+def load_analysis(doc_id: str, kind: str):
+    """
+    Returns the stored (version, result) of an analysis ('fields', 'findings') of a document, or None.
+    """
+    return db.get_analysis(doc_id, kind)
+
+
+def save_analyses(rows: list):
+    """
+    Stores (doc_id, kind, version, result) analysis results in one transaction,
+    together with the field index rows of any extracted fields among them.
+    """
+    if rows:
+        fields = [field_index.index_row(doc_id, version, result)
+                  for doc_id, kind, version, result in rows if kind == 'fields']
+        db.save_analyses(rows, fields)
+
+
+def stale_analyses(kind: str, version) -> list:
+    """
+    Returns IDs of documents whose stored `kind` result is missing or not at `version`.
+    """
+    return db.stale_analyses(kind, version)
+
+
+def legacy_json_docs():
+    """
+    Returns paths of per-document JSON files written by earlier versions.
+    """
+    return sorted(DATA_DIR.glob('*.json'))
 
 
 # def post_webhook(payload):
@@ -99,6 +260,7 @@ def post_webhook(url=None, payload=None):
         print(f"⚠️ Invalid WEBHOOK_URL: {url}")
         return
 
+    import requests  # only needed for webhooks
     try:
         response = requests.post(url, json=payload, timeout=5)
         print(f"✅ Webhook POST to {url} — status {response.status_code}")
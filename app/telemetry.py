@@ -0,0 +1,331 @@
+"""
+Process-local metrics in the Prometheus text format, plus a sampling profiler.
+
+Endpoints are timed by RequestTimer (an ASGI middleware), labelled by route
+template so ids in paths do not multiply series. Pipeline stages are timed
+with `with stage('vectorize'):`. Gauges are read from callbacks at scrape
+time, so /metrics never walks the index or the database under a lock.
+
+Startup phases (import, preload, ready) are recorded as seconds since the
+process started, or since the fork for preforked workers, and memory is
+broken down into RSS, PSS and private bytes so pages shared copy-on-write
+with a preloading master can be told apart from each worker's own.
+
+Profiling is off unless PROFILE_DIR is set: a PROFILE_SAMPLE_RATE share of
+calls to @profiled handlers run under cProfile (or pyinstrument with
+PROFILER=pyinstrument) and the profile is kept if the call took at least
+PROFILE_SLOW_MS.
+"""
+import functools
+import os
+import random
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0.01'))
+PROFILE_SLOW_MS = float(os.getenv('PROFILE_SLOW_MS', '500'))
+PROFILER = os.getenv('PROFILER', 'cprofile')
+
+_registry = []       # metrics in exposition order
+_gauges = []         # (name, help, type, callback)
+_startup = {}        # startup phase -> seconds since process start
+_imported_at = time.perf_counter()
+
+
+def _fmt_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    inner = ','.join('{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                     for k, v in pairs)
+    return '{' + inner + '}'
+
+
+def _fmt_value(v) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, n: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, v in items:
+            yield f'{self.name}{_fmt_labels(self.labels, labels)} {_fmt_value(v)}'
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}    # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, *labels, value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def count(self, *labels) -> int:
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            total = 0
+            for bound, n in zip(self.buckets + (float('inf'),), series):
+                total += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f'{self.name}_bucket{_fmt_labels(self.labels, labels, ("le", le))} {total}'
+            yield f'{self.name}_sum{_fmt_labels(self.labels, labels)} {series[-1]!r}'
+            yield f'{self.name}_count{_fmt_labels(self.labels, labels)} {total}'
+
+
+def gauge(name: str, help: str, callback, type: str = 'gauge'):
+    """
+    Registers a metric read at scrape time. `callback` returns a number, or a
+    dict of {label value tuple: number} with the label names under '_labels'.
+    """
+    _gauges.append((name, help, type, callback))
+
+
+REQUEST_LATENCY = Histogram('contract_http_request_duration_seconds',
+                            'Time from request start to the last response byte.', ('method', 'route', 'status'))
+STAGE_LATENCY = Histogram('contract_stage_duration_seconds', 'Time spent per pipeline stage.', ('stage',))
+OPERATIONS = Counter('contract_operations_total', 'Documents ingested and questions/extractions/audits served.',
+                     ('kind',))
+PROFILES = Counter('contract_profiles_written_total', 'Slow-request profiles written to PROFILE_DIR.')
+
+
+@contextmanager
+def stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.observe(name, value=time.perf_counter() - t0)
+
+
+def rss_bytes() -> int:
+    """Current resident set size (peak RSS where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def memory_breakdown(pid='self') -> dict:
+    """
+    {'rss', 'pss', 'private', 'shared'} in bytes from /proc/<pid>/smaps_rollup.
+    PSS charges each shared page to its sharers in equal parts, and private is
+    what the process alone holds. The dict is empty where smaps is unavailable.
+    """
+    fields = {'Rss': 'rss', 'Pss': 'pss', 'Private_Clean': 'private', 'Private_Dirty': 'private',
+              'Shared_Clean': 'shared', 'Shared_Dirty': 'shared'}
+    out = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                if key in fields:
+                    out[fields[key]] = out.get(fields[key], 0) + int(rest.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return {}
+    return out
+
+
+def process_age() -> float:
+    """Seconds since this process started (forked children count from the fork)."""
+    try:
+        with open('/proc/self/stat') as f:
+            # fields after the parenthesized command name; starttime is field 22
+            started = int(f.read().rpartition(')')[2].split()[19]) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/uptime') as f:
+            return max(0.0, float(f.read().split()[0]) - started)
+    except (OSError, ValueError, IndexError):
+        return time.perf_counter() - _imported_at
+
+
+def mark_startup(phase: str) -> float:
+    """Records how long this process took to reach `phase`; returns the seconds."""
+    _startup[phase] = process_age()
+    return _startup[phase]
+
+
+gauge('process_resident_memory_bytes', 'Resident memory size in bytes.', rss_bytes)
+gauge('process_peak_resident_memory_bytes', 'Peak resident memory size in bytes.', peak_rss_bytes)
+
+
+def _memory_gauges():
+    memory = memory_breakdown()
+    return {'_labels': ('kind',), **{(k,): v for k, v in memory.items()}} if memory else None
+
+
+def _startup_gauges():
+    return {'_labels': ('phase',), **{(k,): v for k, v in _startup.items()}} if _startup else None
+
+
+gauge('contract_process_memory_bytes', 'Memory by kind: rss, pss (shared pages split between sharers), private, '
+      'shared.', _memory_gauges)
+gauge('contract_startup_seconds', 'Seconds from process start (or fork) to each startup phase; workers forked '
+      'after a preload also carry the master\'s import and preload phases.', _startup_gauges)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for name, help, type, callback in _gauges:
+        try:
+            value = callback()
+        except Exception as e:
+            lines.append(f'# {name} unavailable: {e}')
+            continue
+        if value is None:
+            continue
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {type}')
+        if isinstance(value, dict):
+            names = value.pop('_labels', ())
+            for labels, v in sorted(value.items()):
+                lines.append(f'{name}{_fmt_labels(names, labels)} {_fmt_value(v)}')
+        else:
+            lines.append(f'{name} {_fmt_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+class RequestTimer:
+    """ASGI middleware feeding REQUEST_LATENCY; streamed responses count until their last chunk."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        t0 = time.perf_counter()
+        status = {'code': 500, 'done': False}
+
+        def record():
+            if not status['done']:
+                status['done'] = True
+                route = scope.get('route')
+                path = getattr(route, 'path', None) or 'unmatched'
+                REQUEST_LATENCY.observe(scope['method'], path, str(status['code']),
+                                        value=time.perf_counter() - t0)
+
+        async def timed_send(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                record()
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            record()
+
+
+_profile_lock = threading.Lock()
+
+
+def _start_profiler():
+    if PROFILER == 'pyinstrument':
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        return profiler
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _stop_profiler(profiler, name: str, elapsed: float):
+    if PROFILER == 'pyinstrument':
+        profiler.stop()
+    else:
+        profiler.disable()
+    if elapsed * 1000 < PROFILE_SLOW_MS:
+        return
+    out = Path(PROFILE_DIR)
+    out.mkdir(parents=True, exist_ok=True)
+    stem = f'{name}-{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}-{int(elapsed * 1000)}ms'
+    if PROFILER == 'pyinstrument':
+        (out / f'{stem}.html').write_text(profiler.output_html(), encoding='utf-8')
+    else:
+        profiler.dump_stats(out / f'{stem}.prof')
+    PROFILES.inc()
+    print(f"🐢 Slow {name} ({elapsed * 1000:.0f} ms); profile written to {out / stem}.*")
+
+
+def profiled(func):
+    """
+    Profiles a sampled share of calls when PROFILE_DIR is set. Meant for sync
+    endpoint handlers: they run in a worker thread, which a profiler started
+    in the middleware would not see. One profile is taken at a time.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not PROFILE_DIR or random.random() >= PROFILE_SAMPLE_RATE or not _profile_lock.acquire(blocking=False):
+            return func(*args, **kwargs)
+        try:
+            profiler = _start_profiler()
+        except Exception as e:
+            _profile_lock.release()
+            print(f"⚠️ Profiler unavailable: {e}")
+            return func(*args, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            try:
+                _stop_profiler(profiler, name, time.perf_counter() - t0)
+            finally:
+                _profile_lock.release()
+
+    return wrapper
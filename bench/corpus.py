@@ -0,0 +1,159 @@
+"""
+Synthetic contract corpus for benchmarks.
+
+Every document is generated from its index and the seed, so a corpus of any
+size can be rebuilt exactly. Contracts are a few pages of numbered clauses
+(parties, term, renewal, payment, liability, indemnity, confidentiality,
+termination, governing law) with varied wording, and each one comes with the
+facts it states, so retrieval answers can be checked at any scale.
+
+    python -m bench.corpus --docs 1000 --out /tmp/corpus            # PDFs
+    python -m bench.corpus --docs 100000 --format text --out /tmp/corpus
+"""
+import argparse
+import json
+import random
+from pathlib import Path
+
+COMPANIES = ['Acme', 'Globex', 'Initech', 'Umbrella', 'Stark', 'Wayne', 'Tyrell', 'Cyberdyne', 'Soylent',
+             'Hooli', 'Vandelay', 'Wonka', 'Gringotts', 'Oscorp', 'Aperture', 'Massive Dynamic', 'Nakatomi',
+             'Monarch', 'Pied Piper', 'Dunder Mifflin', 'Prestige', 'Sterling Cooper', 'Virtucon', 'Zorg']
+SUFFIXES = ['Inc.', 'LLC', 'Ltd.', 'Corp.', 'GmbH', 'Holdings', 'Group']
+LAWS = ['New York', 'Delaware', 'California', 'Texas', 'England and Wales', 'Ontario', 'Ireland', 'Singapore']
+SUBJECTS = ['software licensing', 'cloud hosting', 'consulting services', 'equipment supply', 'data processing',
+            'marketing services', 'logistics', 'facilities management', 'payroll processing', 'security monitoring']
+PAYMENT_TERMS = ['net 30', 'net 45', 'net 60', 'upon receipt', 'quarterly in advance']
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+          'November', 'December']
+FILLER = [
+    'Each party shall perform its obligations in a professional and workmanlike manner.',
+    'The Supplier shall maintain adequate records of all Services performed under this Agreement.',
+    'Any notice under this Agreement shall be in writing and delivered by hand or by registered mail.',
+    'No failure or delay in exercising any right shall operate as a waiver of that right.',
+    'This Agreement constitutes the entire agreement between the parties on its subject matter.',
+    'Neither party may assign this Agreement without the prior written consent of the other party.',
+    'The Customer shall provide timely access to its premises, systems and personnel as reasonably required.',
+    'The parties shall meet quarterly to review performance against the service levels in Schedule A.',
+    'All amounts are exclusive of value added tax and similar taxes, which the Customer shall pay.',
+    'Changes to the scope of the Services shall be agreed in writing through the change control procedure.',
+]
+PAGE_CHARS = 1800
+
+
+def _party(rng):
+    return f"{rng.choice(COMPANIES)} {rng.choice(SUFFIXES)}"
+
+
+def generate(i: int, seed: int = 0):
+    """(pages, facts) for contract number i."""
+    rng = random.Random(seed * 1_000_003 + i)
+    a, b = _party(rng), _party(rng)
+    while b == a:
+        b = _party(rng)
+    facts = {
+        'id': i,
+        'parties': [a, b],
+        'effective_date': f"{rng.choice(MONTHS)} {rng.randint(1, 28)}, {rng.randint(2015, 2025)}",
+        'subject': rng.choice(SUBJECTS),
+        'term_months': rng.choice([12, 24, 36, 48, 60]),
+        'auto_renewal': rng.random() < 0.5,
+        'notice_days': rng.choice([15, 30, 60, 90]),
+        'payment_terms': rng.choice(PAYMENT_TERMS),
+        'liability_cap': rng.choice([None, 50_000, 100_000, 250_000, 1_000_000, 5_000_000]),
+        'confidentiality': rng.random() < 0.8,
+        'governing_law': rng.choice(LAWS),
+        'reference': f"C-{seed:02d}-{i:07d}",
+    }
+
+    def filler(n):
+        return ' '.join(rng.choice(FILLER) for _ in range(n))
+
+    clauses = [
+        f"MASTER {facts['subject'].upper()} AGREEMENT\n\nContract reference {facts['reference']}",
+        f"This Agreement is entered into by and between {a} (the \"Customer\") and {b} (the \"Supplier\"), "
+        f"effective as of {facts['effective_date']} (the \"Effective Date\").",
+        f"1. Services\n\nThe Supplier shall provide {facts['subject']} to the Customer. {filler(rng.randint(2, 5))}",
+    ]
+    term = (f"2. Term\n\nThe initial term of this Agreement is {facts['term_months']} months from the "
+            f"Effective Date.")
+    if facts['auto_renewal']:
+        term += (f" This Agreement shall automatically renew for successive one-year periods unless either party "
+                 f"gives written notice of non-renewal at least {facts['notice_days']} days before the end of the "
+                 f"then-current term.")
+    clauses.append(term)
+    clauses.append(f"3. Fees and Payment\n\nInvoices are payable {facts['payment_terms']}. "
+                   f"{filler(rng.randint(1, 4))}")
+    if facts['liability_cap'] is None:
+        clauses.append("4. Limitation of Liability\n\nThe Supplier's liability under this Agreement shall be "
+                       "unlimited for breaches of its obligations.")
+    else:
+        clauses.append(f"4. Limitation of Liability\n\nEach party's total liability under this Agreement is limited "
+                       f"to ${facts['liability_cap']:,}. {filler(1)}")
+    clauses.append(f"5. Indemnification\n\nThe Supplier shall indemnify and hold harmless the Customer against any "
+                   f"third-party claims arising from the Services. {filler(rng.randint(1, 3))}")
+    if facts['confidentiality']:
+        clauses.append(f"6. Confidentiality\n\nEach party shall keep the other party's Confidential Information "
+                       f"secret and use it only to perform this Agreement. {filler(rng.randint(1, 3))}")
+    clauses.append(f"7. Termination\n\nEither party may terminate this Agreement for material breach on "
+                   f"{facts['notice_days']} days' written notice. {filler(rng.randint(1, 4))}")
+    clauses.append(f"8. Governing Law\n\nThis Agreement shall be governed by the laws of {facts['governing_law']}.")
+    clauses.append(f"9. General\n\n{filler(rng.randint(3, 8))}")
+    clauses.append(f"IN WITNESS WHEREOF the parties have signed this Agreement.\n\nSigned by: {a}\n\nSigned by: {b}")
+
+    pages, page = [], ''
+    for clause in clauses:
+        if page and len(page) + len(clause) > PAGE_CHARS:
+            pages.append(page)
+            page = ''
+        page += clause + '\n\n'
+    pages.append(page)
+    return pages, facts
+
+
+def questions(facts: dict):
+    """(question, expected answer) pairs that the contract answers in one clause."""
+    a, b = facts['parties']
+    qa = [
+        (f"What law governs the agreement between {a} and {b}?", facts['governing_law']),
+        (f"What are the payment terms for contract {facts['reference']}?", facts['payment_terms']),
+        (f"What is the initial term of the {facts['subject']} agreement between {a} and {b}?",
+         f"{facts['term_months']} months"),
+    ]
+    if facts['liability_cap'] is not None:
+        qa.append((f"What is the liability cap in the agreement between {a} and {b}?",
+                   f"${facts['liability_cap']:,}"))
+    return qa
+
+
+def write_pdf(pages, path: Path):
+    import fitz
+    doc = fitz.open()
+    for text in pages:
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(54, 54, page.rect.width - 54, page.rect.height - 54), text, fontsize=9)
+    doc.save(path)
+    doc.close()
+
+
+def write_corpus(n_docs: int, out: Path, fmt: str = 'pdf', seed: int = 0):
+    """Writes contract-<i>.pdf (or .txt with form feeds between pages) and facts.jsonl to `out`."""
+    out.mkdir(parents=True, exist_ok=True)
+    with open(out / 'facts.jsonl', 'w', encoding='utf-8') as facts_file:
+        for i in range(n_docs):
+            pages, facts = generate(i, seed)
+            if fmt == 'pdf':
+                write_pdf(pages, out / f'contract-{i:07d}.pdf')
+            else:
+                (out / f'contract-{i:07d}.txt').write_text('\f'.join(pages) + '\f', encoding='utf-8')
+            facts_file.write(json.dumps(facts) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=1000)
+    parser.add_argument('--out', type=Path, required=True)
+    parser.add_argument('--format', choices=['pdf', 'text'], default='pdf')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_corpus(args.docs, args.out, args.format, args.seed)
+    print(f"✅ Wrote {args.docs} contracts to {args.out}")
@@ -0,0 +1,355 @@
+"""
+Benchmark suite: ingest throughput, index build time and memory, /ask
+latency under concurrent load and the QA eval set, all against the app
+running in-process on a fresh data directory.
+
+    python -m bench.run --docs 1000                      # PDFs through /ingest
+    python -m bench.run --docs 1000,10000,100000 --format text
+    python -m bench.run --compare old.json new.json      # exit 1 on regressions
+
+--format pdf uploads generated PDFs through /ingest, so extraction, analysis
+and incremental indexing are all timed. --format text writes the texts
+straight to the store (what ingest does after extraction) and is the
+practical choice at 100k documents. Each scale runs in its own process so
+memory figures do not carry over. Results are written as JSON to --out.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from . import corpus
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+SAMPLE_PDF = ROOT / 'data' / '6c084119-de71-4585-812b-cd2cbf7a397c.pdf'
+
+# metric path -> True if higher is better; used by --compare
+TRACKED = {
+    'ingest.docs_per_s': True,
+    'index.build_s': False,
+    'index.rss_after_mb': False,
+    'index.snapshot_load_s': False,
+    'ask.p50_ms': False,
+    'ask.p95_ms': False,
+    'ask.p99_ms': False,
+    'ask.requests_per_s': True,
+    'ask.doc_hit_rate': True,
+    'eval.accuracy': True,
+}
+
+
+def _mb(n_bytes: int) -> float:
+    return round(n_bytes / 2 ** 20, 1)
+
+
+def _git_rev():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _percentiles(latencies):
+    arr = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99]) if len(arr) else (0, 0, 0)
+    return {'p50_ms': round(float(p50), 2), 'p95_ms': round(float(p95), 2), 'p99_ms': round(float(p99), 2),
+            'mean_ms': round(float(arr.mean()), 2) if len(arr) else 0, 'max_ms': round(float(arr.max()), 2)
+            if len(arr) else 0}
+
+
+def _wait_for_jobs(client, job_ids, timeout):
+    deadline = time.monotonic() + timeout
+    pending = set(job_ids)
+    failed = 0
+    while pending:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'{len(pending)} ingest jobs still running after {timeout}s')
+        for job_id in list(pending):
+            job = client.get(f'/jobs/{job_id}').json()
+            if job['status'] in ('done', 'failed'):
+                pending.discard(job_id)
+                failed += sum(f['status'] == 'failed' for f in job['files'])
+        if pending:
+            time.sleep(0.2)
+    return failed
+
+
+def ingest_pdfs(client, n_docs, seed, batch, work_dir, timeout):
+    """Generates PDFs, uploads them `batch` per request and waits for the jobs; returns (stats, doc ids)."""
+    pdf_dir = work_dir / 'corpus'
+    pdf_dir.mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+    paths = []
+    for i in range(n_docs):
+        pages, _ = corpus.generate(i, seed)
+        path = pdf_dir / f'contract-{i:07d}.pdf'
+        corpus.write_pdf(pages, path)
+        paths.append(path)
+    generate_s = time.perf_counter() - t0
+    total_bytes = sum(p.stat().st_size for p in paths)
+
+    t0 = time.perf_counter()
+    job_ids, doc_ids = [], []
+    for i in range(0, n_docs, batch):
+        files = [('files', (p.name, p.read_bytes(), 'application/pdf')) for p in paths[i:i + batch]]
+        body = client.post('/ingest', files=files).json()
+        job_ids.append(body['job_id'])
+        doc_ids.extend(body['document_ids'])
+    failed = _wait_for_jobs(client, job_ids, timeout)
+    elapsed = time.perf_counter() - t0
+    return {'generate_s': round(generate_s, 3), 'elapsed_s': round(elapsed, 3), 'failed': failed,
+            'docs_per_s': round(n_docs / elapsed, 2), 'mb_per_s': round(_mb(total_bytes) / elapsed, 2),
+            'input_mb': _mb(total_bytes)}, doc_ids
+
+
+def ingest_texts(n_docs, seed, batch):
+    """Stores generated texts with their analyses and appends them to the index, `batch` at a time."""
+    from app import analysis, retriever, storage
+    t0 = time.perf_counter()
+    doc_ids, chars = [], 0
+    for lo in range(0, n_docs, batch):
+        records, rows = [], []
+        for i in range(lo, min(n_docs, lo + batch)):
+            pages, facts = corpus.generate(i, seed)
+            text = storage.join_pages(pages)
+            doc_id = f'bench-{seed:02d}-{i:07d}'
+            records.append((doc_id, {'filename': f'contract-{i:07d}.pdf', 'size': len(text),
+                                     'ingested_at': int(time.time())}, text))
+            rows.extend(analysis.analyze(doc_id, text))
+            doc_ids.append(doc_id)
+            chars += len(text)
+        storage.save_docs(records)
+        storage.save_analyses(rows)
+        retriever.add_documents([r[0] for r in records])
+    elapsed = time.perf_counter() - t0
+    return {'elapsed_s': round(elapsed, 3), 'failed': 0, 'docs_per_s': round(n_docs / elapsed, 2),
+            'mb_per_s': round(_mb(chars) / elapsed, 2), 'input_mb': _mb(chars)}, doc_ids
+
+
+def measure_index():
+    """Full rebuild, snapshot write and snapshot load."""
+    from app import retriever, telemetry
+    rss_before = telemetry.rss_bytes()
+    t0 = time.perf_counter()
+    retriever.init_index()
+    build_s = time.perf_counter() - t0
+    rss_after = telemetry.rss_bytes()
+    t0 = time.perf_counter()
+    retriever.save_snapshot()
+    save_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    loaded = retriever.load_snapshot()
+    load_s = time.perf_counter() - t0
+    stats = retriever.index_stats()
+    return {'build_s': round(build_s, 3), 'snapshot_save_s': round(save_s, 3),
+            'snapshot_load_s': round(load_s, 3) if loaded else None, 'chunks': stats['chunks'],
+            'nnz': stats['nnz'], 'rss_before_mb': _mb(rss_before), 'rss_after_mb': _mb(telemetry.rss_bytes()),
+            'rss_build_delta_mb': _mb(rss_after - rss_before), 'peak_rss_mb': _mb(telemetry.peak_rss_bytes())}
+
+
+def load_test(client, doc_ids, seed, n_requests, concurrency, top_k):
+    """Sends n_requests /ask calls from `concurrency` threads; questions are about random corpus documents."""
+    rng = random.Random(seed)
+    work = []
+    for _ in range(n_requests):
+        i = rng.randrange(len(doc_ids))
+        question, _ = rng.choice(corpus.questions(corpus.generate(i, seed)[1]))
+        work.append((question, doc_ids[i]))
+
+    def one(item):
+        question, doc_id = item
+        t0 = time.perf_counter()
+        response = client.post('/ask', json={'question': question, 'top_k': top_k})
+        latency = time.perf_counter() - t0
+        ok = response.status_code == 200
+        cited = ok and any(c['document_id'] == doc_id for c in response.json()['citations'])
+        return latency, ok, cited
+
+    for item in work[:min(len(work), concurrency)]:
+        one(item)  # warm-up
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(one, work))
+    elapsed = time.perf_counter() - t0
+    latencies = [o[0] for o in outcomes]
+    return {'requests': n_requests, 'concurrency': concurrency, 'top_k': top_k, 'elapsed_s': round(elapsed, 3),
+            'requests_per_s': round(n_requests / elapsed, 2), 'errors': sum(not o[1] for o in outcomes),
+            'doc_hit_rate': round(sum(o[2] for o in outcomes) / n_requests, 4), **_percentiles(latencies)}
+
+
+def run_eval(client, concurrency):
+    """The eval/qa_eval.json questions, asked concurrently about the sample PDF they were written for."""
+    from eval import eval_run
+    if not SAMPLE_PDF.exists():
+        return None
+    body = client.post('/ingest', files=[('files', (SAMPLE_PDF.name, SAMPLE_PDF.read_bytes(),
+                                                    'application/pdf'))]).json()
+    _wait_for_jobs(client, [body['job_id']], timeout=120)
+    doc_id = body['document_ids'][0]
+
+    def ask(question):
+        response = client.post('/ask', json={'question': question, 'top_k': 3, 'document_id': doc_id})
+        response.raise_for_status()
+        return response.json()['answer']
+
+    summary = eval_run.evaluate(ask, eval_run.load_eval(), concurrency)
+    latencies = [r['latency_ms'] / 1000 for r in summary['results']]
+    return {**summary, **_percentiles(latencies)}
+
+
+def run_scale(args, n_docs: int) -> dict:
+    """One benchmark run in this process; DATA_DIR must not have been imported yet."""
+    work_dir = Path(args.data_dir or tempfile.mkdtemp(prefix=f'contract-bench-{n_docs}-'))
+    os.environ['DATA_DIR'] = str(work_dir)
+    if not args.cache:
+        os.environ['QUERY_CACHE_SIZE'] = '0'
+    from fastapi.testclient import TestClient
+    from app import telemetry
+    from app.main import app
+
+    result = {'docs': n_docs, 'format': args.format, 'data_dir': str(work_dir)}
+    t0 = time.perf_counter()
+    with TestClient(app) as client:
+        result['startup_s'] = round(time.perf_counter() - t0, 3)
+        print(f"⏱️ Ingesting {n_docs} documents ({args.format})...", file=sys.stderr)
+        if args.format == 'pdf':
+            result['ingest'], doc_ids = ingest_pdfs(client, n_docs, args.seed, args.batch, work_dir,
+                                                    args.ingest_timeout)
+        else:
+            result['ingest'], doc_ids = ingest_texts(n_docs, args.seed, args.batch)
+        result['ingest']['rss_mb'] = _mb(telemetry.rss_bytes())
+        print("⏱️ Rebuilding the index...", file=sys.stderr)
+        result['index'] = measure_index()
+        print(f"⏱️ Load test: {args.requests} requests, concurrency {args.concurrency}...", file=sys.stderr)
+        result['ask'] = load_test(client, doc_ids, args.seed, args.requests, args.concurrency, args.top_k)
+        result['eval'] = run_eval(client, args.concurrency)
+        result['stages'] = _stage_summary(telemetry)
+    return result
+
+
+def _stage_summary(telemetry):
+    """Count and total seconds per pipeline stage, from the app's own stage timers."""
+    summary = {}
+    for line in telemetry.render().splitlines():
+        for suffix, key in (('_sum', 'total_s'), ('_count', 'count')):
+            prefix = f'contract_stage_duration_seconds{suffix}{{stage="'
+            if line.startswith(prefix):
+                stage, value = line[len(prefix):].split('"} ')
+                summary.setdefault(stage, {})[key] = round(float(value), 4)
+    return summary
+
+
+def _get(result: dict, path: str):
+    for key in path.split('.'):
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def compare(old_path: Path, new_path: Path, tolerance: float) -> bool:
+    """Prints tracked metrics side by side per scale; returns False if any regressed by more than `tolerance`."""
+    old = {r['docs']: r for r in json.loads(old_path.read_text())['runs']}
+    new = {r['docs']: r for r in json.loads(new_path.read_text())['runs']}
+    ok = True
+    for docs in sorted(set(old) & set(new)):
+        print(f"\n{docs} documents")
+        for path, higher_is_better in TRACKED.items():
+            a, b = _get(old[docs], path), _get(new[docs], path)
+            if a is None or b is None:
+                continue
+            change = (b - a) / a if a else 0.0
+            worse = -change if higher_is_better else change
+            flag = '❌' if worse > tolerance else '✅'
+            ok &= worse <= tolerance
+            print(f"  {flag} {path:<24} {a:>12} → {b:<12} ({change:+.1%})")
+    return ok
+
+
+def _without_option(argv, name):
+    kept, skip = [], False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == name:
+            skip = True
+        elif not arg.startswith(name + '='):
+            kept.append(arg)
+    return kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', default='1000', help='corpus size, or a comma-separated list of sizes')
+    parser.add_argument('--format', choices=['pdf', 'text'], default='pdf')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch', type=int, default=100, help='documents per upload (pdf) or store batch (text)')
+    parser.add_argument('--requests', type=int, default=1000, help='/ask requests in the load test')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--cache', action='store_true', help='keep the query cache on during the load test')
+    parser.add_argument('--ingest-timeout', type=float, default=3600)
+    parser.add_argument('--data-dir', help='use this (empty) directory instead of a temporary one')
+    parser.add_argument('--out', type=Path, help='JSON results file (default bench/results/bench-<time>.json)')
+    parser.add_argument('--compare', nargs=2, type=Path, metavar=('OLD', 'NEW'))
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed relative regression for --compare')
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(0 if compare(*args.compare, args.tolerance) else 1)
+
+    scales = [int(s) for s in args.docs.split(',')]
+    if args.single:
+        # child process: app output goes to stderr, the result to stdout
+        out = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+        sys.stdout.flush()
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        result = run_scale(args, scales[0])
+        from app import pool
+        pool.shutdown()
+        out.write(json.dumps(result))
+        out.close()
+        return
+
+    runs = []
+    for n_docs in scales:
+        child = _without_option(sys.argv[1:], '--out')
+        cmd = [sys.executable, '-m', 'bench.run', *child, '--docs', str(n_docs), '--single']
+        proc = subprocess.run(cmd, cwd=ROOT, stdout=subprocess.PIPE, text=True)
+        if proc.returncode != 0:
+            sys.exit(f"❌ Benchmark at {n_docs} documents failed (exit {proc.returncode})")
+        runs.append(json.loads(proc.stdout))
+        ask = runs[-1]['ask']
+        print(f"✅ {n_docs} docs: ingest {runs[-1]['ingest']['docs_per_s']} docs/s, "
+              f"index build {runs[-1]['index']['build_s']} s, "
+              f"/ask p50/p95/p99 {ask['p50_ms']}/{ask['p95_ms']}/{ask['p99_ms']} ms at {ask['requests_per_s']} req/s")
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_rev': _git_rev(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': {k: v for k, v in vars(args).items() if k not in ('out', 'compare', 'single')},
+        'runs': runs,
+    }
+    out_path = args.out or RESULTS_DIR / f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(report, indent=2, default=str), encoding='utf-8')
+    print(f"💾 Results written to {out_path}")
+
+
+if __name__ == '__main__':
+    main()
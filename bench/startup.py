@@ -0,0 +1,154 @@
+"""
+Startup time and memory per worker, with and without preloading.
+
+    python -m bench.startup --workers 4 --docs 5000
+
+Seeds a data directory with a synthetic text corpus and its index snapshot,
+then starts the workers twice: each one importing the app and loading the
+index on its own (separate uvicorn processes, or gunicorn with PRELOAD=0),
+and forked from a master that ran app.main.preload() first (gunicorn.conf.py
+with PRELOAD=1). While all workers are alive, each one's RSS, PSS and private
+memory are read from /proc. PSS splits shared pages between the processes
+that share them, so summed PSS is what the deployment really uses. Linux only.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _emit_to_stdout():
+    """A line-buffered handle on the real stdout; app output is sent to stderr from here on."""
+    out = os.fdopen(os.dup(sys.stdout.fileno()), 'w', buffering=1)
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return out
+
+
+def _seed(n_docs: int, seed: int):
+    from app import retriever
+    from .run import ingest_texts
+    ingest_texts(n_docs, seed, 500)
+    retriever.save_snapshot()
+
+
+def _worker(out):
+    from app import main, telemetry
+    main.startup()
+    out.write(json.dumps({'pid': os.getpid(), 'ready_s': telemetry._startup['ready']}) + '\n')
+    # stay alive until the benchmark has read every worker's memory
+    sys.stdin.read()
+
+
+def _master(out, workers: int):
+    from app import main, telemetry
+    main.preload()
+    out.write(json.dumps({'pid': os.getpid(), 'master': True, 'preload_s': telemetry._startup['preload']}) + '\n')
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _worker(out)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    sys.stdin.read()
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+def _start(args, role: str, env: dict):
+    cmd = [sys.executable, '-m', 'bench.startup', '--role', role, '--workers', str(args.workers)]
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+                            stderr=None if args.verbose else subprocess.DEVNULL)
+
+
+def _measure(args, preload: bool, env: dict) -> dict:
+    """Starts the workers, waits until all are ready and reads their memory."""
+    from app import telemetry
+    if preload:
+        procs = [_start(args, 'master', env)]
+        lines = [procs[0].stdout.readline() for _ in range(args.workers + 1)]
+    else:
+        procs = [_start(args, 'worker', env) for _ in range(args.workers)]
+        lines = [p.stdout.readline() for p in procs]
+    if not all(lines):
+        sys.exit('❌ A worker exited before it was ready; rerun with --verbose')
+    reports = [json.loads(line) for line in lines]
+    for report in reports:
+        report.update({k: round(v / 2 ** 20, 1) for k, v in telemetry.memory_breakdown(report['pid']).items()})
+    for p in procs:
+        p.stdin.close()
+    for p in procs:
+        p.wait()
+    workers = [r for r in reports if not r.get('master')]
+    master = next((r for r in reports if r.get('master')), None)
+
+    def mean(key):
+        return round(sum(w[key] for w in workers) / len(workers), 2)
+
+    return {
+        'preload': preload,
+        'preload_s': round(master['preload_s'], 2) if master else None,
+        'ready_s_mean': mean('ready_s'),
+        'ready_s_max': round(max(w['ready_s'] for w in workers), 2),
+        'rss_mb_mean': mean('rss'),
+        'pss_mb_mean': mean('pss'),
+        'private_mb_mean': mean('private'),
+        'total_pss_mb': round(sum(r['pss'] for r in reports), 1),
+        'processes': reports,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--docs', type=int, default=2000, help='synthetic documents to seed a new data directory')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', help='use this data directory as it is instead of seeding a temporary one')
+    parser.add_argument('--out', type=Path, help='write the results as JSON')
+    parser.add_argument('--verbose', action='store_true', help="show the workers' own output")
+    parser.add_argument('--role', choices=['seed', 'worker', 'master'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role:
+        out = _emit_to_stdout()
+        if args.role == 'seed':
+            _seed(args.docs, args.seed)
+        elif args.role == 'worker':
+            _worker(out)
+        else:
+            _master(out, args.workers)
+        return
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='contract-startup-')
+    env = {**os.environ, 'DATA_DIR': data_dir}
+    if not args.data_dir:
+        print(f"⏱️ Seeding {args.docs} documents in {data_dir}...", file=sys.stderr)
+        subprocess.run([sys.executable, '-m', 'bench.startup', '--role', 'seed', '--docs', str(args.docs),
+                        '--seed', str(args.seed)], cwd=ROOT, env=env, check=True,
+                       stdout=None if args.verbose else subprocess.DEVNULL,
+                       stderr=None if args.verbose else subprocess.DEVNULL)
+    results = []
+    for preload in (False, True):
+        r = _measure(args, preload, env)
+        results.append(r)
+        print(f"✅ {'preload' if preload else 'separate'}: {args.workers} workers ready in "
+              f"{r['ready_s_mean']} s (max {r['ready_s_max']} s); per worker RSS {r['rss_mb_mean']} MB, "
+              f"PSS {r['pss_mb_mean']} MB, private {r['private_mb_mean']} MB; total PSS {r['total_pss_mb']} MB"
+              + (f" (master preload {r['preload_s']} s)" if preload else ''))
+    if args.out:
+        report = {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'workers': args.workers,
+                  'docs': None if args.data_dir else args.docs, 'runs': results}
+        args.out.write_text(json.dumps(report, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
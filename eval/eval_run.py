@@ -1,46 +1,113 @@
+"""
+Runs the QA eval set against /ask.
+
+    python eval/eval_run.py [--url http://127.0.0.1:8000] [--concurrency 8] [--document-id ID] [--out results.json]
+
+Questions are sent concurrently. An answer counts as correct when it contains
+at least MATCH_THRESHOLD of the content words of the expected answer.
+"""
+import argparse
 import json
-import requests
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-API_URL = "http://127.0.0.1:8000/ask"
+API_URL = "http://127.0.0.1:8000"
 EVAL_PATH = Path(__file__).resolve().parent / "qa_eval.json"
+MATCH_THRESHOLD = 0.5
+
+_STOPWORDS = {"the", "and", "for", "that", "this", "with", "from", "are", "was", "were", "its", "their", "it",
+              "is", "of", "to", "a", "an", "in", "on", "or", "be", "as", "if", "by", "should"}
+
+
+def load_eval(path: Path = EVAL_PATH):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
 
-def run_evaluation():
-    with open(EVAL_PATH, "r", encoding="utf-8") as f:
-        qa_pairs = json.load(f)
+def _words(text: str):
+    return {w for w in re.findall(r"[a-z0-9]+", text.lower()) if w not in _STOPWORDS}
 
-    correct = 0
-    total = len(qa_pairs)
-    print(f"🔍 Running evaluation on {total} questions via /ask endpoint...\n")
 
-    for qa in qa_pairs:
-        payload = {
-            "question": qa["question"],
-            "top_k": 3
-        }
+def similarity(expected: str, answer: str) -> float:
+    """Share of the expected answer's content words that appear in the answer."""
+    wanted = _words(expected)
+    if not wanted:
+        return 0.0
+    return round(len(wanted & _words(answer)) / len(wanted), 2)
 
+
+def http_ask(url: str = API_URL, document_id: str = None, top_k: int = 3):
+    """ask(question) -> answer text, posting to a running server."""
+    import requests
+    session = requests.Session()
+
+    def ask(question):
+        payload = {"question": question, "top_k": top_k}
+        if document_id:
+            payload["document_id"] = document_id
+        response = session.post(f"{url.rstrip('/')}/ask", json=payload, timeout=15)
+        response.raise_for_status()
+        return response.json().get("answer", "")
+
+    return ask
+
+
+def evaluate(ask, qa_pairs, concurrency: int = 8) -> dict:
+    """Runs every question through ask() concurrently; returns accuracy, latencies and per-question results."""
+    def run(qa):
+        t0 = time.perf_counter()
         try:
-            response = requests.post(API_URL, json=payload, timeout=15)
-            if response.status_code == 200:
-                data = response.json()
-                answer = data.get("answers", [""])[0] if "answers" in data else ""
-            else:
-                print(f"⚠️ Error: {response.status_code} for Q{qa['id']}")
-                answer = ""
+            answer, error = ask(qa["question"]), None
         except Exception as e:
-            print(f"⚠️ Exception for Q{qa['id']}: {e}")
-            answer = ""
+            answer, error = "", str(e)
+        latency_ms = round((time.perf_counter() - t0) * 1000, 2)
+        score = similarity(qa["expected_answer"], answer)
+        result = {"id": qa["id"], "question": qa["question"], "expected": qa["expected_answer"], "answer": answer,
+                  "similarity": score, "result": "✅" if score >= MATCH_THRESHOLD else "❌",
+                  "latency_ms": latency_ms}
+        if error:
+            result["error"] = error
+        return result
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        results = list(executor.map(run, qa_pairs))
+    elapsed = time.perf_counter() - t0
+    correct = sum(r["result"] == "✅" for r in results)
+    return {
+        "total": len(results),
+        "correct": correct,
+        "accuracy": round(correct / len(results) * 100, 2) if results else 0.0,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "results": results,
+    }
 
-        expected = qa["expected_answer"]
-        match = expected.lower().split()[0] in answer.lower() if answer else False
-        correct += int(match)
 
-        print(f"Q{qa['id']}: {qa['question']}")
-        print(f"🟩 Expected: {expected}")
-        print(f"🟦 Got: {answer}\n{'-'*70}")
+def run_evaluation(url: str = API_URL, concurrency: int = 8, document_id: str = None, out: Path = None):
+    qa_pairs = load_eval()
+    print(f"🔍 Running evaluation on {len(qa_pairs)} questions via /ask endpoint...\n")
+    summary = evaluate(http_ask(url, document_id), qa_pairs, concurrency)
+    for r in summary["results"]:
+        print(f"Q{r['id']}: {r['question']}")
+        print(f"🟩 Expected: {r['expected']}")
+        if "error" in r:
+            print(f"⚠️ Error: {r['error']}")
+        print(f"🟦 Got: {r['answer']}\n{r['result']} similarity {r['similarity']}, {r['latency_ms']} ms\n{'-'*70}")
+    print(f"\n✅ Evaluation complete — Accuracy: {summary['accuracy']}% ({summary['correct']}/{summary['total']} correct)")
+    if out:
+        Path(out).write_text(json.dumps(summary, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"💾 Results written to {out}")
+    return summary
 
-    accuracy = round(correct / total * 100, 2)
-    print(f"\n✅ Evaluation complete — Accuracy: {accuracy}% ({correct}/{total} correct)")
 
 if __name__ == "__main__":
-    run_evaluation()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=API_URL)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--document-id", help="ask only about this document")
+    parser.add_argument("--out", type=Path, help="write the results as JSON")
+    args = parser.parse_args()
+    run_evaluation(args.url, args.concurrency, args.document_id, args.out)
@@ -0,0 +1,38 @@
+"""
+gunicorn settings for running several workers:
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+It starts one worker unless WEB_CONCURRENCY says otherwise. Each worker keeps
+its own index and ingest job state: a document ingested through one worker is
+only searchable there (the others see it after they restart), and /jobs/{id}
+only knows the job on the worker that accepted it. So ingest needs a single
+worker; run several only to serve queries over a corpus that is not changing.
+
+With PRELOAD=1 (the default) the master imports the app and runs
+app.main.preload() before forking: the index and sklearn are loaded once
+and shared copy-on-write by every worker, which then starts without loading
+anything. PRELOAD_MODELS=1 (opt-in) preloads the embedding model and FAISS
+index as well; leave it off for models whose threads or handles do not
+survive a fork. PRELOAD=0 makes each worker load its own copy, like
+separate uvicorn processes. Each worker logs its startup time and RSS / PSS /
+private memory; /metrics exports them as contract_startup_seconds and
+contract_process_memory_bytes. `python -m bench.startup` compares both modes.
+"""
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = os.getenv('PRELOAD', '1') == '1'
+timeout = int(os.getenv('WORKER_TIMEOUT', '120'))
+
+
+def when_ready(server):
+    if workers > 1:
+        print(f"⚠️ {workers} workers: documents ingested through one worker are not searchable on the others "
+              f"until they restart; ingest needs WEB_CONCURRENCY=1.")
+    # the master has imported the app and bound the socket; no worker is forked yet
+    if preload_app:
+        from app import main
+        main.preload()
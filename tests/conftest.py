@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Keep uploads and index snapshots written by the tests out of the repo's data/ directory
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="contract-intel-test-"))
@@ -0,0 +1,16 @@
+from app import extractors, storage
+from bench import corpus
+from eval import eval_run
+
+
+def test_synthetic_contracts_are_reproducible_and_parseable():
+    pages, facts = corpus.generate(7, seed=1)
+    assert corpus.generate(7, seed=1) == (pages, facts)
+    fields = extractors.extract_structured_fields(storage.join_pages(pages))
+    assert facts["governing_law"] in fields["governing_law"]
+    assert all(expected for _, expected in corpus.questions(facts))
+
+
+def test_eval_similarity_counts_content_words():
+    assert eval_run.similarity("The extracted text should match.", "extracted text should match closely") == 1.0
+    assert eval_run.similarity("Introduction, Methods, Results", "Introduction only") == 0.33
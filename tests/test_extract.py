@@ -10,3 +10,27 @@ def test_extract_fields():
 
     # Since document might not exist, allow both 200 or 404 for flexibility
     assert response.status_code in (200, 404)
+
+
+def test_structured_fields_from_sample_contract():
+    from app.extractors import extract_structured_fields
+
+    text = ("This Master Services Agreement is made between Acme Corp and Beta LLC.\n"
+            "Effective Date: January 1, 2024\n"
+            "Governing Law. New York\n"
+            "Payment: Fees are due within 30 days. Termination for cause requires notice.\n"
+            "This agreement shall auto-renew annually. Each party keeps the other's information confidential. "
+            "Supplier shall indemnify Customer. "
+            "Total liability under this agreement is subject to a cap: $1,000,000\n"
+            "Signed by: Jane Doe\n")
+    fields = extract_structured_fields(text)
+    assert fields["parties"] == ["Acme Corp", "Beta LLC."]
+    assert fields["effective_date"] == "January 1, 2024"
+    assert fields["governing_law"] == "New York"
+    assert fields["payment_terms"].startswith("Payment: Fees")
+    assert fields["termination"].startswith("Termination for cause")
+    assert fields["auto_renewal"] == "This agreement shall auto-renew annually."
+    assert fields["confidentiality"] is True
+    assert fields["indemnity"] == "Supplier shall indemnify Customer."
+    assert fields["liability_cap"] == {"amount": 1000000}
+    assert fields["signatories"] == [{"name": "Jane Doe", "title": None}]
@@ -9,9 +9,17 @@ def test_ingest_pdf():
     fake_pdf = io.BytesIO(b"%PDF-1.4\n%fake pdf content")
     response = client.post(
         "/ingest",
-        files={"file": ("sample.pdf", fake_pdf, "application/pdf")}
+        files={"files": ("sample.pdf", fake_pdf, "application/pdf")}
     )
     assert response.status_code == 200
     data = response.json()
     assert "document_ids" in data
     assert isinstance(data["document_ids"], list)
+
+
+def test_ask_rejects_out_of_range_sizes():
+    assert client.post("/ask", json={"question": "term?", "top_k": None}).status_code == 422
+    assert client.post("/ask", json={"question": "term?", "top_k": -1}).status_code == 422
+    assert client.post("/ask", json={"question": "term?", "backend": "hybrid", "candidates": 0}).status_code == 422
+    assert client.post("/ask/batch", json={"questions": ["term?"] * 100_000}).status_code == 422
+    assert client.get("/ask/stream", params={"question": "term?", "top_k": 0}).status_code == 422
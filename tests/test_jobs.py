@@ -0,0 +1,186 @@
+import hashlib
+import time
+
+import fitz
+from fastapi.testclient import TestClient
+from app import storage
+from app.main import app
+
+client = TestClient(app)
+
+
+def _pdf_bytes(text):
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), text)
+    return doc.tobytes()
+
+
+def _wait_for(job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_ingest_returns_job_and_indexes_in_background():
+    first = _pdf_bytes("The governing law is the law of Delaware.")
+    response = client.post(
+        "/ingest",
+        files=[
+            ("files", ("a.pdf", first, "application/pdf")),
+            ("files", ("b.pdf", _pdf_bytes("Payment is due within forty five days."), "application/pdf")),
+        ],
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["document_ids"]) == 2
+
+    job = _wait_for(data["job_id"])
+    assert job["status"] == "done"
+    assert job["progress"] == {"done": 2, "total": 2}
+    assert [f["document_id"] for f in job["files"]] == data["document_ids"]
+    meta = storage.load_doc(data["document_ids"][0])["metadata"]
+    assert meta["size"] == len(first)
+    assert meta["sha256"] == hashlib.sha256(first).hexdigest()
+
+    ask = client.post("/ask", json={"question": "governing law Delaware", "top_k": 1}).json()
+    assert ask["citations"][0]["document_id"] == data["document_ids"][0]
+
+
+def test_unknown_job_is_404():
+    assert client.get("/jobs/does-not-exist").status_code == 404
+
+
+def test_reupload_maps_to_existing_document():
+    pdf = _pdf_bytes("This master services agreement renews automatically every year.")
+    first = client.post("/ingest", files={"files": ("msa.pdf", pdf, "application/pdf")}).json()
+    assert _wait_for(first["job_id"])["status"] == "done"
+
+    again = client.post("/ingest", files={"files": ("msa-copy.pdf", pdf, "application/pdf")}).json()
+    assert again["document_ids"] == first["document_ids"]
+    job = client.get(f"/jobs/{again['job_id']}").json()
+    assert job["status"] == "done"
+    assert job["files"][0]["duplicate"] is True
+
+
+def test_claim_of_an_upload_that_was_never_stored_is_taken_over():
+    pdf = _pdf_bytes("This lease was queued when the server stopped.")
+    # a claim whose upload was still queued at shutdown, so no document was stored
+    storage.claim_content_hash(hashlib.sha256(pdf).hexdigest(), "lost-upload")
+
+    data = client.post("/ingest", files={"files": ("lease.pdf", pdf, "application/pdf")}).json()
+    assert data["document_ids"] != ["lost-upload"]
+    assert _wait_for(data["job_id"])["status"] == "done"
+    assert client.post("/extract", json={"document_id": data["document_ids"][0]}).status_code == 200
+
+
+def test_duplicate_follows_the_upload_it_duplicates(monkeypatch):
+    import threading
+    from app import pool
+
+    started, release = threading.Event(), threading.Event()
+
+    def broken(path):
+        started.set()
+        release.wait(10)
+        raise ValueError("corrupt xref table")
+
+    pdf = _pdf_bytes("This addendum is uploaded twice.")
+    monkeypatch.setattr(pool, "extract_text", broken)
+    first = client.post("/ingest", files={"files": ("add.pdf", pdf, "application/pdf")}).json()
+    assert started.wait(10)
+    again = client.post("/ingest", files={"files": ("add-copy.pdf", pdf, "application/pdf")}).json()
+    assert again["document_ids"] == first["document_ids"]
+    assert client.get(f"/jobs/{again['job_id']}").json()["files"][0]["status"] == "queued"
+
+    release.set()
+    job = _wait_for(again["job_id"])
+    assert job["status"] == "failed" and "corrupt xref table" in job["files"][0]["error"]
+    assert _wait_for(first["job_id"])["status"] == "failed"
+
+
+def test_timed_out_extraction_fails_and_frees_the_hash(monkeypatch):
+    from app import pool
+
+    def timeout(path):
+        raise TimeoutError()
+
+    pdf = _pdf_bytes("This schedule hangs the extractor.")
+    monkeypatch.setattr(pool, "extract_text", timeout)
+    first = client.post("/ingest", files={"files": ("hang.pdf", pdf, "application/pdf")}).json()
+    job = _wait_for(first["job_id"])
+    assert job["status"] == "failed" and "timed out" in job["files"][0]["error"]
+    assert storage.load_doc(first["document_ids"][0]) is None
+
+    monkeypatch.undo()
+    again = client.post("/ingest", files={"files": ("hang.pdf", pdf, "application/pdf")}).json()
+    assert again["document_ids"] != first["document_ids"]
+    assert _wait_for(again["job_id"])["status"] == "done"
+
+
+def test_snapshot_failure_does_not_fail_stored_documents(monkeypatch):
+    from app import retriever
+
+    def disk_full(force=False):
+        raise OSError(28, "No space left on device")
+
+    pdf = _pdf_bytes("This order form is stored before the snapshot fails.")
+    monkeypatch.setattr(retriever, "maybe_save_snapshot", disk_full)
+    first = client.post("/ingest", files={"files": ("order.pdf", pdf, "application/pdf")}).json()
+    assert _wait_for(first["job_id"])["status"] == "done"
+    ask = client.post("/ask", json={"question": "order form stored before the snapshot", "top_k": 1}).json()
+    assert ask["citations"][0]["document_id"] == first["document_ids"][0]
+
+    again = client.post("/ingest", files={"files": ("order.pdf", pdf, "application/pdf")}).json()
+    assert again["document_ids"] == first["document_ids"]
+
+
+def test_fields_and_findings_are_stored_at_ingest(monkeypatch):
+    from app import extractors, rules
+
+    pdf = _pdf_bytes("Supplier shall indemnify all customers. Governing law: Ontario")
+    data = client.post("/ingest", files={"files": ("gl.pdf", pdf, "application/pdf")}).json()
+    assert _wait_for(data["job_id"])["status"] == "done"
+    doc_id = data["document_ids"][0]
+    assert storage.load_analysis(doc_id, "fields")[0] == extractors.EXTRACTOR_VERSION
+    assert storage.load_analysis(doc_id, "findings")[0] == rules.RULESET_VERSION
+
+    def fail(*args):
+        raise AssertionError("recomputed a current result")
+
+    monkeypatch.setattr(extractors, "extract_structured_fields", fail)
+    assert client.post("/extract", json={"document_id": doc_id}).json()["governing_law"] == "Ontario"
+
+    # a new ruleset version makes the stored findings stale
+    monkeypatch.setattr(rules, "RULESET_VERSION", "test-2")
+    findings = client.post("/audit", json={"document_id": doc_id}).json()["findings"]
+    assert "broad_indemnity" in [f["rule"] for f in findings]
+    assert storage.load_analysis(doc_id, "findings")[0] == "test-2"
+
+
+def test_bulk_audit_streams_ndjson_and_skips_current_findings():
+    import json
+    from app import rules
+
+    data = client.post("/ingest", files=[
+        ("files", ("bulk-1.pdf", _pdf_bytes("Either party may auto-renew within 10 days."), "application/pdf")),
+        ("files", ("bulk-2.pdf", _pdf_bytes("All information is confidential."), "application/pdf")),
+    ]).json()
+    assert _wait_for(data["job_id"])["status"] == "done"
+    ids = data["document_ids"]
+    storage.save_analyses([(ids[1], "findings", "old", [])])
+
+    # a filter alone selects from all documents
+    response = client.post("/audit/bulk", json={"filter": {"filename": "bulk-*.pdf"}})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    results = {item["document_id"]: item for item in lines[:-1]}
+    assert set(results) == set(ids)
+    assert results[ids[0]]["cached"] is True
+    assert results[ids[1]]["cached"] is False
+    assert [f["rule"] for f in results[ids[0]]["findings"]] == ["auto_renewal_notice", "missing_confidentiality"]
+    assert lines[-1]["summary"]["audited"] == 1
+    assert storage.load_analysis(ids[1], "findings")[0] == rules.ruleset_version()
@@ -0,0 +1,82 @@
+import asyncio
+import json
+import threading
+
+import httpx
+
+from app import llm
+
+
+def _provider(log, fail_first=0):
+    """Mock OpenAI-compatible provider: records requests, answers embeddings and streamed chat."""
+    state = {"calls": 0}
+
+    def handler(request):
+        state["calls"] += 1
+        body = json.loads(request.content)
+        log.append((request.url.path, body))
+        if state["calls"] <= fail_first:
+            return httpx.Response(429, headers={"retry-after": "0"})
+        if request.url.path.endswith("/embeddings"):
+            data = [{"index": i, "embedding": [float(len(t)), 1.0]} for i, t in enumerate(body["input"])]
+            return httpx.Response(200, json={"data": data})
+        chunks = [{"choices": [{"delta": {"content": piece}}]} for piece in ["Gov", "erned ", "by NY."]]
+        sse = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+        return httpx.Response(200, text=sse, headers={"content-type": "text/event-stream"})
+
+    return httpx.MockTransport(handler)
+
+
+def test_concurrent_embeds_are_merged_into_one_request():
+    log = []
+
+    async def run():
+        client = llm.LLMClient("k", base_url="http://provider.test/v1", transport=_provider(log), batch_window=0.05)
+        results = await asyncio.gather(*(client.embed([f"text {i}", "x" * i]) for i in range(10)))
+        await client.aclose()
+        return results
+
+    results = asyncio.run(run())
+    assert len(log) == 1 and len(log[0][1]["input"]) == 20
+    assert [r[1][0] for r in results] == [float(i) for i in range(10)]
+
+
+def test_rate_limited_requests_are_retried():
+    log = []
+
+    async def run():
+        client = llm.LLMClient("k", base_url="http://provider.test/v1", transport=_provider(log, fail_first=2),
+                               backoff_base=0.001, batch_window=0)
+        vectors = await client.embed(["abc"])
+        await client.aclose()
+        return vectors, client.stats
+
+    vectors, stats = asyncio.run(run())
+    assert vectors == [[3.0, 1.0]]
+    assert len(log) == 3 and stats["retries"] == 2
+
+
+def test_sync_helpers_share_the_background_client(monkeypatch):
+    log = []
+
+    async def make_client():
+        return llm.LLMClient("k", base_url="http://provider.test/v1", transport=_provider(log), batch_window=0.05)
+
+    monkeypatch.setattr(llm, "OPENAI_KEY", "test-key")
+    monkeypatch.setattr(llm, "_make_client", make_client)
+    monkeypatch.setattr(llm, "_client", None)
+
+    results = [None] * 4
+
+    def worker(i):
+        results[i] = llm.embed_texts(["a" * (i + 1)])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [[[float(i + 1), 1.0]] for i in range(4)]
+    assert len([p for p, _ in log if p.endswith("/embeddings")]) == 1
+
+    assert "".join(llm.stream_synthesis("governing law?", ["snippet"])) == "Governed by NY."
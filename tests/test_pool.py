@@ -0,0 +1,96 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import pool, storage
+
+
+def _hang(*args):
+    time.sleep(5)
+
+
+def _page_count(path):
+    # runs in the pool's worker processes
+    time.sleep({"hang.pdf": 5, "slow.pdf": 3}.get(path.name, 0))
+    return 1
+
+
+def _pages(path, start, end):
+    return [f"text of {path.name}"]
+
+
+def test_hung_extraction_frees_its_worker_and_slot(monkeypatch, tmp_path):
+    monkeypatch.setattr(storage, "page_count", _hang)
+    monkeypatch.setattr(pool, "_slots", threading.BoundedSemaphore(1))
+    path = tmp_path / "hang.pdf"
+    path.write_bytes(b"%PDF-1.4")
+    stuck = pool.get_pool()
+    try:
+        with pytest.raises(TimeoutError):
+            pool.extract_text(path, timeout=1)
+        assert pool.get_pool() is not stuck
+        assert pool._slots.acquire(timeout=1)
+    finally:
+        pool.shutdown()
+
+
+def test_other_files_survive_a_pool_restart(monkeypatch, tmp_path):
+    monkeypatch.setattr(storage, "page_count", _page_count)
+    monkeypatch.setattr(storage, "extract_pages", _pages)
+    monkeypatch.setattr(pool, "EXTRACT_WORKERS", 2)
+    monkeypatch.setattr(pool, "_slots", threading.BoundedSemaphore(8))
+    pool.shutdown()
+    first = pool.get_pool()
+    errors = []
+
+    def extract_hung():
+        try:
+            pool.extract_text(tmp_path / "hang.pdf", timeout=1)
+        except TimeoutError as e:
+            errors.append(e)
+
+    try:
+        # one worker hangs on hang.pdf, the other is busy with slow.pdf past the timeout and the
+        # rest queue up: queued files move to the new pool, slow.pdf finishes in the old one
+        hung = threading.Thread(target=extract_hung)
+        hung.start()
+        time.sleep(0.2)
+        names = ("slow.pdf",) + tuple(f"{i}.pdf" for i in range(6))
+        others = [pool.submit_extract(tmp_path / name) for name in names]
+        hung.join()
+        assert errors and pool.get_pool() is not first
+        assert [f.result(timeout=30) for f in others] == [storage.join_pages([f"text of {n}"]) for n in names]
+    finally:
+        pool.shutdown()
+
+
+class _FailingPool(ThreadPoolExecutor):
+    """Refuses the `fail_at`-th submission, like a pool shut down halfway through a file."""
+
+    def __init__(self, fail_at):
+        super().__init__(max_workers=2)
+        self.calls = 0
+        self.fail_at = fail_at
+
+    def submit(self, fn, *args):
+        self.calls += 1
+        if self.calls == self.fail_at:
+            raise RuntimeError("cannot schedule new futures after shutdown")
+        return super().submit(fn, *args)
+
+
+def test_failed_part_submission_returns_the_slot(monkeypatch, tmp_path):
+    monkeypatch.setattr(storage, "page_count", lambda path: 3)
+    monkeypatch.setattr(storage, "extract_pages", lambda path, a, b: ["page"] * (b - a))
+    monkeypatch.setattr(pool, "PAGES_PER_TASK", 1)
+    monkeypatch.setattr(pool, "_slots", threading.BoundedSemaphore(1))
+    executor = _FailingPool(fail_at=3)
+    monkeypatch.setattr(pool, "get_pool", lambda: executor)
+    try:
+        with pytest.raises(RuntimeError):
+            pool.extract_text(tmp_path / "a.pdf", timeout=10)
+        assert pool._slots.acquire(timeout=10)
+    finally:
+        executor.shutdown()
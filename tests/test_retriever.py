@@ -0,0 +1,339 @@
+import time
+
+import pytest
+
+from app import retriever, storage
+
+DOCS = {
+    "doc-a": "This Agreement shall be governed by the laws of the State of New York.",
+    "doc-b": "Either party may terminate this Agreement for convenience with 30 days notice.",
+    "doc-c": "The Supplier shall indemnify the Customer against all third party claims.",
+}
+
+
+def _use_docs(monkeypatch, docs):
+    monkeypatch.setattr(storage, "iter_doc_texts",
+                        lambda doc_ids=None: [(d, docs[d]) for d in (docs if doc_ids is None else doc_ids)])
+    monkeypatch.setattr(storage, "load_text_span", lambda doc_id, start, end: docs[doc_id][start:end])
+
+
+def test_add_documents_appends_without_rebuild(monkeypatch):
+    docs = {"doc-a": DOCS["doc-a"], "doc-b": DOCS["doc-b"]}
+    _use_docs(monkeypatch, docs)
+    retriever.init_index()
+
+    docs["doc-c"] = DOCS["doc-c"]
+    monkeypatch.setattr(retriever, "init_index", lambda: (_ for _ in ()).throw(AssertionError("full rebuild")))
+    retriever.add_documents(["doc-c"])
+
+    res = retriever.answer_question("who has to indemnify third party claims?", top_k=1)
+    assert res["citations"][0]["document_id"] == "doc-c"
+    res = retriever.answer_question("terminate for convenience", top_k=1, document_id="doc-b")
+    assert res["citations"][0]["document_id"] == "doc-b"
+
+
+def test_incremental_ranking_matches_full_build(monkeypatch):
+    _use_docs(monkeypatch, DOCS)
+    retriever.init_index()
+    full = retriever.answer_question("laws of New York", top_k=3)
+
+    _use_docs(monkeypatch, {"doc-a": DOCS["doc-a"]})
+    retriever.init_index()
+    _use_docs(monkeypatch, DOCS)
+    retriever.add_documents(["doc-b", "doc-c"])
+    incremental = retriever.answer_question("laws of New York", top_k=3)
+
+    assert [c["document_id"] for c in incremental["citations"]] == [c["document_id"] for c in full["citations"]]
+
+
+def test_snapshot_roundtrip(monkeypatch, tmp_path):
+    _use_docs(monkeypatch, DOCS)
+    mtimes = {d: 1.0 for d in DOCS}
+    monkeypatch.setattr(storage, "doc_mtimes", lambda: dict(mtimes))
+    monkeypatch.setattr(retriever, "INDEX_DIR", tmp_path / "index")
+    retriever.load_or_build_index()
+    expected = retriever.answer_question("indemnify third party claims", top_k=2)
+
+    retriever.invalidate_index()
+    monkeypatch.setattr(retriever, "init_index", lambda: (_ for _ in ()).throw(AssertionError("full rebuild")))
+    assert retriever.load_snapshot()
+    assert retriever.answer_question("indemnify third party claims", top_k=2) == expected
+
+    # a changed document makes the snapshot stale
+    mtimes["doc-a"] = 2.0
+    retriever.invalidate_index()
+    assert not retriever.load_snapshot()
+
+
+def test_batch_answers_match_single_questions(monkeypatch):
+    _use_docs(monkeypatch, DOCS)
+    retriever.init_index()
+    questions = ["laws of New York", "terminate for convenience", "indemnify third party claims"]
+    batch = retriever.answer_questions(questions, top_k=2)
+    assert batch == [retriever.answer_question(q, top_k=2) for q in questions]
+    assert [r["citations"][0]["document_id"] for r in batch] == ["doc-a", "doc-b", "doc-c"]
+
+
+def test_wide_batches_are_scored_in_column_groups(monkeypatch):
+    _use_docs(monkeypatch, DOCS)
+    retriever.init_index()
+    queries = retriever._query_vectors(["laws of New York", "terminate for convenience", "indemnify claims"])
+    whole = retriever._rank(queries, top_k=2)
+    # every query alone already exceeds a budget of one non-zero
+    monkeypatch.setattr(retriever, "SCORE_NNZ_BUDGET", 1)
+    assert len(retriever._query_groups(queries, 3)) == 3
+    split = retriever._rank(queries, top_k=2)
+    assert [(list(r), list(s)) for r, s in split] == [(list(r), list(s)) for r, s in whole]
+
+
+def test_sharded_ranking_matches_single_shard(monkeypatch, tmp_path):
+    questions = ["laws of New York", "terminate for convenience", "indemnify third party claims"]
+    _use_docs(monkeypatch, DOCS)
+    retriever.init_index()
+    single = retriever.answer_questions(questions, top_k=3)
+    one_doc = retriever.answer_question("claims", top_k=2, document_id="doc-c")
+
+    # one document per shard, scored on the search threads
+    monkeypatch.setattr(retriever, "INDEX_SHARD_ROWS", 1)
+    monkeypatch.setattr(retriever, "SEARCH_THREADS", 4)
+    retriever.init_index()
+    assert retriever.index_stats()["shards"] == 3
+    assert retriever.answer_questions(questions, top_k=3) == single
+    assert retriever.answer_question("claims", top_k=2, document_id="doc-c") == one_doc
+
+    # appends open a new shard once the newest is full
+    _use_docs(monkeypatch, {"doc-a": DOCS["doc-a"], "doc-b": DOCS["doc-b"]})
+    retriever.init_index()
+    _use_docs(monkeypatch, DOCS)
+    retriever.add_documents(["doc-c"])
+    assert retriever.index_stats()["shards"] == 3
+    single = retriever.answer_questions(questions, top_k=3)
+    assert [r["citations"][0]["document_id"] for r in single] == ["doc-a", "doc-b", "doc-c"]
+
+    # a snapshot keeps the shards, and the next one links the unchanged files
+    monkeypatch.setattr(storage, "doc_mtimes", lambda: {d: 1.0 for d in DOCS})
+    monkeypatch.setattr(retriever, "INDEX_DIR", tmp_path / "index")
+    inode = (retriever.save_snapshot() / "shard-0000" / "data.npy").stat().st_ino
+    assert (retriever.save_snapshot() / "shard-0000" / "data.npy").stat().st_ino == inode
+    retriever.invalidate_index()
+    assert retriever.load_snapshot()
+    assert retriever.index_stats()["shards"] == 3
+    assert retriever.answer_questions(questions, top_k=3) == single
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_dense_backend_embeds_only_new_chunks(monkeypatch, tmp_path):
+    pytest.importorskip("faiss")
+    from app import db, dense, llm
+
+    # dense state is module-global; restore it after the test
+    for name in ("_index", "_kind", "_rows", "_build_id", "_model", "_active", "_ready"):
+        monkeypatch.setattr(dense, name, getattr(dense, name))
+
+    vocab = ["law", "terminate", "indemnify"]
+    embedded = []
+
+    def fake_embed(texts):
+        embedded.extend(texts)
+        return [[1.0 + 5 * (w in t.lower()) for w in vocab] for t in texts]
+
+    docs = {"doc-a": DOCS["doc-a"], "doc-b": DOCS["doc-b"]}
+    _use_docs(monkeypatch, docs)
+    monkeypatch.setattr(storage, "load_text", lambda doc_id: docs[doc_id])
+    monkeypatch.setattr(llm, "available", lambda: True)
+    monkeypatch.setattr(llm, "embedding_model", lambda: "fake")
+    monkeypatch.setattr(llm, "embed_texts", fake_embed)
+    monkeypatch.setattr(retriever, "INDEX_DIR", tmp_path / "index")
+    retriever.init_index()
+
+    # the first query starts a background build instead of embedding inside the request
+    with pytest.raises(dense.DenseUnavailable):
+        retriever.answer_question("terminate", top_k=1, backend="dense")
+    _wait_for(lambda: dense.index_stats()["ready"])
+    res = retriever.answer_question("terminate", top_k=1, backend="dense")
+    assert res["citations"][0]["document_id"] == "doc-b"
+
+    docs["doc-c"] = DOCS["doc-c"]
+    retriever.add_documents(["doc-c"])
+    embedded.clear()
+    dense.sync_if_active()
+    _wait_for(lambda: dense.index_stats()["vectors"] == 3)
+    res = retriever.answer_question("indemnify", top_k=1, backend="dense")
+    assert res["citations"][0]["document_id"] == "doc-c"
+    assert embedded == [DOCS["doc-c"], "indemnify"]
+    # questions are embedded on every query but never written to the chunk cache
+    assert db.get_embeddings("fake", {dense.chunk_hash("indemnify")}) == {}
+
+    res = retriever.answer_question("indemnify", top_k=1, document_id="doc-a", backend="dense")
+    assert res["citations"][0]["document_id"] == "doc-a"
+
+
+def test_dense_ivf_starts_flat_and_is_retrained(monkeypatch):
+    pytest.importorskip("faiss")
+    from app import dense
+
+    monkeypatch.setattr(dense, "DENSE_INDEX_KIND", "ivf")
+    monkeypatch.setattr(dense, "DENSE_IVF_LISTS", 4)
+    assert dense._resolve_kind(3) == "flat"
+    assert dense._resolve_kind(4) == "ivf"
+
+
+def test_hybrid_reranks_sparse_candidates(monkeypatch):
+    from app import llm
+
+    docs = {
+        "doc-a": "Termination. This agreement ends on the stated date unless renewed.",
+        "doc-b": "Either party may terminate this agreement with notice.",
+    }
+    embedded = []
+
+    def fake_embed(texts):
+        embedded.extend(texts)
+        return [[1.0, 5.0 * ("ends" in t or "end" in t.split())] for t in texts]
+
+    _use_docs(monkeypatch, docs)
+    monkeypatch.setattr(llm, "available", lambda: True)
+    monkeypatch.setattr(llm, "embedding_model", lambda: "fake-hybrid")
+    monkeypatch.setattr(llm, "embed_texts", fake_embed)
+    retriever.init_index()
+
+    sparse = retriever.answer_question("when does the agreement end", top_k=1)
+    res = retriever.answer_question("when does the agreement end", top_k=1, backend="hybrid", candidates=2)
+    assert sparse["citations"][0]["document_id"] == "doc-b"
+    assert res["citations"][0]["document_id"] == "doc-a"
+    assert res["retrieval"]["candidates"] == 2
+    assert {"sparse_ms", "fetch_ms", "embed_ms"} <= set(res["retrieval"])
+    # only the candidates and the question were embedded
+    assert sorted(embedded) == sorted(list(docs.values()) + ["when does the agreement end"])
+
+
+def test_repeated_questions_hit_cache_until_index_changes(monkeypatch):
+    docs = {"doc-a": DOCS["doc-a"], "doc-b": DOCS["doc-b"]}
+    _use_docs(monkeypatch, docs)
+    retriever.init_index()
+    before = retriever.cache_stats()
+
+    first = retriever.answer_question("Who has to indemnify?", top_k=1)
+    assert retriever.answer_question("  who has to INDEMNIFY ", top_k=1) == first
+    stats = retriever.cache_stats()
+    assert (stats["hits"] - before["hits"], stats["misses"] - before["misses"]) == (1, 1)
+
+    docs["doc-c"] = DOCS["doc-c"]
+    retriever.add_documents(["doc-c"])
+    res = retriever.answer_question("who has to indemnify", top_k=1)
+    assert res["citations"][0]["document_id"] == "doc-c"
+    assert retriever.cache_stats()["misses"] - before["misses"] == 2
+
+
+def test_idf_refresh_invalidates_cached_answers(monkeypatch):
+    docs = {"doc-a": DOCS["doc-a"], "doc-b": DOCS["doc-b"]}
+    _use_docs(monkeypatch, docs)
+    retriever.init_index()
+    docs["doc-c"] = DOCS["doc-c"]
+    retriever.add_documents(["doc-c"])
+
+    # this query re-weights the index with the new IDF; its answer was scored
+    # with the new weights but cached before the refresh, so it is not reused
+    generation = retriever.index_stats()["generation"]
+    before = retriever.cache_stats()
+    retriever.answer_question("who has to indemnify", top_k=1)
+    assert retriever.index_stats()["generation"] == generation + 1
+    retriever.answer_question("who has to indemnify", top_k=1)
+    retriever.answer_question("who has to indemnify", top_k=1)
+    stats = retriever.cache_stats()
+    assert (stats["hits"] - before["hits"], stats["misses"] - before["misses"]) == (1, 2)
+
+
+def test_chunks_follow_sections_and_pages(monkeypatch):
+    from app import chunking
+
+    body = "The Supplier shall deliver the goods in good order. " * 8
+    text = storage.join_pages([
+        "MASTER AGREEMENT\n\n1. Delivery\n" + body,
+        "2. Termination\nEither party may terminate for convenience. " + body + "\n\n3. Liability\n" + body,
+    ])
+    spans = chunking.chunk_spans(text)
+    chunks = [text[s:e] for s, e in spans]
+    assert [c.split("\n")[0] for c in chunks] == ["MASTER AGREEMENT", "2. Termination", "3. Liability"]
+    assert all(a[1] <= b[0] for a, b in zip(spans, spans[1:]))
+    assert list(chunking.page_numbers(text, [s for s, _ in spans])) == [1, 2, 2]
+
+    _use_docs(monkeypatch, {"doc-p": text})
+    retriever.init_index()
+    res = retriever.answer_question("terminate for convenience", top_k=1)
+    assert res["citations"][0]["page"] == 2
+    assert res["answer"].startswith("2. Termination")
+
+
+def test_stream_sends_citations_before_tokens_and_closes_upstream(monkeypatch):
+    from app import llm
+
+    closed = []
+
+    def fake_stream(question, snippets):
+        try:
+            for token in ["Delaware ", "law ", "applies."]:
+                yield token
+        finally:
+            closed.append(True)
+
+    _use_docs(monkeypatch, DOCS)
+    monkeypatch.setattr(llm, "stream_synthesis", fake_stream)
+    retriever.init_index()
+
+    events = list(retriever.stream_answer("laws of New York", top_k=1))
+    assert events[0].startswith(":")
+    assert events[1].startswith("data: [CITATIONS] ")
+    assert events[2:] == ["data: Delaware \n\n", "data: law \n\n", "data: applies.\n\n", "data: [DONE]\n\n"]
+
+    closed.clear()
+    gen = retriever.stream_answer("laws of New York", top_k=1)
+    for _ in range(3):
+        next(gen)
+    gen.close()
+    assert closed == [True]
+
+
+def test_stream_closes_upstream_when_the_client_goes_away(monkeypatch):
+    import anyio
+    from app import llm, main
+
+    closed = []
+
+    def slow_stream(question, snippets):
+        try:
+            while True:
+                time.sleep(0.05)
+                yield "token "
+        finally:
+            closed.append(True)
+
+    class Client:
+        async def is_disconnected(self):
+            return False
+
+    _use_docs(monkeypatch, DOCS)
+    monkeypatch.setattr(llm, "stream_synthesis", slow_stream)
+    retriever.init_index()
+
+    async def disconnect_after_a_few_events():
+        response = await main.ask_stream(Client(), "laws of New York", top_k=1, backend="tfidf")
+        async with anyio.create_task_group() as tg:
+            async def consume():
+                n = 0
+                async for _ in response.body_iterator:
+                    n += 1
+                    if n == 4:
+                        # Starlette cancels the response task like this when the client disconnects
+                        tg.cancel_scope.cancel()
+            tg.start_soon(consume)
+        # the response still references the generator, so only an explicit close ends the upstream
+        assert closed == [True]
+
+    anyio.run(disconnect_after_a_few_events)
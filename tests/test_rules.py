@@ -0,0 +1,41 @@
+import json
+import os
+
+from app import rules
+
+TEXT = "Renewal. This agreement will auto-renew unless notice is given 15 days before expiry. No cap applies to liability."
+
+
+def test_default_ruleset_findings():
+    findings = rules.run_audit_rules("doc-1", TEXT)
+    assert [(f["rule"], f["severity"]) for f in findings] == [
+        ("auto_renewal_notice", "high"), ("liability_unlimited", "high"), ("missing_confidentiality", "medium")]
+    assert findings[0]["evidence"] == "This agreement will auto-renew unless notice is given 15 days before expiry."
+    stats = rules.rule_stats()
+    assert {"_scan", "auto_renewal_notice", "broad_indemnity"} <= set(stats)
+
+
+def test_ruleset_is_reloaded_when_file_changes(monkeypatch, tmp_path):
+    path = tmp_path / "rules.json"
+    spec = {"version": "t1", "rules": [{"id": "notice_window", "any": ["notice"], "all": [["days"]], "within": 20}]}
+    path.write_text(json.dumps(spec))
+    monkeypatch.setattr(rules, "RULESET_PATH", path)
+    try:
+        assert rules.reload(force=True)
+        first = rules.RULESET_VERSION
+        assert [f["rule"] for f in rules.run_audit_rules("doc-1", TEXT)] == ["notice_window"]
+
+        spec["rules"][0]["within"] = 5
+        path.write_text(json.dumps(spec))
+        os.utime(path, ns=(0, path.stat().st_mtime_ns + 1_000_000))
+        monkeypatch.setattr(rules, "_checked_at", 0.0)
+        assert rules.run_audit_rules("doc-1", TEXT) == []
+        assert rules.RULESET_VERSION != first
+
+        # a broken file keeps the previous rules
+        path.write_text("{not json")
+        assert not rules.reload(force=True)
+        assert rules.run_audit_rules("doc-1", TEXT) == []
+    finally:
+        monkeypatch.undo()
+        rules.reload(force=True)
@@ -0,0 +1,60 @@
+import uuid
+
+from fastapi.testclient import TestClient
+
+from app import analysis, retriever, storage
+from app.main import app
+
+client = TestClient(app)
+
+CONTRACT = """Services Agreement
+This Agreement is made between {a} and {b}.
+Effective Date: {date}
+Limitation of Liability: total liability cap ${cap}.
+{renewal}
+Governing Law: {law}
+"""
+
+
+def _ingest(**fields):
+    doc_id = f"search-{uuid.uuid4()}"
+    text = CONTRACT.format(**fields)
+    storage.save_docs([(doc_id, {"filename": f"{doc_id}.pdf"}, text)])
+    storage.save_analyses(analysis.analyze(doc_id, text))
+    return doc_id
+
+
+def test_search_and_filtered_ask_use_the_field_index():
+    retriever.load_or_build_index()
+    renews = "This Agreement will auto-renew for one-year terms."
+    ny_small = _ingest(a="Zephyr Widgets Inc", b="Quokka Labs LLC", date="January 5, 2021", cap="500,000",
+                       renewal=renews, law="New York")
+    ny_large = _ingest(a="Zephyr Widgets Inc", b="Quokka Labs LLC", date="March 1, 2023", cap="2,000,000",
+                       renewal=renews, law="the State of New York")
+    delaware = _ingest(a="Zephyr Widgets Inc", b="Quokka Labs LLC", date="June 30, 2019", cap="100,000",
+                       renewal="", law="Delaware")
+    retriever.add_documents([ny_small, ny_large, delaware])
+
+    body = client.post("/search", json={"filter": {"party": "quokka"}}).json()
+    by_id = {d["document_id"]: d for d in body["documents"]}
+    assert by_id[ny_large]["governing_law"] == "New York"
+    assert by_id[ny_small]["effective_date"] == "2021-01-05"
+    assert by_id[delaware]["liability_cap"] == 100000 and not by_id[delaware]["auto_renewal"]
+
+    wanted = {"governing_law": "new york", "liability_cap": {"lt": 1000000}, "auto_renewal": True,
+              "party": "quokka"}
+    body = client.post("/search", json={"filter": wanted}).json()
+    assert [d["document_id"] for d in body["documents"]] == [ny_small]
+    body = client.post("/search", json={"filter": {"party": "quokka", "effective_date": {"lt": "2020-01-01"}}})
+    assert [d["document_id"] for d in body.json()["documents"]] == [delaware]
+
+    res = client.post("/ask", json={"question": "limitation of liability cap", "top_k": 3, "filter": wanted}).json()
+    assert {c["document_id"] for c in res["citations"]} == {ny_small}
+    # two documents that are not next to each other in the index
+    small_caps = {"party": "quokka", "liability_cap": {"lte": 500000}}
+    res = client.post("/ask", json={"question": "limitation of liability cap", "top_k": 5,
+                                    "filter": small_caps}).json()
+    assert {c["document_id"] for c in res["citations"]} == {ny_small, delaware}
+    res = client.post("/ask", json={"question": "governing law", "filter": {"party": "nobody-matches"}}).json()
+    assert res["citations"] == []
+    assert client.post("/search", json={"filter": {"effective_date": {"after": "2020"}}}).status_code == 422
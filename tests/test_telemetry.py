@@ -0,0 +1,49 @@
+from fastapi.testclient import TestClient
+
+from app import telemetry
+from app.main import app
+
+client = TestClient(app)
+
+
+def test_metrics_report_latency_histograms_and_stages():
+    assert client.post("/ask", json={"question": "Who are the parties?"}).status_code == 200
+    body = client.get("/metrics").text
+    assert 'contract_http_request_duration_seconds_count{method="POST",route="/ask",status="200"}' in body
+    assert 'contract_operations_total{kind="ask"}' in body
+    assert 'contract_index{field="chunks"}' in body
+    assert "process_resident_memory_bytes" in body
+    assert telemetry.REQUEST_LATENCY.count("POST", "/ask", "200") >= 1
+
+
+def test_histogram_buckets_are_cumulative():
+    h = telemetry.Histogram("test_seconds", "test", ("stage",), buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 5.0):
+        h.observe("x", value=v)
+    lines = list(h.render())
+    assert 'test_seconds_bucket{stage="x",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="x",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{stage="x",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="x"} 3' in lines
+
+
+def test_slow_sampled_calls_are_profiled(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(telemetry, "PROFILE_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(telemetry, "PROFILE_SLOW_MS", 0.0)
+    assert client.post("/ask", json={"question": "What is the governing law?"}).status_code == 200
+    assert [p.suffix for p in tmp_path.iterdir()] == [".prof"]
+
+
+def test_app_import_leaves_heavy_dependencies_for_first_use():
+    import subprocess
+    import sys
+    from pathlib import Path
+    code = ("import sys, app.main; from app import telemetry; "
+            "print([m for m in ('sklearn', 'fitz', 'sentence_transformers', 'requests') if m in sys.modules]); "
+            "print(telemetry.render())")
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert out.startswith("[]")
+    assert 'contract_startup_seconds{phase="import"}' in out
+    if Path("/proc/self/smaps_rollup").exists():
+        assert 'contract_process_memory_bytes{kind="pss"}' in out